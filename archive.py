@@ -0,0 +1,319 @@
+import gzip
+import hashlib
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+from conversation_index import conversation_preview
+from conversation_store import iter_messages, is_conversation_file, sync_directory
+
+
+ARCHIVE_DIR = ".clarde_archive"
+TOC_FILE = "toc.json.gz"
+# Conversations untouched this many days are archived...
+ARCHIVE_AFTER_DAYS = 30
+# ...and so are the oldest ones, while the unarchived files add up to more than this
+LOOSE_MAX_MB = 100
+# A new container is started once the current one is this big
+CONTAINER_MB = 64
+# zlib only looks at the last 32KB of a preset dictionary
+DICTIONARY_SIZE = 32 * 1024
+# What every archived conversation is made of, at the end of the dictionary
+# where zlib finds it most easily
+DICTIONARY_SEED = b'{"role":"user","content":"{"role":"assistant","content":"[{"type":"text","text":"```\\n'
+
+MAGIC = b"CLAR"
+MEMBER = struct.Struct(">4sI")  # magic, length of the JSON header that follows
+
+
+def compact_jsonl(messages):
+    return b"".join(json.dumps(m, ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b"\n"
+                    for m in messages)
+
+
+class ConversationArchive:
+    """Old conversations, compressed into a few container files.
+
+    Each conversation is one member of a container: a small JSON header
+    (name, sizes, mtime, which dictionary) and then its messages as JSONL,
+    deflated on their own with a preset dictionary shared by the whole
+    archive. Chats are small and look alike, so the shared dictionary is
+    what makes them compress well one at a time. The table of contents
+    (toc.json.gz) says where every member starts, so loading one seeks
+    there and inflates just that member. If it's lost, rebuild_toc() reads
+    it back from the member headers.
+
+    The automatic policy (see due()) archives conversations nobody touched
+    for CLARDE_ARCHIVE_AFTER_DAYS, and the oldest ones while the loose files
+    add up to more than CLARDE_ARCHIVE_MAX_MB. Setting either to 0 turns
+    that rule off. It runs in the background, so conversations are hold()
+    before they're opened, and the policy leaves those alone.
+    """
+
+    def __init__(self, directory=ARCHIVE_DIR, image_store=None, after_days=None, max_mb=None):
+        self.directory = directory
+        self.image_store = image_store  # old inline images are moved there while archiving
+        self.after = float(after_days if after_days is not None else
+                           os.getenv("CLARDE_ARCHIVE_AFTER_DAYS", ARCHIVE_AFTER_DAYS)) * 86400
+        self.max_bytes = float(max_mb if max_mb is not None else
+                               os.getenv("CLARDE_ARCHIVE_MAX_MB", LOOSE_MAX_MB)) * 1024 * 1024
+        self.toc = None
+        self.toc_mtime = None
+        self.dictionaries = {}
+        self.lock = threading.Lock()  # held while the policy runs
+        self.held = set()  # opened by someone, see hold()
+
+    @property
+    def toc_path(self):
+        return os.path.join(self.directory, TOC_FILE)
+
+    def entries(self):
+        """name -> TOC entry of every archived conversation."""
+        try:
+            mtime = os.stat(self.toc_path).st_mtime
+        except OSError:
+            mtime = None
+        if self.toc is None or mtime != self.toc_mtime:
+            # Another session may have archived something since
+            try:
+                with gzip.open(self.toc_path, 'rt', encoding='utf-8') as f:
+                    self.toc = json.load(f)["entries"]
+            except (OSError, EOFError, ValueError, KeyError):
+                # Lost or damaged, the member headers have all it said
+                self.toc = self.rebuild_toc()
+            self.toc_mtime = mtime
+        return self.toc
+
+    def __contains__(self, name):
+        return os.path.basename(name) in self.entries()
+
+    def save_toc(self, entries):
+        tmp_path = self.toc_path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(gzip.compress(json.dumps({"version": 1, "entries": entries}, ensure_ascii=False,
+                                             separators=(',', ':')).encode('utf-8')))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.toc_path)
+        sync_directory(self.toc_path)
+        self.toc = entries
+        self.toc_mtime = os.stat(self.toc_path).st_mtime
+
+    def rebuild_toc(self):
+        """Reads the table of contents back from the member headers.
+
+        Only the previews need the members themselves inflated.
+        """
+        entries = {}
+        if not os.path.isdir(self.directory):
+            return entries
+        for container in sorted(n for n in os.listdir(self.directory) if n.endswith(".clar")):
+            path = os.path.join(self.directory, container)
+            with open(path, 'rb') as f:
+                while True:
+                    head = f.read(MEMBER.size)
+                    if len(head) < MEMBER.size:
+                        break
+                    magic, length = MEMBER.unpack(head)
+                    try:
+                        if magic != MAGIC:
+                            raise ValueError(magic)
+                        header = json.loads(f.read(length))
+                    except ValueError:
+                        break  # torn write at the end, there's nothing after it
+                    header.update(container=container, offset=f.tell())
+                    f.seek(header["length"], os.SEEK_CUR)
+                    if header.get("forgotten"):
+                        entries.pop(header["name"], None)
+                    else:
+                        entries[header["name"]] = header
+        for name, entry in list(entries.items()):
+            try:
+                first = self.inflate(entry).split(b"\n", 1)[0]
+            except zlib.error:
+                del entries[name]  # cut short by the same torn write
+                continue
+            entry["preview"] = conversation_preview([json.loads(first)] if first.strip() else [])
+        return entries
+
+    def dictionary(self, dictionary_id):
+        if dictionary_id not in self.dictionaries:
+            with open(os.path.join(self.directory, f"dictionary-{dictionary_id}.bin"), 'rb') as f:
+                self.dictionaries[dictionary_id] = f.read()
+        return self.dictionaries[dictionary_id]
+
+    def current_dictionary(self, samples):
+        """Id of the archive's dictionary, made from samples the first time anything is archived.
+
+        It's never replaced afterwards, every member names the one it needs.
+        """
+        existing = [n for n in os.listdir(self.directory) if n.startswith("dictionary-")]
+        if existing:
+            return existing[0][len("dictionary-"):-len(".bin")]
+        # The start of each conversation is where they're most alike
+        data = b"".join(sample[:2048] for sample in samples)[-(DICTIONARY_SIZE - len(DICTIONARY_SEED)):]
+        data += DICTIONARY_SEED
+        dictionary_id = hashlib.sha1(data).hexdigest()[:12]
+        path = os.path.join(self.directory, f"dictionary-{dictionary_id}.bin")
+        with open(path + ".tmp", 'wb') as f:
+            f.write(data)
+        os.replace(path + ".tmp", path)
+        self.dictionaries[dictionary_id] = data
+        return dictionary_id
+
+    def container_path(self):
+        """The container new members go into, a new one once the last is full."""
+        containers = sorted(n for n in os.listdir(self.directory) if n.endswith(".clar"))
+        if containers:
+            last = os.path.join(self.directory, containers[-1])
+            if os.path.getsize(last) < CONTAINER_MB * 1024 * 1024:
+                return last
+        return os.path.join(self.directory, f"archive-{len(containers) + 1:04d}.clar")
+
+    def read_conversation(self, path):
+        messages = list(iter_messages(path))
+        if self.image_store:
+            messages = [self.image_store.dehydrate(m) for m in messages]
+        return messages
+
+    def archive(self, paths):
+        """Moves the conversation files at paths into the archive.
+
+        Returns (name, original size, archived size) for each one.
+        """
+        if not paths:
+            return []
+        os.makedirs(self.directory, exist_ok=True)
+        loaded = []
+        for path in paths:
+            stats = os.stat(path)
+            messages = self.read_conversation(path)
+            loaded.append((path, stats, messages, compact_jsonl(messages)))
+
+        dictionary_id = self.current_dictionary([data for _, _, _, data in loaded])
+        dictionary = self.dictionary(dictionary_id)
+        entries = dict(self.entries())
+        results = []
+        container = self.container_path()
+        # Unbuffered, so each member goes out in one append and tell() is where it ended
+        with open(container, 'ab', buffering=0) as f:
+            for path, stats, messages, data in loaded:
+                compressor = zlib.compressobj(9, zdict=dictionary)
+                packed = compressor.compress(data) + compressor.flush()
+                name = os.path.basename(path)
+                header = {
+                    "name": name,
+                    "length": len(packed),
+                    "size": stats.st_size,
+                    "mtime": stats.st_mtime,
+                    "dictionary": dictionary_id,
+                    "messages": len(messages),
+                }
+                encoded = json.dumps(header, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+                f.write(MEMBER.pack(MAGIC, len(encoded)) + encoded + packed)
+                entries[name] = dict(header, container=os.path.basename(container), offset=f.tell() - len(packed),
+                                     preview=conversation_preview(messages))
+                results.append((name, stats.st_size, MEMBER.size + len(encoded) + len(packed)))
+            os.fsync(f.fileno())
+
+        # Only once the archive has them for sure do the loose files go
+        self.save_toc(entries)
+        for path, _, _, _ in loaded:
+            os.remove(path)
+        return results
+
+    def read(self, name):
+        """JSONL of one archived conversation, read by seeking straight to it."""
+        entry = self.entries().get(os.path.basename(name))
+        if entry is None:
+            raise FileNotFoundError(f"{name} is not in the archive")
+        return self.inflate(entry)
+
+    def inflate(self, entry):
+        with open(os.path.join(self.directory, entry["container"]), 'rb') as f:
+            f.seek(entry["offset"])
+            packed = f.read(entry["length"])
+        decompressor = zlib.decompressobj(zdict=self.dictionary(entry["dictionary"]))
+        data = decompressor.decompress(packed) + decompressor.flush()
+        if not decompressor.eof:
+            raise zlib.error(f"{entry['name']} is cut short in {entry['container']}")
+        return data
+
+    def iter_messages(self, name):
+        for line in self.read(name).splitlines():
+            if line.strip():
+                yield json.loads(line)
+
+    def forget(self, name):
+        """Drops a conversation from the archive, e.g. once it's been restored.
+
+        Its bytes stay in the container, a tombstone member makes sure
+        rebuild_toc() won't bring it back.
+        """
+        name = os.path.basename(name)
+        entries = dict(self.entries())
+        if entries.pop(name, None) is None:
+            return
+        header = json.dumps({"name": name, "length": 0, "forgotten": True}, separators=(',', ':')).encode('utf-8')
+        with open(self.container_path(), 'ab') as f:
+            f.write(MEMBER.pack(MAGIC, len(header)) + header)
+        self.save_toc(entries)
+
+    def restore(self, name, directory="."):
+        """Writes an archived conversation back out as a .jsonl file and forgets it here."""
+        name = os.path.basename(name)
+        path = os.path.normpath(os.path.join(directory, name if name.endswith(".jsonl") else name + "l"))
+        data = self.read(name)
+        with open(path + ".tmp", 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+        self.forget(name)
+        return path
+
+    def due(self, directory=".", exclude=(), now=None):
+        """Conversation files in directory the policy says should be archived, oldest first."""
+        now = now or time.time()
+        excluded = {os.path.abspath(p) for p in exclude if p}
+        files = []
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if is_conversation_file(entry.name) and os.path.abspath(entry.path) not in excluded:
+                    stats = entry.stat()
+                    files.append((stats.st_mtime, stats.st_size, entry.path))
+        files.sort()
+
+        due = []
+        total = sum(size for _, size, _ in files)
+        for mtime, size, path in files:
+            too_old = self.after and now - mtime > self.after
+            too_much = self.max_bytes and total > self.max_bytes
+            if not (too_old or too_much):
+                break
+            due.append(path)
+            total -= size
+        return due
+
+    def hold(self, path):
+        """Keeps the automatic policy away from path from now on.
+
+        If the policy is running it waits for it, so afterwards path is
+        either still a loose file that will stay one, or already archived.
+        """
+        with self.lock:
+            self.held.add(os.path.abspath(path))
+
+    def apply_policy(self, directory=".", exclude=()):
+        with self.lock:
+            return self.archive(self.due(directory, list(exclude) + list(self.held)))
+
+    def footprint(self):
+        """(conversations, their original bytes, bytes the archive takes on disk)."""
+        entries = self.entries()
+        on_disk = 0
+        if os.path.isdir(self.directory):
+            on_disk = sum(os.path.getsize(os.path.join(self.directory, n)) for n in os.listdir(self.directory))
+        return len(entries), sum(e["size"] for e in entries.values()), on_disk
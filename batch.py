@@ -0,0 +1,216 @@
+"""Headless batch mode: python clarde.py batch in.jsonl out.jsonl
+
+Each input line is one independent conversation:
+    {"id": "q1", "prompt": "Explain decorators"}
+    {"id": "q2", "prompts": ["Write a haiku", "Now make it rhyme"], "model": "claude-3-5-sonnet-20241022"}
+
+Conversations run concurrently on a worker pool. Every finished one is
+written to the output file straight away, so an interrupted run picks up
+where it left off when started again with the same output file.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import colors
+from context import ContextManager, build_request
+from conversation_store import sync_directory
+from image_store import ImageStore
+from transport import AsyncTransport
+
+
+DEFAULT_MODEL = "claude-3-haiku-20240307"
+
+
+def read_jobs(path):
+    jobs = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            job = json.loads(line)
+            job.setdefault("id", str(line_number))
+            if "prompts" not in job:
+                job["prompts"] = [job.get("prompt", "")]
+            jobs.append(job)
+    return jobs
+
+
+def positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, not {value}")
+    return number
+
+
+def prepare_output(path):
+    """ids already answered in an existing output file. Gets the file ready to append to.
+
+    Failed ones are run again, so their records go, and so do a line cut
+    off by the interruption and any record without an id. The file is only rewritten if there's
+    something like that to drop.
+    """
+    done = set()
+    if not os.path.exists(path):
+        return done
+    kept = []
+    with open(path, 'rb') as f:
+        lines = f.readlines()
+    for line in lines:
+        try:
+            result = json.loads(line)
+        except json.JSONDecodeError:
+            continue  # cut off by the interruption
+        if not isinstance(result, dict) or result.get("id") is None:
+            continue  # can't tell which job it answers, so that job runs again
+        if "error" not in result and line.endswith(b"\n"):
+            done.add(result["id"])
+            kept.append(line)
+    if len(kept) < len(lines):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            f.writelines(kept)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        sync_directory(path)
+    return done
+
+
+class BatchRunner:
+    """Runs conversations against the API with a bounded number in flight.
+
+    Every worker goes through one transport.AsyncTransport, which retries
+    429/529/5xx and connection errors with jittered backoff, holds back
+    all the workers while a rate limit lasts, and answers from the response
+    cache when that's on.
+    """
+
+    def __init__(self, transport, concurrency=4, max_tokens=1024, model=DEFAULT_MODEL):
+        self.transport = transport
+        self.concurrency = concurrency
+        self.max_tokens = max_tokens
+        self.model = model
+        self.image_store = ImageStore()
+
+    @property
+    def retries(self):
+        return self.transport.retries
+
+    async def create(self, request):
+        return await self.transport.create(**request)
+
+    async def run_job(self, job):
+        model = job.get("model", self.model)
+        max_tokens = job.get("max_tokens", self.max_tokens)
+        context = ContextManager()
+        context.set_model(model, max_tokens)
+
+        history = []
+        responses = []
+        usage = {"input_tokens": 0, "output_tokens": 0}
+        start = time.perf_counter()
+        try:
+            for prompt in job["prompts"]:
+                history.append({"role": "user", "content": prompt})
+                response = await self.create(build_request(context, self.image_store, model, history, max_tokens))
+                text = "".join(block.text for block in response.content if block.type == "text")
+                history.append({"role": "assistant", "content": text})
+                responses.append(text)
+                usage["input_tokens"] += response.usage.input_tokens
+                usage["output_tokens"] += response.usage.output_tokens
+        except Exception as e:
+            return {"id": job["id"], "model": model, "error": str(e)}
+
+        result = {
+            "id": job["id"],
+            "model": model,
+            "response": responses[-1] if responses else "",
+            "usage": usage,
+            "latency_ms": round((time.perf_counter() - start) * 1000, 1),
+        }
+        if len(responses) > 1:
+            result["responses"] = responses
+        return result
+
+    async def run(self, jobs, out, ordered=True, on_result=None):
+        """Runs jobs, writing each result line to out. Keeps input order if ordered."""
+        queue = asyncio.Queue()
+        for index, job in enumerate(jobs):
+            queue.put_nowait((index, job))
+
+        finished = {}
+        next_index = 0
+
+        def write(result):
+            out.write(json.dumps(result, ensure_ascii=False) + "\n")
+            out.flush()
+            if on_result:
+                on_result(result)
+
+        async def worker():
+            nonlocal next_index
+            while True:
+                try:
+                    index, job = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                result = await self.run_job(job)
+                if not ordered:
+                    write(result)
+                    continue
+                # Hold on to results that finish early until their turn comes
+                finished[index] = result
+                while next_index in finished:
+                    write(finished.pop(next_index))
+                    next_index += 1
+
+        await asyncio.gather(*(worker() for _ in range(min(self.concurrency, len(jobs)) or 1)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="clarde.py batch", description="Run a JSONL file of prompts through Claude.")
+    parser.add_argument("input", help="JSONL file, one conversation per line")
+    parser.add_argument("output", help="JSONL results file, also used to resume an interrupted run")
+    parser.add_argument("-c", "--concurrency", type=positive_int, default=4, help="conversations in flight at once (default 4)")
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--max-tokens", type=int, default=1024)
+    parser.add_argument("--max-retries", type=int, default=6)
+    parser.add_argument("--unordered", action="store_true", help="write results as they finish instead of in input order")
+    parser.add_argument("--base-url", default=os.getenv("ANTHROPIC_BASE_URL"), help="API base URL, e.g. a local stub server")
+    args = parser.parse_args(argv)
+
+    jobs = read_jobs(args.input)
+    done = prepare_output(args.output)
+    todo = [job for job in jobs if job["id"] not in done]
+    if done:
+        print(colors.blue_text(f"Resuming: {len(done)} of {len(jobs)} already done."), file=sys.stderr)
+
+    # One transport for all the workers, so they share its connections and rate limit pauses
+    transport = AsyncTransport(os.getenv("ANTHROPIC_API_KEY", "stub"), base_url=args.base_url,
+                               max_retries=args.max_retries, max_delay=30.0)
+    runner = BatchRunner(transport, concurrency=args.concurrency, max_tokens=args.max_tokens, model=args.model)
+
+    failed = 0
+
+    def progress(result):
+        nonlocal failed
+        if "error" in result:
+            failed += 1
+            print(colors.Red_text(f"[{result['id']}] {result['error']}"), file=sys.stderr)
+
+    start = time.perf_counter()
+    with open(args.output, 'a', encoding='utf-8') as out:
+        try:
+            asyncio.run(runner.run(todo, out, ordered=not args.unordered, on_result=progress))
+        except KeyboardInterrupt:
+            print(colors.Red_text("\nInterrupted, run the same command again to resume."), file=sys.stderr)
+            return 130
+
+    elapsed = time.perf_counter() - start
+    print(colors.blue_text(f"Done: {len(todo) - failed} ok, {failed} failed, {runner.retries} retries "
+                           f"in {elapsed:.1f}s."), file=sys.stderr)
+    return 1 if failed else 0
@@ -0,0 +1,80 @@
+"""Disk footprint and load time of archived conversations.
+
+Writes a set of synthetic conversations to a scratch directory, archives
+them all, and compares what they take on disk and how long loading one
+takes, loose and archived. Also shows what the same members would take
+compressed without the shared dictionary.
+
+Usage: python benchmarks/archive_bench.py [--conversations 200] [--turns 20]
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import zlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from archive import ConversationArchive, compact_jsonl
+from conversation_bench import make_session
+from conversation_store import iter_messages
+
+
+def median_ms(fn, names):
+    times = []
+    for name in names:
+        start = time.perf_counter()
+        fn(name)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--conversations", type=int, default=200, help="conversations to archive")
+    parser.add_argument("--turns", type=int, default=20, help="turns per conversation")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix="clarde-archive-bench-") as directory:
+        names = []
+        for i in range(args.conversations):
+            name = f"conversation_bench_{i}.jsonl"
+            with open(os.path.join(directory, name), 'wb') as f:
+                f.write(compact_jsonl(make_session(args.turns, seed=i)))
+            names.append(name)
+        loose_bytes = sum(os.path.getsize(os.path.join(directory, n)) for n in names)
+        loose_ms = median_ms(lambda n: list(iter_messages(os.path.join(directory, n))), names)
+        without_dictionary = sum(len(zlib.compress(open(os.path.join(directory, n), 'rb').read(), 9)) for n in names)
+
+        archive = ConversationArchive(os.path.join(directory, "archive"))
+        start = time.perf_counter()
+        archive.archive([os.path.join(directory, n) for n in names])
+        archive_sec = time.perf_counter() - start
+        _, _, archived_bytes = archive.footprint()
+        archived_ms = median_ms(lambda n: list(archive.iter_messages(n)), names)
+
+    result = {
+        "conversations": args.conversations,
+        "loose_mb": loose_bytes / 1e6,
+        "archived_mb": archived_bytes / 1e6,
+        "without_dictionary_mb": without_dictionary / 1e6,
+        "archive_sec": archive_sec,
+        "loose_load_ms": loose_ms,
+        "archived_load_ms": archived_ms,
+    }
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return 0
+    print(f"{args.conversations} conversations, archived in {archive_sec:.2f}s")
+    print(f"on disk     loose {result['loose_mb']:.2f} MB | archived {result['archived_mb']:.2f} MB "
+          f"({archived_bytes / loose_bytes:.0%}) | zlib without the dictionary {result['without_dictionary_mb']:.2f} MB")
+    print(f"load one    loose {loose_ms:.2f} ms | archived {archived_ms:.2f} ms (median)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,121 @@
+"""Memory and per-turn CPU of the conversation model on long sessions.
+
+Builds a synthetic session (chat turns with code in the answers, plus a few
+imported files) twice: as the list of dicts the history used to be, and as
+a Conversation. Reports the memory each one holds, and the time per turn to
+assemble and encode the request body and to rewrite the whole save file.
+
+Usage: python benchmarks/conversation_bench.py [--turns 1000] [--repeat 20]
+"""
+import argparse
+import gc
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from context import ContextManager, build_request
+from conversation import Conversation, encode_body, encoded
+from image_store import ImageStore
+
+WORDS = "the a request cache token stream model turn file line value error python json history window".split()
+
+
+def sentence(rng, words):
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def make_session(turns, seed=1):
+    """Messages as json.loads gives them back from a save file."""
+    rng = random.Random(seed)
+    messages = []
+    for turn in range(turns):
+        if turn % 100 == 5:
+            code = "\n".join(f"    value_{i} = compute({i}, \"{rng.choice(WORDS)}\")" for i in range(400))
+            messages.append({"role": "user", "content": f"Importing file: module_{turn}.py"})
+            messages.append({"role": "assistant", "content": f"File: module_{turn}.py\n```python\n{code}\n```"})
+            continue
+        messages.append({"role": "user", "content": " ".join(sentence(rng, 12) for _ in range(rng.randint(1, 4)))})
+        answer = " ".join(sentence(rng, 15) for _ in range(rng.randint(3, 10)))
+        if turn % 3 == 0:
+            answer += "\n```python\n" + "\n".join(f"x_{i} = {i} * 2" for i in range(rng.randint(5, 30))) + "\n```"
+        messages.append({"role": "assistant", "content": answer})
+    # Round trip, so strings are laid out like ones read from disk
+    return [json.loads(json.dumps(m)) for m in messages]
+
+
+def held_memory(build):
+    gc.collect()
+    tracemalloc.start()
+    value = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return value, size
+
+
+def per_turn(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--turns", type=int, default=1000, help="turns in the session")
+    parser.add_argument("--repeat", type=int, default=20, help="times each step is timed")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args(argv)
+
+    session = make_session(args.turns)
+    text = [json.dumps(m) for m in session]
+    dicts, dict_bytes = held_memory(lambda: [json.loads(line) for line in text])
+    conversation, conversation_bytes = held_memory(lambda: Conversation(json.loads(line) for line in text))
+
+    images = ImageStore()
+    context = ContextManager()
+
+    def old_request():
+        # What the SDK had to encode on every turn
+        history = list(dicts)
+        json.dumps(dict(build_request(context, images, "bench", history), stream=True),
+                   ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+    def new_request():
+        history = list(conversation)
+        encode_body(dict(build_request(context, images, "bench", history), stream=True))
+
+    def old_save():
+        b"".join(json.dumps(m, ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b"\n" for m in dicts)
+
+    def new_save():
+        b"".join(encoded(m) + b"\n" for m in conversation)
+
+    result = {
+        "turns": args.turns,
+        "messages": len(session),
+        "dict_mb": dict_bytes / 1e6,
+        "conversation_mb": conversation_bytes / 1e6,
+        "dict_request_ms": per_turn(old_request, args.repeat) * 1000,
+        "conversation_request_ms": per_turn(new_request, args.repeat) * 1000,
+        "dict_save_ms": per_turn(old_save, args.repeat) * 1000,
+        "conversation_save_ms": per_turn(new_save, args.repeat) * 1000,
+    }
+
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return 0
+    print(f"{result['turns']} turns, {result['messages']} messages")
+    print(f"{'':16}{'list of dicts':>16}{'Conversation':>16}")
+    print(f"{'memory':16}{result['dict_mb']:>13.1f} MB{result['conversation_mb']:>13.1f} MB")
+    print(f"{'request body':16}{result['dict_request_ms']:>13.2f} ms{result['conversation_request_ms']:>13.2f} ms")
+    print(f"{'full save':16}{result['dict_save_ms']:>13.2f} ms{result['conversation_save_ms']:>13.2f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
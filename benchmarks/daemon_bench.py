@@ -0,0 +1,116 @@
+"""Load test for the session daemon against the local stub API.
+
+Starts `clarde.py serve` in a scratch directory, pointed at the stub server,
+and runs many concurrent sessions through it. Each session sends a few
+messages in a row. Reports client-side time to first token (p50/p99) next
+to the stub's own latency, the daemon's CPU time, and
+sessions per core: how many sessions like these one fully busy core would
+carry. CPU time is only counted while the sessions run, not while the
+daemon starts up.
+
+Usage: python benchmarks/daemon_bench.py [--sessions 64] [--messages 5] [--latency 0.3]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from daemon import DaemonClient
+from metrics import percentile
+from stub_server import start_stub_server
+
+
+def run_session(address, messages, ttfts, errors, start_gate):
+    client = DaemonClient(address)
+    start_gate.wait()
+    try:
+        session = client.open()
+        for i in range(messages):
+            sent = time.perf_counter()
+            first = None
+            for event in client.chat(session, f"Message {i} of a benchmark session, please echo it back."):
+                if event["type"] == "text" and first is None:
+                    first = time.perf_counter()
+                elif event["type"] == "error":
+                    errors.append(event["message"])
+            if first is not None:
+                ttfts.append(first - sent)
+        client.close(session, discard=True)
+    except Exception as e:
+        errors.append(str(e))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=64, help="concurrent sessions")
+    parser.add_argument("--messages", type=int, default=5, help="messages per session")
+    parser.add_argument("--latency", type=float, default=0.3, help="stub seconds before the first token")
+    parser.add_argument("--chunk-delay", type=float, default=0.005, help="stub seconds between deltas")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    stub = start_stub_server(latency=args.latency, chunk_delay=args.chunk_delay, chunk_size=8)
+    workdir = tempfile.TemporaryDirectory(prefix="clarde-daemon-bench-")
+    env = dict(os.environ, ANTHROPIC_BASE_URL=stub.url, ANTHROPIC_API_KEY="bench")
+    daemon = subprocess.Popen([sys.executable, os.path.join(ROOT, "clarde.py"), "serve", "--port", "0"],
+                              cwd=workdir.name, env=env, stderr=subprocess.PIPE, text=True)
+    address = daemon.stderr.readline().split()[-1]
+    # Measure a daemon that's up and connected, not one still loading the SDK
+    while not DaemonClient(address).health()["ready"]:
+        time.sleep(0.05)
+    cpu_before = DaemonClient(address).health()["cpu"]
+
+    ttfts, errors = [], []
+    start_gate = threading.Event()
+    threads = [threading.Thread(target=run_session, args=(address, args.messages, ttfts, errors, start_gate))
+               for _ in range(args.sessions)]
+    for thread in threads:
+        thread.start()
+    start = time.perf_counter()
+    start_gate.set()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - start
+    cpu = DaemonClient(address).health()["cpu"] - cpu_before
+    daemon_stats = DaemonClient(address).stats()
+
+    daemon.terminate()
+    daemon.wait()
+    workdir.cleanup()
+
+    result = {
+        "sessions": args.sessions,
+        "messages": len(ttfts),
+        "errors": len(errors),
+        "wall_sec": wall,
+        "daemon_cpu_sec": cpu,
+        "daemon_ttft_p95_ms": (daemon_stats["ttft_p95"] or 0) * 1000,
+        "stub_latency_ms": args.latency * 1000,
+        "ttft_p50_ms": (percentile(ttfts, 50) or 0) * 1000,
+        "ttft_p99_ms": (percentile(ttfts, 99) or 0) * 1000,
+        "sessions_per_core": args.sessions * wall / cpu if cpu else None,
+    }
+
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print(f"{result['sessions']} sessions, {result['messages']} messages, {result['errors']} errors "
+              f"in {wall:.1f}s")
+        print(f"time to first token  p50 {result['ttft_p50_ms']:.0f} ms  p99 {result['ttft_p99_ms']:.0f} ms  "
+              f"(stub adds {result['stub_latency_ms']:.0f} ms)")
+        print(f"daemon               {cpu:.2f}s CPU, ~{result['sessions_per_core']:.0f} sessions per core, "
+              f"its own p95 time to first token {result['daemon_ttft_p95_ms']:.0f} ms")
+    for message in errors[:5]:
+        print(f"error: {message}", file=sys.stderr)
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,168 @@
+"""In-process stand-in for the Anthropic API, for benchmarks and offline runs.
+
+FakeAPI plays the SDK client under a real transport.Transport (or
+AsyncTransport), so everything clarde does on its side of the wire still
+runs: building the request, encoding the body, the response cache and
+resuming. It answers with the event sequence the streaming API sends:
+message_start with the input usage, content_block_start, text deltas of
+chunk_size characters, content_block_stop, message_delta with the output
+tokens, and message_stop. Events are plain objects with the SDK's
+attribute names, like the ones the response cache replays. Nothing goes
+over the network, so timings are the client's own.
+
+    transport = fake_transport(reply="Hello!", chunk_size=8)
+    chatbot.transport = transport
+"""
+import asyncio
+import json
+import os
+import re
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from response_cache import ResponseCache
+from sdk import LazyClient
+from stub_server import last_user_text
+from transport import AsyncTransport, Transport
+
+
+class FakeOptions:
+    def __init__(self, reply=None, chunk_size=12, chunk_delay=0.0, latency=0.0, input_tokens=None,
+                 output_tokens=None):
+        self.reply = reply  # fixed reply text; default echoes the prompt, which means parsing the request
+        self.chunk_size = chunk_size  # characters per delta
+        self.chunk_delay = chunk_delay  # seconds between deltas
+        self.latency = latency  # seconds before the first event, or a function of the model giving them
+        self.input_tokens = input_tokens  # default: estimated from the size of the request
+        self.output_tokens = output_tokens  # default: estimated from the reply length
+
+
+def namespace(value):
+    if isinstance(value, dict):
+        return SimpleNamespace(**{k: namespace(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return [namespace(v) for v in value]
+    return value
+
+
+class FakeAPI:
+    def __init__(self, **options):
+        self.options = FakeOptions(**options)
+        self.requests = 0
+
+    def answer(self, body=None, content=None):
+        """(reply text, input tokens, output tokens, latency) for a request body, given as a dict or as bytes."""
+        self.requests += 1
+        options = self.options
+        if options.reply is not None:
+            text = options.reply
+        else:
+            request = body if body is not None else json.loads(content)
+            text = f"Echo: {last_user_text(request.get('messages', []))}"
+        input_tokens = options.input_tokens
+        if input_tokens is None:
+            input_tokens = len(content) // 4 + 1 if content is not None else len(json.dumps(body)) // 4 + 1
+        output_tokens = options.output_tokens if options.output_tokens is not None else len(text) // 4 + 1
+        latency = options.latency
+        if callable(latency):
+            # The model is one of the first fields, no need to parse the whole body for it
+            model = body.get("model") if body is not None else re.search(rb'"model":"([^"]*)"', content).group(1).decode()
+            latency = latency(model)
+        return text, input_tokens, output_tokens, latency
+
+    def events(self, answer):
+        """The stream for an answer(), as (seconds to wait first, event) pairs."""
+        text, input_tokens, output_tokens, latency = answer
+        options = self.options
+        usage = {"input_tokens": input_tokens, "output_tokens": 1,
+                 "cache_read_input_tokens": 0, "cache_creation_input_tokens": 0}
+        yield latency, namespace({"type": "message_start", "message": {
+            "id": f"msg_fake_{self.requests}", "type": "message", "role": "assistant", "model": "fake",
+            "content": [], "stop_reason": None, "usage": usage}})
+        yield 0, namespace({"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}})
+        for i in range(0, len(text), options.chunk_size):
+            yield options.chunk_delay, namespace({"type": "content_block_delta", "index": 0,
+                                                  "delta": {"type": "text_delta", "text": text[i:i + options.chunk_size]}})
+        yield 0, namespace({"type": "content_block_stop", "index": 0})
+        yield 0, namespace({"type": "message_delta", "delta": {"stop_reason": "end_turn"},
+                            "usage": {"output_tokens": output_tokens}})
+        yield 0, namespace({"type": "message_stop"})
+
+    def message(self, answer):
+        text, input_tokens, output_tokens, _ = answer
+        return namespace({
+            "id": f"msg_fake_{self.requests}", "type": "message", "role": "assistant", "model": "fake",
+            "content": [{"type": "text", "text": text}], "stop_reason": "end_turn",
+            "usage": {"input_tokens": input_tokens, "output_tokens": output_tokens,
+                      "cache_read_input_tokens": 0, "cache_creation_input_tokens": 0}})
+
+
+class FakeClient:
+    """What Transport expects of anthropic.Anthropic: post() and messages.create()."""
+
+    def __init__(self, api):
+        self.api = api
+        self.messages = SimpleNamespace(create=lambda **request: self.post("/v1/messages", body=request,
+                                                                           stream=request.get("stream", False)))
+
+    def post(self, path, *, body=None, content=None, stream=False, **options):
+        answer = self.api.answer(body, content)
+        return self.stream(answer) if stream else self.create(answer)
+
+    def stream(self, answer):
+        for delay, event in self.api.events(answer):
+            if delay:
+                time.sleep(delay)
+            yield event
+
+    def create(self, answer):
+        if answer[3]:
+            time.sleep(answer[3])
+        return self.api.message(answer)
+
+
+class FakeAsyncStream:
+    """Like the SDK's AsyncStream: iterated with async for, closed with await close()."""
+
+    def __init__(self, events):
+        self.events = events
+
+    def __aiter__(self):
+        return self.events
+
+    async def close(self):
+        await self.events.aclose()
+
+
+class FakeAsyncClient(FakeClient):
+    """The same for anthropic.AsyncAnthropic."""
+
+    async def post(self, path, *, body=None, content=None, stream=False, **options):
+        answer = self.api.answer(body, content)
+        return FakeAsyncStream(self.stream(answer)) if stream else await self.create(answer)
+
+    async def stream(self, answer):
+        for delay, event in self.api.events(answer):
+            if delay:
+                await asyncio.sleep(delay)
+            yield event
+
+    async def create(self, answer):
+        if answer[3]:
+            await asyncio.sleep(answer[3])
+        return self.api.message(answer)
+
+
+def fake_transport(transport_class=Transport, cache=None, **options):
+    """A transport_class talking to a new FakeAPI (at transport.api), with the response cache off."""
+    api = FakeAPI(**options)
+    client_class = FakeAsyncClient if issubclass(transport_class, AsyncTransport) else FakeClient
+    transport = transport_class("fake-key", cache=cache or ResponseCache(mode="off"))
+    transport.client = LazyClient(lambda: client_class(api))
+    transport.raw_body = True
+    transport.warmed.set()
+    transport.api = api
+    return transport
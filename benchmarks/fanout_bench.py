@@ -0,0 +1,98 @@
+"""Time to first token with and without fan-out, when a model has a slow tail.
+
+Runs the same prompts through fanout.Race on the in-process fake API, with
+one model at a time (off), racing all models, and hedging. The fake's time
+to first token is drawn per request: usually quick, now and then (--tail,
+as a fraction) several times slower. Reports the p50 and p95 time to first
+token as the user sees it, and how many requests each prompt cost.
+
+Usage: python benchmarks/fanout_bench.py [--prompts 60] [--tail 0.1] [--scale 0.2]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from context import MODELS
+from fake_api import fake_transport
+from fanout import FanOut, Race, model_name
+from metrics import MetricsStore, percentile
+from suite import scratch_chatbot
+from transport import AsyncTransport
+
+# (usual, slow) seconds to first token per model, before --scale
+LATENCY = {
+    "claude-3-haiku-20240307": (0.4, 2.5),
+    "claude-3-5-sonnet-20241022": (0.8, 5.0),
+}
+
+
+def first_token(race):
+    start = time.perf_counter()
+    try:
+        for event in race:
+            if event.type == "content_block_delta":
+                return time.perf_counter() - start
+    finally:
+        race.close()
+
+
+def latency_of(model, args):
+    """The usual time to first token of model, what the hedge falls back on before it has its own numbers."""
+    return LATENCY[model][0] * args.scale
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--prompts", type=int, default=60, help="prompts per policy")
+    parser.add_argument("--tail", type=float, default=0.1, help="share of requests that are slow")
+    parser.add_argument("--scale", type=float, default=0.2, help="multiplies every latency, to keep runs short")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args(argv)
+
+    primary = MODELS[-1][1]
+    request = {"max_tokens": 100, "messages": [{"role": "user", "content": "Hello"}]}
+    results = {}
+    for policy in ("off", "race", "hedge"):
+        rng = random.Random(1)  # the same draws for every policy
+
+        def latency(model):
+            usual, slow = LATENCY[model]
+            return (slow if rng.random() < args.tail else usual) * args.scale
+
+        with scratch_chatbot() as chatbot:
+            chatbot.engine.transport = fake_transport(AsyncTransport, reply="Hi there!", latency=latency)
+            metrics = MetricsStore()
+            fanout = FanOut(chatbot.engine, metrics, policy="race" if policy == "off" else policy,
+                            hedge_after=latency_of(primary, args) * 1.5)
+            ttfts, requests = [], 0
+            for _ in range(args.prompts):
+                if policy == "off":
+                    race = Race(chatbot.engine, metrics, "chat", request, [primary])
+                else:
+                    race = fanout.start("chat", request, primary)
+                ttfts.append(first_token(race))
+                requests += len(race.futures)
+        results[policy] = {
+            "ttft_p50_ms": percentile(ttfts, 50) * 1000,
+            "ttft_p95_ms": percentile(ttfts, 95) * 1000,
+            "requests_per_prompt": requests / args.prompts,
+        }
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return 0
+    print(f"{args.prompts} prompts per policy, first choice {model_name(primary)}, {args.tail:.0%} of requests slow")
+    print(f"{'':8}{'ttft p50':>12}{'ttft p95':>12}{'requests':>10}")
+    for policy, result in results.items():
+        print(f"{policy:8}{result['ttft_p50_ms']:>9.0f} ms{result['ttft_p95_ms']:>9.0f} ms"
+              f"{result['requests_per_prompt']:>10.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
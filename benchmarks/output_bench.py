@@ -0,0 +1,85 @@
+"""Throughput of the output backends on a recorded long response.
+
+Replays the recorded delta stream (--copies times over, for a long answer)
+through each backend's renderer: tty, plain and ndjson, plus what a pipe
+used to get before there were backends, the styled renderer writing
+through colorama's stdout wrapper, which stripped the codes back out.
+Reports characters per second, write syscalls and bytes written.
+
+Usage: python benchmarks/output_bench.py [deltas.jsonl] [--copies 20] [--repeat 30]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from colorama import AnsiToWin32
+import colors
+from output import NDJSONRenderer
+from renderer import MarkdownRenderer, PlainRenderer
+from render_bench import DEFAULT_STREAM, load_deltas, terminal_like
+
+
+def colorama_pipe(out):
+    return MarkdownRenderer(out=AnsiToWin32(out, strip=True).stream, styles=colors.STYLES)
+
+
+BACKENDS = {
+    "colorama": colorama_pipe,
+    "tty": lambda out: MarkdownRenderer(out=out, styles=colors.STYLES),
+    "plain": PlainRenderer,
+    "ndjson": NDJSONRenderer,
+}
+
+
+def run(name, make, deltas, repeat):
+    chars = sum(len(d) for d in deltas)
+    best = None
+    for _ in range(repeat):
+        raw, out = terminal_like()
+        start = time.perf_counter()
+        renderer = make(out)
+        for chunk in deltas:
+            renderer.feed(chunk)
+        renderer.finish()
+        out.flush()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return {
+        "backend": name,
+        "chars": chars,
+        "deltas": len(deltas),
+        "chars_per_sec": chars / best if best else float("inf"),
+        "syscalls_per_response": raw.writes,
+        "bytes_written": raw.bytes,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("stream", nargs="?", default=DEFAULT_STREAM, help="recorded delta stream (JSONL)")
+    parser.add_argument("--copies", type=int, default=20, help="times the recording is played back to back")
+    parser.add_argument("--repeat", type=int, default=30)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args(argv)
+
+    deltas = load_deltas(args.stream) * args.copies
+    results = [run(name, make, deltas, args.repeat) for name, make in BACKENDS.items()]
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return 0
+
+    print(f"{len(deltas)} deltas, {results[0]['chars']} chars")
+    for r in results:
+        print(f"{r['backend']:<10} {r['chars_per_sec']:>14,.0f} chars/sec  "
+              f"{r['syscalls_per_response']:>5} syscalls/response  {r['bytes_written']:>8} bytes")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,197 @@
+"""Replays a recorded delta stream through the response renderer.
+
+Reports characters per second and write syscalls per response for the
+incremental renderer and for the old one-print-per-segment loop, with the
+deltas fed back to back. Back to back, only the size threshold ever
+flushes, so the stream is also replayed paced like a real one: --burst
+deltas at a time with --gap seconds between bursts. That run reports the
+syscalls a response really costs, and the longest time text sat in the
+buffer before reaching the terminal.
+
+Usage: python benchmarks/render_bench.py [deltas.jsonl] [--repeat N] [--burst 4] [--gap 0.05]
+"""
+import argparse
+import bisect
+import io
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import colors
+from renderer import MarkdownRenderer
+
+DEFAULT_STREAM = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "code_heavy_response.jsonl")
+
+
+class CountingRaw(io.RawIOBase):
+    """Raw sink that counts write() calls, i.e. the syscalls a real tty would see."""
+
+    def __init__(self):
+        self.writes = 0
+        self.bytes = 0
+        self.times = []  # perf_counter() of every write
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.writes += 1
+        self.bytes += len(b)
+        self.times.append(time.perf_counter())
+        return len(b)
+
+
+def terminal_like():
+    raw = CountingRaw()
+    # Same setup Python uses for an interactive stdout
+    text = io.TextIOWrapper(io.BufferedWriter(raw), encoding="utf-8", line_buffering=True)
+    return raw, text
+
+
+def load_deltas(path):
+    deltas = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            event = json.loads(line)
+            if event.get("type") == "content_block_delta":
+                deltas.append(event["delta"]["text"])
+    return deltas
+
+
+def legacy_render(deltas, out):
+    """The per-character loop stream_chat used before the incremental renderer."""
+    def show(text):
+        if in_code_block:
+            print(colors.code_text(text), end="", flush=True, file=out)
+        elif in_bold:
+            print(colors.bold_text(text), end="", flush=True, file=out)
+        else:
+            print(colors.green_text(text), end="", flush=True, file=out)
+
+    response_content = ""
+    in_code_block = False
+    in_bold = False
+    current_text = ""
+    for chunk in deltas:
+        response_content += chunk
+        i = 0
+        while i < len(chunk):
+            if chunk[i:i+3] == "```":
+                if current_text:
+                    show(current_text)
+                current_text = ""
+                in_code_block = not in_code_block
+                i += 3
+                continue
+            if chunk[i:i+2] == "**":
+                if current_text:
+                    show(current_text)
+                current_text = ""
+                if not in_code_block:
+                    in_bold = not in_bold
+                i += 2
+                continue
+            current_text += chunk[i]
+            i += 1
+        if current_text and not (chunk.endswith("```") or chunk.endswith("**")):
+            show(current_text)
+            current_text = ""
+    if current_text:
+        show(current_text)
+
+
+def incremental_render(deltas, out):
+    parts = []
+    renderer = MarkdownRenderer(out=out)
+    for chunk in deltas:
+        parts.append(chunk)
+        renderer.feed(chunk)
+    renderer.finish()
+    "".join(parts)
+
+
+def paced_render(deltas, out, burst, gap):
+    """Feeds deltas burst at a time, gap seconds apart. Returns when each delta was fed."""
+    renderer = MarkdownRenderer(out=out)
+    fed = []
+    for i, chunk in enumerate(deltas):
+        if i and i % burst == 0:
+            time.sleep(gap)
+        fed.append(time.perf_counter())
+        renderer.feed(chunk)
+    renderer.finish()
+    return fed
+
+
+def run_paced(deltas, burst, gap):
+    raw, out = terminal_like()
+    start = time.perf_counter()
+    fed = paced_render(deltas, out, burst, gap)
+    out.flush()
+    # A delta reaches the terminal with the first write after it was fed
+    longest = max(raw.times[bisect.bisect_left(raw.times, t)] - t for t in fed)
+    return {
+        "renderer": "incremental (paced)",
+        "burst": burst,
+        "gap": gap,
+        "seconds": time.perf_counter() - start,
+        "syscalls_per_response": raw.writes,
+        "bytes_written": raw.bytes,
+        "longest_wait_ms": longest * 1000,
+    }
+
+
+def run(name, render, deltas, repeat):
+    chars = sum(len(d) for d in deltas)
+    best = None
+    for _ in range(repeat):
+        raw, out = terminal_like()
+        start = time.perf_counter()
+        render(deltas, out)
+        out.flush()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return {
+        "renderer": name,
+        "chars": chars,
+        "deltas": len(deltas),
+        "chars_per_sec": chars / best if best else float("inf"),
+        "syscalls_per_response": raw.writes,
+        "bytes_written": raw.bytes,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("stream", nargs="?", default=DEFAULT_STREAM, help="recorded delta stream (JSONL)")
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--burst", type=int, default=4, help="deltas arriving together in the paced run")
+    parser.add_argument("--gap", type=float, default=0.05, help="seconds between bursts in the paced run")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    deltas = load_deltas(args.stream)
+    results = [
+        run("legacy", legacy_render, deltas, args.repeat),
+        run("incremental", incremental_render, deltas, args.repeat),
+    ]
+    paced = run_paced(deltas, args.burst, args.gap)
+
+    if args.json:
+        print(json.dumps(results + [paced], indent=2))
+        return
+
+    print(f"{len(deltas)} deltas, {results[0]['chars']} chars")
+    for r in results:
+        print(f"{r['renderer']:<12} {r['chars_per_sec']:>14,.0f} chars/sec  "
+              f"{r['syscalls_per_response']:>5} syscalls/response  {r['bytes_written']:>7} bytes")
+    print(f"Paced, {args.burst} deltas every {args.gap * 1000:.0f}ms: {paced['syscalls_per_response']} syscalls/response, "
+          f"longest wait {paced['longest_wait_ms']:.0f}ms before reaching the terminal")
+
+
+if __name__ == "__main__":
+    main()
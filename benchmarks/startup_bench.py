@@ -0,0 +1,109 @@
+"""Times clarde's startup, from launching the process to the menu prompt.
+
+Each run starts a fresh interpreter on clarde.py with -X importtime and
+reads the milestones main() prints when CLARDE_BENCH_STARTUP is set. The
+imports that happen before the prompt are what the user waits on; the SDK
+is expected to show up under the background ones.
+
+Usage: python clarde.py --bench-startup [--runs N] [--max-prompt-ms MS] [--json]
+   or: python benchmarks/startup_bench.py ...
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CLARDE = os.path.join(ROOT, "clarde.py")
+
+# (label, from milestone, to milestone); "spawn" is when we launched the process
+PHASES = [
+    ("interpreter", "spawn", "started"),
+    ("imports", "started", "imported"),
+    ("chatbot", "imported", "chatbot"),
+    ("menu", "chatbot", "prompt"),
+    ("time to prompt", "spawn", "prompt"),
+    ("client ready", "spawn", "client"),
+]
+IMPORT_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+MILESTONE_LINE = re.compile(r"^clarde-startup (\w+) ([\d.]+)")
+
+
+def run_once():
+    """One cold start. Returns milestones and the top level imports before/after the prompt."""
+    env = dict(os.environ, CLARDE_BENCH_STARTUP="1", ANTHROPIC_API_KEY=os.getenv("ANTHROPIC_API_KEY", "bench"))
+    # In a scratch directory, so the index and such don't end up in the checkout
+    with tempfile.TemporaryDirectory(prefix="clarde-startup-") as directory:
+        spawn = time.time()
+        proc = subprocess.run([sys.executable, "-X", "importtime", CLARDE], cwd=directory, env=env,
+                              stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                              stderr=subprocess.PIPE, text=True)
+    milestones = {"spawn": spawn}
+    imports = {"before": {}, "after": {}}
+    for line in proc.stderr.splitlines():
+        match = MILESTONE_LINE.match(line)
+        if match:
+            milestones[match.group(1)] = float(match.group(2))
+            continue
+        match = IMPORT_LINE.match(line)
+        # Only modules imported directly by clarde.py (or the SDK thread),
+        # nested ones are already in their parent's cumulative time
+        if match and len(match.group(3)) == 1:
+            side = "after" if "prompt" in milestones else "before"
+            imports[side][match.group(4)] = int(match.group(2)) / 1000
+
+    missing = [name for _, start, end in PHASES for name in (start, end) if name not in milestones]
+    if missing:
+        raise RuntimeError(f"clarde.py exited with {proc.returncode} before reaching '{missing[0]}':\n{proc.stderr[-2000:]}")
+    return milestones, imports
+
+
+def summarize(runs, top):
+    phases = {label: statistics.median((m[end] - m[start]) * 1000 for m, _ in runs)
+              for label, start, end in PHASES}
+    imports = {}
+    for side in ("before", "after"):
+        names = set().union(*(i[side] for _, i in runs))
+        times = {name: statistics.median(i[side].get(name, 0.0) for _, i in runs) for name in names}
+        imports[side] = sorted(times.items(), key=lambda item: -item[1])[:top]
+    return {"runs": len(runs), "phases_ms": phases, "imports_ms": imports}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="clarde.py --bench-startup", description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=8, help="slowest imports to list")
+    parser.add_argument("--max-prompt-ms", type=float, help="exit with 1 if the median time to prompt is over this")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args(argv)
+
+    try:
+        result = summarize([run_once() for _ in range(args.runs)], args.top)
+    except RuntimeError as e:
+        print(str(e), file=sys.stderr)
+        return 2
+
+    slow = args.max_prompt_ms is not None and result["phases_ms"]["time to prompt"] > args.max_prompt_ms
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print(f"Startup, median of {result['runs']} runs:")
+        for label, ms in result["phases_ms"].items():
+            print(f"  {label:<16} {ms:>8.1f} ms")
+        for side, title in (("before", "Imports before the prompt"), ("after", "Imports in the background")):
+            print(f"\n{title}:")
+            for name, ms in result["imports_ms"][side]:
+                print(f"  {name:<24} {ms:>8.1f} ms")
+    if slow:
+        print(f"\nTime to prompt is over the {args.max_prompt_ms:.0f} ms limit.", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
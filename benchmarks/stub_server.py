@@ -0,0 +1,204 @@
+"""Local stand-in for the Anthropic Messages API.
+
+Answers POST /v1/messages, streamed (SSE) or not, by echoing the last user
+message back, so the CLI and batch mode can be exercised without network
+access or an API key. It can also misbehave on purpose, see the options.
+Connections are kept alive (streams use chunked encoding), and
+server.connections counts how many were opened, so connection reuse can
+be checked too.
+
+Usage: python benchmarks/stub_server.py [--port 8765] [--latency 0.2] [--rate-limit-every 5] [--drop-every 3]
+Then point clarde at it, e.g. ANTHROPIC_BASE_URL=http://127.0.0.1:8765
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubOptions:
+    def __init__(self, latency=0.0, chunk_delay=0.0, chunk_size=12, rate_limit_every=0,
+                 overload_every=0, reset_every=0, drop_every=0, retry_after=0.1, reply=None):
+        self.latency = latency  # seconds before the first byte
+        self.chunk_delay = chunk_delay  # seconds between streamed deltas
+        self.chunk_size = chunk_size  # characters per delta
+        self.rate_limit_every = rate_limit_every  # answer every Nth request with a 429
+        self.overload_every = overload_every  # answer every Nth request with a 529
+        self.reset_every = reset_every  # close the connection without answering every Nth request
+        self.drop_every = drop_every  # cut every Nth stream off halfway through
+        self.retry_after = retry_after
+        self.reply = reply  # fixed reply text, default echoes the prompt
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_HEAD(self):
+        # What clients send to open a connection ahead of time
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_POST(self):
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            count = server.requests
+        options = server.options
+
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+
+        if options.reset_every and count % options.reset_every == 0:
+            self.close_connection = True
+            return
+        if options.rate_limit_every and count % options.rate_limit_every == 0:
+            return self.send_error_json(429, "rate_limit_error", "Number of requests has exceeded your rate limit")
+        if options.overload_every and count % options.overload_every == 0:
+            return self.send_error_json(529, "overloaded_error", "Overloaded")
+
+        if options.latency:
+            time.sleep(options.latency)
+
+        messages = body.get("messages", [])
+        text = options.reply if options.reply is not None else f"Echo: {last_user_text(messages)}"
+        if messages and messages[-1].get("role") == "assistant":
+            # Prefilled answer, carry on from where it stops
+            prefill = messages[-1].get("content", "")
+            if isinstance(prefill, str) and text.startswith(prefill):
+                text = text[len(prefill):]
+        input_tokens = len(json.dumps(body.get("messages", []))) // 4 + 1
+        output_tokens = len(text) // 4 + 1
+        model = body.get("model", "stub-model")
+
+        if body.get("stream"):
+            drop = bool(options.drop_every and count % options.drop_every == 0)
+            self.send_stream(model, text, input_tokens, output_tokens, drop)
+        else:
+            self.send_json(200, {
+                "id": f"msg_stub_{count}",
+                "type": "message",
+                "role": "assistant",
+                "model": model,
+                "content": [{"type": "text", "text": text}],
+                "stop_reason": "end_turn",
+                "stop_sequence": None,
+                "usage": {"input_tokens": input_tokens, "output_tokens": output_tokens}
+            })
+
+    def send_json(self, status, payload, headers=None):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_error_json(self, status, kind, message):
+        self.send_json(status, {"type": "error", "error": {"type": kind, "message": message}},
+                       headers={"retry-after": str(self.server.options.retry_after)})
+
+    def send_event(self, payload):
+        data = f"event: {payload['type']}\ndata: {json.dumps(payload)}\n\n".encode("utf-8")
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def send_stream(self, model, text, input_tokens, output_tokens, drop=False):
+        options = self.server.options
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        self.send_event({"type": "message_start", "message": {
+            "id": f"msg_stub_{self.server.requests}", "type": "message", "role": "assistant", "model": model,
+            "content": [], "stop_reason": None, "stop_sequence": None,
+            "usage": {"input_tokens": input_tokens, "output_tokens": 1}
+        }})
+        self.send_event({"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}})
+        for i in range(0, len(text), options.chunk_size):
+            if drop and i >= len(text) // 2:
+                # Hang up mid-stream, like a reset connection would
+                self.close_connection = True
+                return
+            if options.chunk_delay:
+                time.sleep(options.chunk_delay)
+            self.send_event({"type": "content_block_delta", "index": 0,
+                             "delta": {"type": "text_delta", "text": text[i:i + options.chunk_size]}})
+        self.send_event({"type": "content_block_stop", "index": 0})
+        self.send_event({"type": "message_delta", "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+                         "usage": {"output_tokens": output_tokens}})
+        self.send_event({"type": "message_stop"})
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+
+def last_user_text(messages):
+    for message in reversed(messages):
+        if message.get("role") != "user":
+            continue
+        content = message.get("content", "")
+        if isinstance(content, str):
+            return content
+        return " ".join(block.get("text", "") for block in content if block.get("type") == "text")
+    return ""
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # The default backlog of 5 drops connections under load, and the
+    # client's SYN retry then shows up as a one second stall
+    request_queue_size = 256
+
+
+def start_stub_server(port=0, **options):
+    """Starts the stub on a background thread. Returns the server; its URL is server.url."""
+    server = StubServer(("127.0.0.1", port), StubHandler)
+    server.options = StubOptions(**options)
+    server.requests = 0
+    server.connections = 0
+    server.lock = threading.Lock()
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds before the first byte")
+    parser.add_argument("--chunk-delay", type=float, default=0.0, help="seconds between streamed deltas")
+    parser.add_argument("--chunk-size", type=int, default=12, help="characters per streamed delta")
+    parser.add_argument("--rate-limit-every", type=int, default=0, help="answer every Nth request with a 429")
+    parser.add_argument("--overload-every", type=int, default=0, help="answer every Nth request with a 529")
+    parser.add_argument("--reset-every", type=int, default=0, help="close the connection without answering every Nth request")
+    parser.add_argument("--drop-every", type=int, default=0, help="cut every Nth stream off halfway through")
+    parser.add_argument("--reply", default=None, help="fixed reply text instead of echoing the prompt")
+    args = parser.parse_args()
+
+    server = start_stub_server(args.port, latency=args.latency, chunk_delay=args.chunk_delay,
+                               chunk_size=args.chunk_size, rate_limit_every=args.rate_limit_every,
+                               overload_every=args.overload_every, reset_every=args.reset_every,
+                               drop_every=args.drop_every, reply=args.reply)
+    print(f"Stub API listening on {server.url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
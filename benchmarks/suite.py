@@ -0,0 +1,322 @@
+"""Offline benchmark suite for the client's hot paths, with a regression check.
+
+Runs the real ClaudeChatbot code in a scratch directory against the
+in-process fake API (fake_api.py), with the terminal swapped for a sink
+that counts writes, so nothing touches the network or the screen:
+
+  stream_chat     one chat turn, rendering a code-heavy answer streamed in
+                  chunks of 4/16/64 characters, and one on a long history
+  save / load     write_conversation and load_conversation on long histories
+  list_recent     the /recent listing over 100 to 10,000 saved files, with a
+                  cold index (first run) and a warm one
+  images          attaching an image and streaming the answer about it
+  import_file     /import of one big file and of a directory of sources
+
+Every metric is the best of --repeat runs in ms, lower is better. With a baseline the
+run fails (exit 1) when a metric got slower than the baseline by more than
+--tolerance; timings under NOISE_MS apart never count.
+
+Usage: python benchmarks/suite.py [--quick] [--only stream_chat,save] [--json]
+       python benchmarks/suite.py --update-baseline
+"""
+import argparse
+import atexit
+import builtins
+import json
+import os
+import platform
+import random
+import struct
+import sys
+import tempfile
+import time
+import zlib
+from contextlib import contextmanager
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from archive import compact_jsonl
+from clarde import ClaudeChatbot
+from context import MODELS
+from conversation import Conversation
+from conversation_bench import make_session
+from conversation_index import ConversationIndex
+from engine import result_or
+from fake_api import fake_transport
+from render_bench import DEFAULT_STREAM, load_deltas, terminal_like
+from sdk import load_sdk
+from transport import AsyncTransport
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, "baseline.json")
+# Differences smaller than this are scheduling noise, not regressions
+NOISE_MS = 0.5
+
+
+@contextmanager
+def scratch_chatbot(**options):
+    """A ClaudeChatbot in a fresh directory, on the fake API, printing into a sink."""
+    cwd = os.getcwd()
+    stdout, stdin = sys.stdout, builtins.input
+    with tempfile.TemporaryDirectory(prefix="clarde-suite-") as directory:
+        os.chdir(directory)
+        raw, sys.stdout = terminal_like()
+        builtins.input = lambda prompt="": "y"  # confirms big imports
+        chatbot = None
+        try:
+            chatbot = ClaudeChatbot("fake-key")
+            chatbot.transport = fake_transport(**options)
+            chatbot.engine.transport = fake_transport(AsyncTransport, reply="Suite Title")
+            chatbot.current_model = MODELS[0][1]
+            chatbot.context.set_model(chatbot.current_model)
+            chatbot.sink = raw
+            # Imported once here, not in the middle of something being timed
+            load_sdk()
+            yield chatbot
+        finally:
+            if chatbot is not None:
+                result_or(chatbot.title_future, 5)
+                chatbot.engine.wait_for_writes()
+                chatbot.engine.close()
+                atexit.unregister(chatbot.engine.close)  # already closed, it'd only wait on a stopped loop
+            sys.stdout.flush()
+            sys.stdout, builtins.input = stdout, stdin
+            os.chdir(cwd)
+
+
+def best_ms(fn, repeat, setup=None):
+    """Best time of fn() over repeat runs, after one untimed warm-up run.
+
+    setup(i) runs before each one, untimed. Like timeit, the best run is
+    the one least disturbed by everything else on the machine, so it's the
+    steadiest number to compare from run to run.
+    """
+    times = []
+    for i in range(repeat + 1):
+        if setup is not None:
+            setup(i)
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times[1:]) * 1000
+
+
+def fresh_history(chatbot, messages=()):
+    chatbot.engine.wait_for_writes()
+    chatbot.conversation_history = Conversation(messages)
+    chatbot.context.reset()
+    chatbot.store = None
+    chatbot.autosave_path = None
+    chatbot.title_future = None
+
+
+def bench_stream_chat(args):
+    reply = "".join(load_deltas(DEFAULT_STREAM))
+    results = {}
+    for chunk_size in (4, 16, 64):
+        with scratch_chatbot(reply=reply, chunk_size=chunk_size) as chatbot:
+            results[f"stream_chat.chunk{chunk_size}"] = best_ms(
+                lambda: chatbot.stream_chat("Show me an example"), args.repeat,
+                setup=lambda i: fresh_history(chatbot))
+            if chatbot.transport.api.requests != args.repeat + 1:
+                raise RuntimeError("stream_chat didn't reach the fake API")
+    turns = 200 if args.quick else 1000
+    history = make_session(turns)
+    with scratch_chatbot(reply=reply, chunk_size=16) as chatbot:
+        results[f"stream_chat.history{turns}"] = best_ms(
+            lambda: chatbot.stream_chat("And one more"), args.repeat,
+            setup=lambda i: fresh_history(chatbot, history))
+    return results
+
+
+def bench_save_load(args):
+    results = {}
+    for turns in ((200,) if args.quick else (1000, 5000)):
+        history = make_session(turns)
+        with scratch_chatbot() as chatbot:
+            fresh_history(chatbot, history)
+
+            def save():
+                chatbot.write_conversation("conversation_suite.jsonl")
+                chatbot.engine.wait_for_writes()
+
+            results[f"save.turns{turns}"] = best_ms(save, args.repeat)
+            results[f"load.turns{turns}"] = best_ms(
+                lambda: chatbot.load_conversation("conversation_suite.jsonl"), args.repeat)
+            if len(chatbot.conversation_history) != len(history):
+                raise RuntimeError("load_conversation lost messages")
+    return results
+
+
+def bench_list_recent(args):
+    results = {}
+    for count in ((100, 1000) if args.quick else (100, 1000, 10000)):
+        with scratch_chatbot() as chatbot:
+            data = [compact_jsonl(make_session(2, seed=i)) for i in range(50)]
+            for i in range(count):
+                with open(f"conversation_suite_{i:05d}.jsonl", 'wb') as f:
+                    f.write(data[i % len(data)])
+
+            def cold(i):
+                chatbot.index.db.close()
+                os.remove(chatbot.index.path)
+                chatbot.index = ConversationIndex(archive=chatbot.archive)
+
+            results[f"list_recent.files{count}.cold"] = best_ms(
+                chatbot.list_recent_conversations, max(1, args.repeat // 4), setup=cold)
+            results[f"list_recent.files{count}.warm"] = best_ms(chatbot.list_recent_conversations, args.repeat)
+            if chatbot.list_recent_conversations()[1] != count:
+                raise RuntimeError("list_recent_conversations missed files")
+    return results
+
+
+def png(width, height, seed):
+    """A noisy RGB PNG, which compresses about as badly as a photo."""
+    rng = random.Random(seed)
+    rows = b"".join(b"\0" + rng.randbytes(width * 3) for _ in range(height))
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(rows, 6)) + chunk(b"IEND", b""))
+
+
+def bench_images(args):
+    side = 256 if args.quick else 768
+    with scratch_chatbot(reply="A picture of noise.") as chatbot:
+        paths = []
+        for i in range(args.repeat + 1):  # and the warm-up run
+            # A new image every time, the store would only link a repeat
+            paths.append(f"suite_{i}.png")
+            with open(paths[-1], 'wb') as f:
+                f.write(png(side, side, seed=i))
+        results = {f"images.{side}px": best_ms(
+            lambda: chatbot.images(paths[len(chatbot.conversation_history) // 2], prompt="What is this?"),
+            args.repeat)}
+        if len(chatbot.conversation_history) != 2 * len(paths):
+            raise RuntimeError("images didn't add to the conversation")
+    return results
+
+
+def write_sources(directory, files, lines, seed=1):
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    for i in range(files):
+        with open(os.path.join(directory, f"module_{i}.py"), 'w', encoding='utf-8') as f:
+            for n in range(lines):
+                f.write(f"def function_{n}(value):\n    return value * {rng.randint(1, 999)} + {n}\n")
+
+
+def bench_import_file(args):
+    results = {}
+    with scratch_chatbot() as chatbot:
+        lines, files = (2000, 40) if args.quick else (12000, 150)
+        write_sources("big", 1, lines)
+        write_sources("tree", files, 150, seed=2)
+        for target, name in (("big/module_0.py", f"import_file.lines{2 * lines}"),
+                             ("tree", f"import_file.directory{files}")):
+            results[name] = best_ms(lambda: chatbot.import_file(target), args.repeat,
+                                      setup=lambda i: (fresh_history(chatbot), chatbot.importer.remember([])))
+            if not chatbot.conversation_history:
+                raise RuntimeError(f"import_file imported nothing from {target}")
+    return results
+
+
+def bench_history(args):
+    turns = 1000 if args.quick else 5000
+    results = {}
+    with scratch_chatbot() as chatbot:
+        fresh_history(chatbot, make_session(turns))
+        builtins.input = lambda prompt="": ""  # closes the pager after one page
+        results[f"history.recent.turns{turns}"] = best_ms(chatbot.show_recent_turns, args.repeat)
+        results[f"history.jump.turns{turns}"] = best_ms(lambda: chatbot.display_history(str(turns // 2)), args.repeat)
+        results[f"history.search.turns{turns}"] = best_ms(lambda: chatbot.display_history("no such words"), args.repeat,
+                                                          setup=lambda i: chatbot.history_view().hits.clear())
+        if chatbot.history_view().turn_start(turns // 2) != 2 * (turns // 2 - 1):
+            raise RuntimeError("the history view lost track of the turns")
+    return results
+
+
+BENCHMARKS = {
+    "stream_chat": bench_stream_chat,
+    "save": bench_save_load,
+    "list_recent": bench_list_recent,
+    "images": bench_images,
+    "import_file": bench_import_file,
+    "history": bench_history,
+}
+
+
+def compare(metrics, baseline, tolerance):
+    """[(metric, baseline ms, now ms)] for every metric that got slower than tolerance allows."""
+    regressions = []
+    for name, value in metrics.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        if value > before * (1 + tolerance) and value - before > NOISE_MS:
+            regressions.append((name, before, value))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--only", default="", help=f"comma separated, out of {', '.join(BENCHMARKS)}")
+    parser.add_argument("--repeat", type=int, default=None, help="runs per metric (default 15, 5 with --quick)")
+    parser.add_argument("--quick", action="store_true", help="smaller inputs, for a fast check")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="JSON results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="allowed slowdown, 0.5 = 50%%")
+    parser.add_argument("--update-baseline", action="store_true", help="write the results as the new baseline")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args(argv)
+    args.repeat = args.repeat or (5 if args.quick else 15)
+
+    names = [n.strip() for n in args.only.split(",") if n.strip()] or list(BENCHMARKS)
+    unknown = [n for n in names if n not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmark(s): {', '.join(unknown)}")
+
+    metrics = {}
+    for name in names:
+        metrics.update(BENCHMARKS[name](args))
+    result = {"python": platform.python_version(), "quick": args.quick, "repeat": args.repeat,
+              "metrics": {k: round(v, 3) for k, v in metrics.items()}}
+
+    if args.update_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, encoding='utf-8') as f:
+                baseline = json.load(f).get("metrics", {})
+        # --only updates just the metrics it ran
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(dict(result, metrics=dict(baseline, **result["metrics"])), f, indent=2, sort_keys=True)
+            f.write("\n")
+        baseline = {}
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f).get("metrics", {})
+    else:
+        baseline = {}
+
+    regressions = compare(result["metrics"], baseline, args.tolerance)
+    if args.json:
+        print(json.dumps(dict(result, regressions=[name for name, _, _ in regressions]), indent=2))
+    else:
+        for name, value in result["metrics"].items():
+            before = baseline.get(name)
+            change = f"  ({(value - before) / before:+.0%} vs baseline {before:.2f} ms)" if before else ""
+            print(f"{name:32}{value:>10.2f} ms{change}")
+        if args.update_baseline:
+            print(f"Baseline written to {args.baseline}")
+    if regressions:
+        print(f"\nREGRESSION: {len(regressions)} metric(s) more than {args.tolerance:.0%} slower than the baseline",
+              file=sys.stderr)
+        for name, before, value in regressions:
+            print(f"  {name}: {before:.2f} ms -> {value:.2f} ms", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
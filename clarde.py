@@ -1,42 +1,86 @@
-from anthropic import Anthropic
+import time
+STARTED = time.time()  # before any other import, for --bench-startup
 import colors
-import json
+import output
+from archive import ConversationArchive
+from conversation_index import ConversationIndex
+from conversation import Conversation
+from conversation_store import ConversationStore, iter_messages, is_conversation_file
+from context import ContextManager, MODELS, POLICIES, USAGE_FIELDS, build_request, estimate_tokens, message_tokens, text_of
+from metrics import MetricsStore, percentile
+from image_store import ImageStore, MEDIA_TYPES
+from engine import BackgroundEngine, result_or
+from fanout import FanOut, POLICIES as FANOUT_POLICIES, model_name, resolve_models, side_by_side
+from titles import TitleGenerator
+from importer import Importer
+from transport import Transport
+from typeahead import TypeAhead
+from priming import CachePrimer
+from history_view import CHROME_LINES, RECENT_TURNS, HistoryView, clip
+from profiler import MODES as PROFILE_MODES, Profiler, configure_from_args as profile_from_args
+from response_cache import configure_from_args
 import os
 from datetime import datetime
 import signal
+import sys
 import platform
-import glob
-from operator import itemgetter
-from typing import List, Dict
-import re
-import base64
+import shutil
+from typing import List, Dict, Tuple
+
+
+# Start on a title in the background after this many exchanges
+TITLE_AFTER_EXCHANGES = 3
+# Ask before importing anything bigger than this
+CONFIRM_IMPORT_TOKENS = 5000
+# Ends an answer that was stopped with Ctrl-C, in the history too
+INTERRUPTED_NOTE = "[answer interrupted]"
+# Set by --bench-startup in the processes it times
+BENCH_STARTUP_ENV = "CLARDE_BENCH_STARTUP"
 
 
 class ClaudeChatbot:
     def __init__(self, api_key):
-        self.anthropic = Anthropic(api_key=api_key)
-        self.conversation_history = []
+        # Not built until it's needed, or until main() starts it in the background
+        self.transport = Transport(api_key)
+        self.engine = BackgroundEngine(api_key)
+        self.metrics = MetricsStore()
+        self.fanout = FanOut(self.engine, self.metrics)
+        self.primer = CachePrimer(self.engine, self.metrics)
+        self.titles = TitleGenerator(self.engine.create_message, metrics=self.metrics)
+        self.title_future = None  # speculative title, see maybe_start_title
+        self.conversation_history = Conversation()
         self.total_tokens_used = 0
+        self.image_store = ImageStore()
+        self.archive = ConversationArchive(image_store=self.image_store)
+        self.index = ConversationIndex(archive=self.archive)
+        self.store = None  # append-only file the current conversation is autosaved to
+        self.autosave_path = None  # set when that file was started by this session
+        self.legacy_path = None  # loaded conversation still in the old .json format
+        self.archived_name = None  # loaded conversation that's still in the archive
+        self.names_given = set()  # files this session saved to, maybe still queued, see unused_name
+        self.context = ContextManager(summarize=self.summarize_text)
+        self.importer = Importer()
+        self.current_image = None  # reference block attached to the next message
+        self.typeahead = TypeAhead()
+        self.streaming = False  # an answer is coming in, Ctrl-C stops it
+        self.output = output.current()
+        self.profiler = Profiler()
+        self.view = None  # HistoryView of the conversation_history, see history_view()
 
     
     def choose_model(self):
         print(colors.blue_text("\nChoose a model:"))
-        print(f"[1] Claude (Haiku)")
-        print(f"[2] Claude (Sonnet)")
+        for number, (name, _) in enumerate(MODELS, 1):
+            print(f"[{number}] Claude ({name})")
         
         while True:
             try:
                 choice = input(colors.blue_text("Enter the number of the model you want to use: "))
-                if choice == "1":
-                    self.current_model = "claude-3-haiku-20240307"
+                if choice.strip().isdigit() and 1 <= int(choice) <= len(MODELS):
+                    name, self.current_model = MODELS[int(choice) - 1]
+                    self.context.set_model(self.current_model)
                     print()
-                    print(colors.blue_text("Using 'Claude Haiku' model."))
-                    print()
-                    break
-                elif choice == "2":
-                    self.current_model = "claude-3-5-sonnet-20241022"
-                    print()
-                    print(colors.blue_text("Using 'Claude Sonnet' model."))
+                    print(colors.blue_text(f"Using 'Claude {name}' model."))
                     print()
                     break
                 else:
@@ -44,98 +88,120 @@ class ClaudeChatbot:
             except ValueError:
                 print(colors.Red_text("Please enter a valid number."))
 
-    def list_recent_conversations(self) -> List[Dict]:
-        """Lists recent conversation files and returns them sorted by modification time."""
-        conversations = []
-        
-        # Find all conversation JSON files
-        for file in glob.glob("conversation_*.json"):
-            try:
-                stats = os.stat(file)
-                with open(file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                
-                    # Get the content from the first message
-                    if data and "content" in data[0]:
-                        message_content = data[0]["content"]
-
-                        # Handle if it's a list (image + text)
-                        if isinstance(message_content, list):
-                            # Look for the text part in the content list
-                            preview = next((item["text"] for item in message_content if item["type"] == "text"), "Image message")
-                        else:
-                            # If it's just regular text
-                            preview = message_content
-                    else:
-                        preview = "Empty conversation"
-
-                    # Truncate the preview
-                    preview = preview[:60] + "..." if len(preview) > 60 else preview
-            
-                    conversations.append({
-                    'filename': file,
-                    'modified': stats.st_mtime,
-                    'size': stats.st_size,
-                    'preview': preview
-                })
-            except Exception as e:
-                print(colors.Red_text(f"Error reading {file}: {str(e)}"))
-                continue
-    
-        return sorted(conversations, key=itemgetter('modified'), reverse=True)
+    def list_recent_conversations(self, page=0, page_size=10) -> Tuple[List[Dict], int]:
+        """Returns one page of saved conversations, newest first, and the total count."""
+        try:
+            with self.profiler.span("list_recent"):
+                return self.index.list(page, page_size)
+        except Exception as e:
+            print(colors.Red_text(f"Error listing conversations: {str(e)}"))
+            return [], 0
 
     def display_recent_conversations(self):
         """Displays recent conversations and allows user to select one to load."""
-        conversations = self.list_recent_conversations()
-        
+        page = 0
+        page_size = 10
+        conversations, total = self.list_recent_conversations(page, page_size)
+
         if not conversations:
             print(colors.blue_text("No previous conversations found."))
             return
-        
-        print(colors.blue_text("\n=== Recent Conversations ==="))
-        for i, conv in enumerate(conversations):
-            modified_time = datetime.fromtimestamp(conv['modified']).strftime('%Y/%m/%d %H:%M')
-            size_kb = conv['size'] / 1024
-            print(f"{colors.bold_text(f'[{i+1}]')} {colors.blue_text(conv['filename'])}")
-            print(f"    Modified: {modified_time} | Size: {size_kb:.1f}KB")
-            print(f"    Preview: {colors.green_text(conv['preview'])}\n")
-        
-        print(colors.blue_text("Enter the number of the conversation to load, or press Enter to cancel."))
-        
+
         while True:
-            try:
-                choice = input(colors.blue_text("Choice: ")).strip()
-                
-                if not choice:  # User pressed Enter without a choice
-                    print()
-                    print(colors.Red_text("choice canneled"))
-                    self.choose_model()
+            pages = (total + page_size - 1) // page_size
+            print(colors.blue_text(f"\n=== Recent Conversations (page {page + 1}/{pages}) ==="))
+            for i, conv in enumerate(conversations):
+                modified_time = datetime.fromtimestamp(conv['modified']).strftime('%Y/%m/%d %H:%M')
+                size_kb = conv['size'] / 1024
+                details = f"Modified: {modified_time} | Size: {size_kb:.1f}KB | Messages: {conv['message_count']}"
+                if conv['model']:
+                    details += f" | Model: {conv['model']}"
+                if conv['archived']:
+                    details += " | Archived"
+                print(f"{colors.bold_text(f'[{page * page_size + i + 1}]')} {colors.blue_text(conv['filename'])}")
+                print(f"    {details}")
+                print(f"    Preview: {colors.green_text(conv['preview'])}\n")
+
+            print(colors.blue_text("Enter the number of the conversation to load, [n]ext/[p]revious page, or press Enter to cancel."))
+
+            while True:
+                try:
+                    choice = input(colors.blue_text("Choice: ")).strip().lower()
+
+                    if not choice:  # User pressed Enter without a choice
+                        print()
+                        print(colors.Red_text("choice canneled"))
+                        self.choose_model()
+                        return
+
+                    if choice in ("n", "p"):
+                        new_page = page + 1 if choice == "n" else page - 1
+                        if 0 <= new_page < pages:
+                            page = new_page
+                            conversations, total = self.list_recent_conversations(page, page_size)
+                            break
+                        print(colors.Red_text("No more pages."))
+                        continue
+
+                    choice_num = int(choice) - page * page_size
+                    if 1 <= choice_num <= len(conversations):
+                        selected_file = conversations[choice_num-1]['filename']
+                        filename = selected_file
+                        self.load_conversation(filename)
+                        self.choose_model()
+                        self.prime_cache()
+                        self.show_recent_turns()
+                        return
+                    else:
+                        print(colors.Red_text("Invalid selection. Please try again."))
+                except ValueError:
+                    print(colors.Red_text("Please enter a valid number."))
+                except Exception as e:
+                    print(colors.Red_text(f"Error: {str(e)}"))
                     return
-                    
-                
-                choice_num = int(choice)
-                if 1 <= choice_num <= len(conversations):
-                    selected_file = conversations[choice_num-1]['filename']
-                    filename = selected_file                        
-                    self.load_conversation(filename)
-                    self.choose_model()
-                    self.display_history()
-                    break
-                else:
-                    print(colors.Red_text("Invalid selection. Please try again."))
-            except ValueError:
-                print(colors.Red_text("Please enter a valid number."))
-            except Exception as e:
-                print(colors.Red_text(f"Error: {str(e)}"))
-                break
+
+    def prime_cache(self):
+        """Warms the prompt cache on the loaded history for the chosen model, if CLARDE_PRIME is on."""
+        if self.primer.start(self.context, self.image_store, self.current_model, self.conversation_history):
+            print(colors.blue_text("Priming the prompt cache in the background..."))
 
     def load_conversation(self, filename):
         try:
-            with open(filename, 'r', encoding='utf-8') as f:
-                self.conversation_history = json.load(f)
+            start = time.perf_counter()
+            # The startup archiving may be running, make sure it leaves this one be
+            self.archive.hold(filename)
+            archived = not os.path.exists(filename) and filename in self.archive
+            if archived:
+                # Only this conversation gets read out of its container
+                messages = list(self.archive.iter_messages(filename))
+            else:
+                # Older saves have images inline as base64, move those into the image store
+                messages = [self.image_store.dehydrate(m) for m in iter_messages(filename)]
+            self.importer.remember(messages)
+            self.conversation_history = Conversation(messages)
+            self.title_future = None
+            self.context.reset()
+            if archived:
+                elapsed = (time.perf_counter() - start) * 1000
+                print(colors.blue_text(f"Loaded conversation from {filename} (from the archive in {elapsed:.0f}ms)"))
+            else:
                 print(colors.blue_text(f"Loaded conversation from {filename}"))
-                self.loaded_previous_name = True
-                self.previous_save_name = filename
+            self.loaded_previous_name = True
+            self.previous_save_name = filename
+            # Archived and old .json conversations are written out to a
+            # .jsonl file on the next exchange
+            self.archived_name = filename if archived else None
+            if archived:
+                self.store = None
+                self.legacy_path = None
+            elif filename.endswith(".json"):
+                self.store = None
+                self.legacy_path = filename
+            else:
+                self.store = ConversationStore(filename)
+                self.legacy_path = None
+            self.autosave_path = None
+            self.maybe_start_title()
         except Exception as e:
             print(colors.Red_text(f"Error loading conversation: {str(e)}"))
 
@@ -145,133 +211,232 @@ class ClaudeChatbot:
             self.handle_commands(user_input)
             return
 
+        call = None
         try:
             # If we have an attached image, include it in the message
-            content = []
-            if hasattr(self, 'current_image'):
-                content.append(self.current_image)
-            content.append({"type": "text", "text": user_input})
+            if self.current_image:
+                content = [self.current_image, {"type": "text", "text": user_input}]
+            else:
+                content = user_input
 
-            message = {
+            message = self.conversation_history.append({
                 "role": "user",
-                "content": content if hasattr(self, 'current_image') else user_input
-            }
-
-            self.conversation_history.append(message)
+                "content": content
+            })
 
-            stream = self.anthropic.messages.create(
-                max_tokens=1200,
-                model=str(self.current_model),
-                messages=self.conversation_history,
-                stream=True
-            )
+            # Waiting on priming or a summary (see build_request) can take a
+            # while too, Ctrl-C then cancels the question instead of quitting
+            self.streaming = True
+            try:
+                # A conversation that was just loaded may still be priming the cache for this turn
+                self.primer.wait()
+                with self.profiler.span("build_request"):
+                    request = build_request(self.context, self.image_store, self.current_model, self.conversation_history)
+            except KeyboardInterrupt:
+                self.output.end_answer("[cancelled]")
+                self.conversation_history.pop()
+                return
+            finally:
+                self.streaming = False
+            # The image goes with this message only, later turns see it in the history
+            self.current_image = None
 
-            response_content = ""
-            print(f"{colors.yellow_text('Claude:')} ", end="", flush=True)
-
-            in_code_block = False
-            in_bold = False
-            current_text = ""
-
-            for message in stream:
-                if message.type == "content_block_delta":
-                    chunk = message.delta.text
-                    response_content += chunk
-
-                    i = 0
-                    while i < len(chunk):
-                        # Check for code block markers
-                        if chunk[i:i+3] == "```":
-                            # Print accumulated text with current formatting
-                            if current_text:
-                                if in_code_block:
-                                    print(colors.code_text(current_text), end="", flush=True)
-                                elif in_bold:
-                                    print(colors.bold_text(current_text), end="", flush=True)
-                                else:
-                                    print(colors.green_text(current_text), end="", flush=True)
-                            current_text = ""
-                            in_code_block = not in_code_block
-                            i += 3
-                            continue
-                            
-                        # Check for bold markers
-                        if chunk[i:i+2] == "**":
-                            # Print accumulated text with current formatting
-                            if current_text:
-                                if in_code_block:
-                                    print(colors.code_text(current_text), end="", flush=True)
-                                elif in_bold:
-                                    print(colors.bold_text(current_text), end="", flush=True)
-                                else:
-                                    print(colors.green_text(current_text), end="", flush=True)
-                            current_text = ""
-                            if not in_code_block:  # Only toggle bold if not in code block
-                                in_bold = not in_bold
-                            i += 2
-                            continue
-                            
-                        current_text += chunk[i]
-                        i += 1
-
-                    # Print any remaining text if it doesn't end with a marker
-                    if current_text and not (chunk.endswith("```") or chunk.endswith("**")):
-                        if in_code_block:
-                            print(colors.code_text(current_text), end="", flush=True)
-                        elif in_bold:
-                            print(colors.bold_text(current_text), end="", flush=True)
-                        else:
-                            print(colors.green_text(current_text), end="", flush=True)
-                        current_text = ""
-
-            # Print any final remaining text
-            if current_text:
-                if in_code_block:
-                    print(colors.code_text(current_text), end="", flush=True)
-                elif in_bold:
-                    print(colors.bold_text(current_text), end="", flush=True)
+            if self.fanout.policy == "compare":
+                response_content = self.compare(request)
+                if response_content is None:
+                    self.conversation_history.pop()
+                    return
+            else:
+                if self.fanout.enabled:
+                    # Several models at once, the Race passes on the winner's stream and timing
+                    stream = call = self.fanout.start("chat", request, self.current_model)
                 else:
-                    print(colors.green_text(current_text), end="", flush=True)
+                    call = self.metrics.start("chat", self.current_model)
+                    # Retried on transient errors, and resumed if it breaks off halfway
+                    stream = self.transport.stream(**request)
 
-            print()  # New line after response
+                self.output.start_answer()
+                response_content, interrupted = self.receive(stream, call)
+                if self.fanout.enabled and call.winner:
+                    self.output.report(call.report())
+                if interrupted and not response_content:
+                    # Stopped before any of the answer came, as if it was never asked
+                    self.conversation_history.pop()
+                    return
 
-            self.conversation_history.append({
+            reply = self.conversation_history.append({
                 "role": "assistant",
                 "content": response_content
             })
+            with self.profiler.span("persist"):
+                self.persist(message, reply)
 
         except Exception as e:
-            print(colors.Red_text(f"Error: {str(e)}"))
+            self.output.error(f"Error: {str(e)}")
+            if call:
+                call.finish(error=e)
             if self.conversation_history[-1]["role"] == "user":
                 self.conversation_history.pop()
 
+    def receive(self, stream, call):
+        """Renders a streamed answer as it comes in. Returns (its text, whether it was interrupted).
+
+        Ctrl-C meanwhile (see interrupt()) hangs up on the stream, and what
+        came in so far is kept with INTERRUPTED_NOTE at the end. Whatever is
+        typed meanwhile waits for the next prompt instead of being echoed
+        into the answer.
+        """
+        response_parts = []
+        renderer = self.output.renderer()
+        interrupted = False
+        try:
+            with self.typeahead.capture():
+                self.streaming = True
+                # Time spent waiting for events is the API's, the rest is rendering
+                for event in self.profiler.waiting(stream):
+                    call.observe(event)
+                    if event.type == "content_block_delta":
+                        chunk = event.delta.text
+                        response_parts.append(chunk)
+                        renderer.feed(chunk)
+                    self.typeahead.poll()
+                self.streaming = False
+        except KeyboardInterrupt:
+            interrupted = True
+        finally:
+            self.streaming = False
+            # Closes the connection if the answer is still coming, so it stops being generated
+            stream.close()
+
+        renderer.finish()
+        text = "".join(response_parts)
+        note = None
+        if interrupted:
+            note = INTERRUPTED_NOTE if text else "[cancelled]"
+            if call.usage:
+                # The final count never came, but what we got was paid for
+                call.usage["output_tokens"] = max(call.usage["output_tokens"], estimate_tokens(text))
+            if text:
+                text += f"\n\n{INTERRUPTED_NOTE}"
+        self.output.end_answer(note)
+        self.record_call(call)
+        return text, interrupted
+
+    def compare(self, request):
+        """Asks every fan-out model at once and lets the user keep one answer. Returns it, or None."""
+        race = self.fanout.start("chat", request, self.current_model)
+        names = [model_name(model) for model in race.models]
+        print(colors.yellow_text(f"Asking {', '.join(names)}..."), flush=True)
+        self.streaming = True
+        try:
+            answers = race.answers()
+        except KeyboardInterrupt:
+            print(colors.Red_text("[cancelled]"))
+            return None
+        finally:
+            self.streaming = False
+            race.close()
+
+        columns = []
+        for number, (model, answer) in enumerate(answers, 1):
+            record = race.record(model) if not isinstance(answer, BaseException) else None
+            if record:
+                self.total_tokens_used += sum(record[field] for field in USAGE_FIELDS)
+            took = f", {record['ttft']:.2f}s to first token" if record and record["ttft"] is not None else ""
+            columns.append((f"[{number}] {model_name(model)}{took}",
+                            f"Error: {answer}" if isinstance(answer, BaseException) else answer))
+
+        lines = side_by_side(columns, shutil.get_terminal_size().columns)
+        if lines:
+            print("\n".join(lines))
+        else:
+            for title, text in columns:
+                print(colors.yellow_text(title))
+                self.output.render(text)
+                print()
+
+        choices = [i for i, (_, answer) in enumerate(answers) if not isinstance(answer, BaseException)]
+        if not choices:
+            return None
+        while True:
+            choice = input(colors.blue_text(f"Keep which answer? [1-{len(answers)}, Enter for {choices[0] + 1}] ")).strip()
+            if not choice:
+                return answers[choices[0]][1]
+            if choice.isdigit() and int(choice) - 1 in choices:
+                return answers[int(choice) - 1][1]
+            print(colors.Red_text("Please choose one of the answers."))
+
+    def fanout_command(self, args):
+        """/fanout, or '/fanout <policy> [models]'."""
+        if args:
+            policy, *names = args.split()
+            if policy not in FANOUT_POLICIES:
+                print(colors.Red_text(f"Unknown policy. Choose one of: {', '.join(FANOUT_POLICIES)}"))
+                return
+            try:
+                self.fanout.models = resolve_models(names) if names else self.fanout.models
+            except ValueError as e:
+                print(colors.Red_text(str(e)))
+                return
+            self.fanout.policy = policy
+            if self.fanout.enabled:
+                self.fanout.warm_up()
+
+        models = self.fanout.models_for(getattr(self, 'current_model', None) or MODELS[0][1])
+        print(colors.blue_text(f"Fan-out: {self.fanout.policy} | Models: {', '.join(map(model_name, models))}"))
+        threshold, based_on = self.fanout.threshold(models[0])
+        print(colors.blue_text(f"Hedge after: {threshold:.2f}s ({based_on}, {model_name(models[0])})"))
+
+    def interrupt(self, sig, frame):
+        """Ctrl-C: stops the answer that's coming in, or quits when there's none."""
+        if self.streaming:
+            self.streaming = False
+            raise KeyboardInterrupt
+        signal_handler(sig, frame)
+
     def clear_screen(self):
-        os.system('cls' if platform.system() == 'Windows' else 'clear')
+        # Only a terminal has a screen to clear, elsewhere it'd be junk in the output
+        if self.output.styled:
+            os.system('cls' if platform.system() == 'Windows' else 'clear')
 
-    def import_file(self, filename):
+    def import_file(self, target):
+        """Imports a file, a directory or a glob pattern into the conversation."""
         try:
-            with open(filename, 'r', encoding='utf-8') as f:
-                content = f.read()
-                
-            # Get the file extension
-            file_ext = filename.split('.')[-1].lower()
-            
-            # Create a message about the imported file
-            import_message = f"I've imported the file '{filename}'. Here's its content:\n\n```{file_ext}\n{content}\n```"
-            
-            # Add the import message to conversation history
-            self.conversation_history.append({
-                "role": "user",
-                "content": f"Importing file: {filename}"
-            })
-            self.conversation_history.append({
-                "role": "assistant",
-                "content": import_message
-            })
-            
-            print(colors.blue_text(f"\nSuccessfully imported {filename}"))
-            print(colors.yellow_text("Claude: "), end="")
-            print(colors.code_text(import_message))
+            files, skipped = self.importer.collect(target)
+
+            for path, reason in skipped:
+                print(colors.Red_text(f"  skipped {path}: {reason}"))
+            if not files:
+                print(colors.Red_text(f"Nothing to import from {target}"))
+                return
+
+            tokens = sum(f.tokens for f in files)
+            for f in files:
+                cut = " (truncated)" if f.truncated else ""
+                print(f"  {colors.blue_text(f.path)}  {f.size / 1024:.1f}KB, {f.lines} lines, ~{f.tokens} tokens{cut}")
+
+            # Big imports get resent with every message, so check first
+            if len(files) > 1 or tokens > CONFIRM_IMPORT_TOKENS:
+                answer = input(colors.blue_text(f"Import {len(files)} file(s), ~{tokens} tokens? [y/n] ")).strip().lower()
+                if answer != "y":
+                    print(colors.Red_text("Import cancelled."))
+                    return
+
+            names = ", ".join(f.path for f in files)
+            new_messages = [
+                {
+                    "role": "user",
+                    "content": f"Importing file: {names}"
+                },
+                {
+                    "role": "assistant",
+                    "content": self.importer.message_for(files)
+                }
+            ]
+            self.persist(*self.conversation_history.extend(new_messages))
+            self.importer.seen.update(f.digest for f in files)
+
+            print(colors.blue_text(f"\nSuccessfully imported {len(files)} file(s), ~{tokens} tokens."))
             
         except Exception as e:
             print(colors.Red_text(f"Error importing file: {str(e)}"))
@@ -280,7 +445,15 @@ class ClaudeChatbot:
         cmd = command.lower()
         if cmd == "/clear":
             self.clear_screen()
-            self.conversation_history = []
+            self.conversation_history = Conversation()
+            self.context.reset()
+            self.title_future = None
+            self.primer.forget()
+            self.importer.seen = set()
+            self.store = None
+            self.autosave_path = None
+            self.legacy_path = None
+            self.archived_name = None
             print(colors.blue_text("Conversation cleared!"))
         elif cmd == "/save":
             self.save_conversation()
@@ -289,122 +462,366 @@ class ClaudeChatbot:
         elif cmd.startswith("/load "):
             filename = command[6:].strip()
             self.load_conversation(filename)
+            self.prime_cache()
         elif cmd.startswith("/import "):
             filename = command[8:].strip()
             self.import_file(filename)
-        elif cmd == "/history":
-            self.display_history()
+        elif cmd == "/history" or cmd.startswith("/history "):
+            self.display_history(command[8:].strip())
+        elif cmd == "/archive" or cmd.startswith("/archive "):
+            self.archive_command(command[8:].strip())
+        elif cmd.startswith("/search"):
+            self.search_conversations(command[7:].strip())
         elif cmd == "/recent":  
             self.display_recent_conversations()
+        elif cmd == "/stats" or cmd.startswith("/stats "):
+            self.show_stats(command[6:].strip())
+        elif cmd == "/fanout" or cmd.startswith("/fanout "):
+            self.fanout_command(cmd[7:].strip())
+        elif cmd == "/profile" or cmd.startswith("/profile "):
+            self.profile_command(cmd[8:].strip())
+        elif cmd == "/context" or cmd.startswith("/context "):
+            self.context_command(cmd[8:].strip())
         elif cmd.startswith("/attach "):
             filename = command[8:].strip()
-            self.images(filename)
+            once = filename.startswith("--once ")
+            if once:
+                filename = filename[7:].strip()
+            self.images(filename, once=once)
         else:
             print(colors.Red_text("Unknown command. Type /help for available commands."))
 
-    def generate_conversation_title(self):
-        try:
-            # If we loaded a previous conversation, use its filename
-            #if self.loaded_previous_name == True:
-            #    return self.previous_save_name
-            
-            # Otherwise generate a new title
-            if self.anthropic:
-                analysis_prompt = {
-                    "role": "user",
-                    "content": "Based on the conversation above, generate a brief (2-5 words) title that captures the main topic. Return ONLY the title, no quotes or extra text."
-                }
+    def profile_command(self, args):
+        """/profile on [cprofile|stacks], /profile off, or /profile for the summary so far."""
+        words = args.split()
+        if words and words[0] in ("on", "off"):
+            mode = words[1] if words[0] == "on" and len(words) > 1 else words[0]
+            if mode not in PROFILE_MODES:
+                print(colors.Red_text(f"Unknown profile mode. Choose one of: {', '.join(PROFILE_MODES[1:])}"))
+                return
+            self.profiler.set_mode(mode)
+        elif words:
+            print(colors.Red_text("Usage: /profile [on [cprofile|stacks]|off]"))
+            return
 
-                # Create a temporary conversation history with the analysis prompt
-                temp_history = self.conversation_history.copy()
-                temp_history.append(analysis_prompt)
-        
-                # Get Claude's response
-                response = self.anthropic.messages.create(
-                    model="claude-3-haiku-20240307",
-                    max_tokens=20,
-                    messages=temp_history
-                )
-        
-                # Clean up the title
-                title = response.content[0].text.strip()
-                # Replace spaces with underscores and remove special characters
-                title = title.replace(' ', '_')
-                title = ''.join(c for c in title if c.isalnum() or c == '_')
-                return f"conversation_{title.lower()}.json"
-            
-            return f"conversation_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-            
-        except Exception as e:
-            print(colors.Red_text(f"Error generating title: {str(e)}"))
-            return f"conversation_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+        print(colors.blue_text(f"Profiling: {self.profiler.mode}"
+                               + (f" | Written to {self.profiler.directory}" if self.profiler.enabled else "")))
+        lines = self.profiler.summary()
+        if lines:
+            print("\n".join(lines))
+        elif not words:
+            print(colors.blue_text("Nothing profiled yet." if self.profiler.enabled else
+                                   "Turn it on with '/profile on', or start with --profile."))
+
+    def context_command(self, policy):
+        """Shows the context budget, or switches the policy used when it runs out."""
+        if policy:
+            if policy not in POLICIES:
+                print(colors.Red_text(f"Unknown policy. Choose one of: {', '.join(POLICIES)}"))
+                return
+            self.context.policy = policy
+            self.context.reset()
+            print(colors.blue_text(f"Context policy set to '{policy}'."))
+            return
+
+        used = sum(message_tokens(m) for m in self.context.window(self.conversation_history))
+        print(colors.blue_text(f"Model: {self.context.model} | Budget: {self.context.budget} tokens | "
+                               f"Next request: ~{used} tokens | Policy: {self.context.policy}"))
+
+    def summarize_text(self, prompt):
+        """Used by the 'summarize' context policy to condense older turns."""
+        call = self.metrics.start("summary", "claude-3-haiku-20240307")
+        response = self.transport.create(
+            model="claude-3-haiku-20240307",
+            max_tokens=500,
+            messages=[{"role": "user", "content": prompt}]
+        )
+        self.total_tokens_used += sum(call.finish(response)[field] for field in USAGE_FIELDS)
+        return response.content[0].text.strip()
+
+    def record_call(self, call):
+        """Records a finished streamed call and prints its one line report."""
+        record = call.finish()
+        self.total_tokens_used += sum(record[field] for field in USAGE_FIELDS)
+        self.output.usage(record, self.context.usage_report(record) if call.usage else None)
+        primed = self.primer.report(record)
+        if primed:
+            self.output.report(primed)
+
+    def show_stats(self, args=""):
+        """/stats, or '/stats export <file.jsonl|file.prom>'."""
+        if args.startswith("export"):
+            path = args[6:].strip()
+            if not path:
+                print(colors.Red_text("Usage: /stats export <file.jsonl|file.prom>"))
+                return
+            try:
+                if path.endswith(".prom"):
+                    self.metrics.export_prometheus(path)
+                    print(colors.blue_text(f"Metrics exported to {path}"))
+                else:
+                    count = self.metrics.export_jsonl(path)
+                    print(colors.blue_text(f"{count} new call{'s' if count != 1 else ''} exported to {path}"))
+            except Exception as e:
+                print(colors.Red_text(f"Error exporting metrics: {str(e)}"))
+            return
+
+        stats = self.metrics.summary()
+        if not stats["calls"]:
+            print(colors.blue_text("No API calls yet."))
+            return
+
+        def seconds(value):
+            return f"{value:.2f}s" if value is not None else "-"
+
+        print(colors.blue_text("\n=== Session Stats ==="))
+        print(f"API calls: {stats['calls']} ({stats['errors']} failed"
+              + (f", {stats['cancelled']} cancelled by fan-out" if stats['cancelled'] else "") + ")")
+        print(f"Time to first token: p50 {seconds(stats['ttft_p50'])} | p95 {seconds(stats['ttft_p95'])}")
+        models = self.metrics.models()
+        if len(models) > 1:
+            for model in models:
+                ttfts = self.metrics.model_ttfts(model)
+                print(f"  {model_name(model)}: p50 {seconds(percentile(ttfts, 50))} | "
+                      f"p95 {seconds(percentile(ttfts, 95))} ({len(ttfts)} answers)")
+        print(f"Total latency: p50 {seconds(stats['latency_p50'])} | p95 {seconds(stats['latency_p95'])}")
+        if stats["tokens_per_sec"]:
+            print(f"Output speed: {stats['tokens_per_sec']:.0f} tokens/sec")
+        print(f"Tokens: input {stats['input_tokens']} | output {stats['output_tokens']} | "
+              f"cache read {stats['cache_read_input_tokens']} | cache write {stats['cache_creation_input_tokens']}")
+        print(f"Estimated cost: ${stats['cost']:.4f}")
+        if stats["cached"]:
+            print(f"Replayed from response cache: {stats['cached']}")
+        primed = self.primer.summary()
+        if primed:
+            print(f"Cache priming: {primed[0]} loaded conversation(s), ${primed[1]:.4f} | "
+                  f"first answers ~{primed[2]:.2f}s sooner on average")
+        if self.transport.retries or self.transport.resumes:
+            print(f"Retried requests: {self.transport.retries} | Resumed streams: {self.transport.resumes}")
+        print(colors.blue_text("=====================\n"))
+
+    def maybe_start_title(self):
+        """Starts working out a title in the background once there's enough to go on."""
+        if self.title_future is None and len(self.conversation_history) >= 2 * TITLE_AFTER_EXCHANGES:
+            self.start_title()
+
+    def start_title(self):
+        # Only a short text digest goes to the API, so this is cheap to redo
+        self.title_future = self.engine.submit(self.titles.generate(list(self.conversation_history)))
+
+    def generate_conversation_title(self, timeout=10):
+        """Title for the conversation as it is now, waiting at most timeout seconds for it."""
+        title = self.titles.cached(self.conversation_history)
+        if title is None:
+            earlier = None
+            if self.title_future is None or self.title_future.done():
+                # A title worked out earlier in this conversation (the future
+                # is dropped on /clear and load), in case the new one is late
+                earlier = result_or(self.title_future, 0)
+                self.start_title()
+            title = result_or(self.title_future, timeout) or earlier
+        if title is None:
+            return None
+        return f"conversation_{title}.jsonl"
 
     def save_conversation(self, auto_save=False):
         if not self.conversation_history:
             return
             
         try:
-            # Get filename from either previous save or generate new one
-            filename = self.generate_conversation_title()
+            # Don't hold up quitting for a title, only for the write itself
+            filename = self.generate_conversation_title(timeout=0 if auto_save else 10)
+
+            if filename is None and auto_save and self.store:
+                # Already autosaved under a timestamp, that'll do
+                self.autosave_path = None
+                print(colors.blue_text(f"\nConversation saved to {self.store.path}"))
+                return
+            if filename is None:
+                filename = f"conversation_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jsonl"
             
             if not auto_save:
                 # Only prompt for new filename if this isn't an auto-save
                 user_title = input(f"{colors.blue_text('Suggested title:')} {filename}\n{colors.blue_text('Press Enter to accept or type a new title:')} ")
                 if user_title.strip():
-                    filename = f"conversation_{user_title.strip()}.json"
+                    filename = f"conversation_{user_title.strip()}.jsonl"
             
             # Ensure filename is valid
             filename = ''.join(c for c in filename if c.isalnum() or c in ('_', '-', '.'))
             
-            with open(filename, 'w', encoding='utf-8') as f:
-                json.dump(self.conversation_history, f, indent=2)
-            print(colors.blue_text(f"\nConversation saved to {filename}"))
+            self.write_conversation(filename)
             
         except Exception as e:
             print(colors.Red_text(f"Error saving conversation: {str(e)}"))
             # Fallback to timestamp if there's an error
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f"conversation_{timestamp}.json"
-            with open(filename, 'w', encoding='utf-8') as f:
-                json.dump(self.conversation_history, f, indent=2)
-            print(colors.blue_text(f"\nConversation saved to {filename}"))
+            filename = f"conversation_{timestamp}.jsonl"
+            self.write_conversation(filename)
+
+    def write_conversation(self, filename):
+        """Compacts the whole conversation into filename and keeps appending there."""
+        filename = self.unused_name(filename)
+        # The autosave file has been superseded by the named one
+        superseded = None
+        if self.store and self.store.path == self.autosave_path and os.path.abspath(self.store.path) != os.path.abspath(filename):
+            superseded = self.store.path
+
+        self.store = ConversationStore(filename)
+        self.autosave_path = None
+        self.queue_write(list(self.conversation_history), compact=True, remove=superseded)
+        self.unarchive()
+        print(colors.blue_text(f"\nConversation saved to {filename}"))
+
+    def unused_name(self, filename):
+        """filename, or filename_2, _3... if another conversation (loose or archived) already has it."""
+        ours = {os.path.abspath(path) for path in (self.store.path if self.store else None, self.archived_name) if path}
+        stem, ext = os.path.splitext(filename)
+        name, number = filename, 1
+        while os.path.abspath(name) not in ours and (os.path.abspath(name) in self.names_given
+                                                     or os.path.exists(name) or name in self.archive):
+            number += 1
+            name = f"{stem}_{number}{ext}"
+        self.names_given.add(os.path.abspath(name))
+        if name != filename:
+            print(colors.blue_text(f"{filename} is another conversation, saving as {name} instead."))
+        return name
+
+    def persist(self, *messages):
+        """Autosaves new messages, appending only them to the conversation file."""
+        remove = None
+        if self.store is None:
+            if self.archived_name:
+                # Continuing an archived conversation brings it back out under its own name
+                path = self.archived_name if self.archived_name.endswith(".jsonl") else self.archived_name + "l"
+                self.previous_save_name = path
+            elif self.legacy_path:
+                # Move an old .json conversation over to the append-only format
+                path = self.legacy_path + "l"
+                remove = self.legacy_path
+                self.previous_save_name = path
+                self.legacy_path = None
+            else:
+                path = self.unused_name(f"conversation_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jsonl")
+                self.autosave_path = path
+            self.store = ConversationStore(path)
+            self.queue_write(list(self.conversation_history), compact=True, remove=remove)
+            self.unarchive()
+        else:
+            self.queue_write(list(messages))
+        self.maybe_start_title()
+
+    def unarchive(self):
+        """Drops the loaded conversation from the archive, once the queued write has it on disk again."""
+        if self.archived_name:
+            self.engine.write(self.archive.forget, self.archived_name)
+            self.archived_name = None
+
+    def queue_write(self, messages, compact=False, remove=None):
+        """Hands a save to the background writer, the prompt comes back immediately."""
+        self.engine.write(self.write_job, self.store, messages, list(self.conversation_history),
+                          compact=compact, remove=remove,
+                          model=getattr(self, 'current_model', None), tokens=self.total_tokens_used)
+
+    def write_job(self, store, messages, history, compact=False, remove=None, model=None, tokens=0):
+        # Runs on the engine's writer thread, in the order saves were queued
+        with self.profiler.span("save"):
+            appended_to = None
+            if compact:
+                store.compact(messages)
+            else:
+                appended_to = store.append(messages)
+            if remove and os.path.exists(remove):
+                os.remove(remove)
+
+            # Keep /recent in sync without it having to read the file back
+            try:
+                self.index.update(store.path, history, model=model, tokens=tokens, appended_to=appended_to)
+            except Exception as e:
+                print(colors.Red_text(f"Error updating conversation index: {str(e)}"))
+
+    def archive_old_conversations(self):
+        # Runs on the engine's writer thread, queued at startup
+        try:
+            self.archive.apply_policy(exclude=self.open_paths())
+        except Exception as e:
+            print(colors.Red_text(f"\nError archiving conversations: {str(e)}"))
+
+    def open_paths(self):
+        """Conversation files this session is using, which are never archived."""
+        return [path for path in (self.store.path if self.store else None, self.legacy_path) if path]
+
+    def archive_command(self, args):
+        """/archive, '/archive <file>' or '/archive restore <file>'."""
+        try:
+            if args.startswith("restore "):
+                name = args[8:].strip()
+                if name not in self.archive:
+                    print(colors.Red_text(f"{name} is not in the archive."))
+                    return
+                print(colors.blue_text(f"Restored {self.archive.restore(name)}"))
+                return
+
+            if args:
+                if not os.path.exists(args) or not is_conversation_file(os.path.basename(args)):
+                    print(colors.Red_text(f"No such conversation: {args}"))
+                    return
+                if os.path.abspath(args) in map(os.path.abspath, self.open_paths()):
+                    print(colors.Red_text("That's the conversation you're in, it can't be archived right now."))
+                    return
+                paths = [args]
+            else:
+                paths = self.archive.due(exclude=self.open_paths())
+
+            # A save still queued for one of these would recreate it
+            self.engine.wait_for_writes()
+            for name, size, packed in self.archive.archive(paths):
+                print(f"  {colors.blue_text(name)}  {size / 1024:.1f}KB -> {packed / 1024:.1f}KB")
+            self.show_archive_status()
+        except Exception as e:
+            print(colors.Red_text(f"Error archiving conversations: {str(e)}"))
+
+    def show_archive_status(self):
+        archived, original, on_disk = self.archive.footprint()
+        loose = self.index.scan()
+        mb = 1024 * 1024
+        print(colors.blue_text(f"Archive: {archived} conversation(s), {original / mb:.2f}MB stored in {on_disk / mb:.2f}MB"
+                               + (f" ({on_disk / original:.0%})" if original else "")
+                               + f" | Not archived: {len(loose)} ({sum(size for _, _, size in loose) / mb:.2f}MB)"))
+        rules = []
+        if self.archive.after:
+            rules.append(f"untouched for {self.archive.after / 86400:g} days")
+        if self.archive.max_bytes:
+            rules.append(f"the oldest while the rest add up to more than {self.archive.max_bytes / mb:g}MB")
+        print(colors.blue_text("Archived automatically: " + (", and ".join(rules) if rules else "never")))
+
+    def discard_autosave(self):
+        """Deletes the autosave file started by this session, if there is one."""
+        if self.autosave_path:
+            self.engine.write(remove_file, self.autosave_path)
+        if self.store and self.store.path == self.autosave_path:
+            self.store = None
+        self.autosave_path = None
 
-    def images(self, image_path, prompt=None):
+    def images(self, image_path, prompt=None, once=False):
         try:
             if not os.path.exists(image_path):
                 print(colors.Red_text(f"Error: Image file '{image_path}' not found"))
                 return
 
-            # Get file extension and set proper media type
             ext = image_path.lower().split('.')[-1]
-            media_types = {
-                'jpg': 'image/jpeg',
-                'jpeg': 'image/jpeg',
-                'png': 'image/png',
-                'gif': 'image/gif',
-                'webp': 'image/webp'
-            }
-            media_type = media_types.get(ext)
-
-            if not media_type:
+            if ext not in MEDIA_TYPES:
                 print(colors.Red_text(f"Unsupported image format: {ext}"))
                 return
 
-            # Store image data for reuse
-            with open(image_path, 'rb') as img_file:
-                self.current_image = {
-                    "type": "image",
-                    "source": {
-                        "type": "base64",
-                        "media_type": media_type,
-                        "data": base64.b64encode(img_file.read()).decode('utf-8')
-                    }
-                }
-                self.current_image_path = image_path
+            # Stored once under its hash (downscaled if Pillow is installed),
+            # the history only keeps a reference to it
+            with self.profiler.span("image_store"):
+                self.current_image = self.image_store.add(image_path, once=once)
+            self.current_image_path = image_path
 
             # If no prompt provided, just confirm attachment
             if not prompt:
-                print(colors.blue_text(f"\nImage '{image_path}' attached. You can now ask questions about it."))
+                print(colors.blue_text(f"\nImage '{image_path}' attached to your next message. You can now ask questions about it."))
                 return
 
             # Create message with image and prompt
@@ -418,40 +835,33 @@ class ClaudeChatbot:
                     }
                 ]
             }]
+            self.current_image = None
 
             # Stream the response
-            stream = self.anthropic.messages.create(
+            call = self.metrics.start("image", self.current_model)
+            stream = self.transport.stream(
                 model=self.current_model,
                 max_tokens=1024,
-                messages=messages,
-                stream=True
+                messages=self.image_store.materialize(messages)
             )
 
-            print(f"{colors.yellow_text('Claude:')} ", end="", flush=True)
-            response_content = ""
-
-            for chunk in stream:
-                if chunk.type == "content_block_delta":
-                    text = chunk.delta.text
-                    response_content += text
-                    print(colors.green_text(text), end="", flush=True)
-
-            print()
+            self.output.start_answer()
+            response_content, interrupted = self.receive(stream, call)
+            if interrupted and not response_content:
+                return
 
             # Add to conversation history
-            self.conversation_history.extend([
-                {
-                    "role": "user",
-                    "content": f"[Image attached: {image_path}] {prompt if prompt else ''}"
-                },
+            new_messages = [
+                messages[0],  # just the image reference, not the image itself
                 {
                     "role": "assistant",
                     "content": response_content
                 }
-            ])
+            ]
+            self.persist(*self.conversation_history.extend(new_messages))
 
         except Exception as e:
-            print(colors.Red_text(f"Error processing image: {str(e)}"))
+            self.output.error(f"Error processing image: {str(e)}")
 
     def show_help(self):
         help_text = """
@@ -459,40 +869,206 @@ Available Commands:
 /clear    - Clear the conversation history and screen
 /save     - Save the current conversation to a file
 /load     - Load a conversation from a file
-/import   - Import a file (Python, JSON, etc.) into the conversation
-/history  - Display conversation history
+/import   - Import a file, directory or glob (e.g. src/*.py) into the conversation
+/history  - Page through the conversation, '/history <turn>' to jump there, '/history <words>' to search it
+/stats    - Show latency, token and cost stats ('/stats export <file.jsonl|file.prom>')
+/context  - Show context usage, or '/context <policy>' (sliding, summarize, drop-images)
+/fanout   - Ask several models at once: '/fanout <race|hedge|compare|off> [haiku sonnet]'
+/profile  - Show where the time goes, or '/profile on [cprofile|stacks]', '/profile off'
 /recent   - Show and select from recent conversations
+/search   - Search all saved conversations, e.g. '/search docker compose'
+/archive  - Archive old conversations now, or '/archive <file>', '/archive restore <file>'
+/attach   - Attach an image to your next message ('/attach --once <path>' sends it only with that message)
 /help     - Show this help message
 quit      - Exit the chat
+Ctrl-C    - Stop the answer that's coming in (at the prompt, exit)
 """
         print(colors.blue_text(help_text))
 
-    def display_history(self):
-        print(colors.blue_text("\n=== Conversation History ==="))
-        for msg in self.conversation_history:
-            role = msg["role"]
-            content = msg["content"]
-            if role == "user":
-                print(f"You: {content}")
-            else:
-                print(f"{colors.yellow_text('Claude:')} ", end="")
-                # Handle code blocks in history display
-                in_code_block = False
-                parts = content.split("```")
-                for i, part in enumerate(parts):
-                    if i % 2 == 0:  # Regular text
-                        print(colors.green_text(part), end="")
-                    else:  # Code block
-                        print(colors.code_text(part), end="")
-                print()
+    def history_view(self):
+        """The HistoryView of the current conversation, kept while it's the same one."""
+        if self.view is None or self.view.history is not self.conversation_history:
+            self.view = HistoryView(self.conversation_history)
+        return self.view
+
+    def show_recent_turns(self):
+        """The last few turns of a conversation that was just loaded, /history has the rest."""
+        if not len(self.conversation_history):
+            return
+        view = self.history_view()
+        start = view.recent_start(RECENT_TURNS)
+        turns = len(view.index())
+        rows = max(shutil.get_terminal_size().lines - CHROME_LINES, 1)
+        print(colors.blue_text(f"\n=== Last {min(turns, RECENT_TURNS)} of {turns} turns ==="))
+        for position in range(start, len(self.conversation_history)):
+            self.print_message(self.conversation_history[position], view.text(position), rows=rows)
+        if start:
+            print(colors.blue_text(f"({start} earlier messages, /history to page through them)"))
         print(colors.blue_text("========================\n"))
 
+    def display_history(self, args=""):
+        """/history: pages back from the end, '/history <turn>' starts at that turn, '/history <words>' at a match."""
+        view = self.history_view()
+        total = len(self.conversation_history)
+        if not total:
+            print(colors.blue_text("No messages yet."))
+            return
+        size = shutil.get_terminal_size()
+        rows, width = max(size.lines - CHROME_LINES, 1), size.columns
+        query = None
+        if args.isdigit():
+            start = view.turn_start(int(args))
+        elif args:
+            query = args
+            hit = view.next_hit(query, -1)
+            if hit is None:
+                print(colors.Red_text(f"No matches for '{query}' in this conversation."))
+                return
+            start = hit[0]
+        else:
+            start = view.page_before(total, rows, width)[0][0]
+
+        full = False
+        while True:
+            page = view.page_from(start, rows, width)
+            end = page[-1][0] + 1
+            title = f"turn {view.turn_of(start)}-{view.turn_of(end - 1)} of {len(view.index())}, messages {start + 1}-{end} of {total}"
+            if query:
+                hits = view.search(query)
+                title += f", {len(hits)} match(es) for '{query}'"
+            print(colors.blue_text(f"\n=== Conversation History ({title}) ==="))
+            for position, text in page:
+                self.print_message(self.conversation_history[position], text, rows=None if full else rows,
+                                   turn=view.turn_of(position))
+            full = False
+
+            print(colors.blue_text("[n]ext/[p]revious page, a turn number, /words to search, [f]ull messages, or press Enter to close."))
+            while True:
+                choice = input(colors.blue_text("History: ")).strip()
+                lower = choice.lower()
+                if not choice:
+                    return
+                if lower == "n":
+                    if end >= total:
+                        print(colors.Red_text("No more pages."))
+                        continue
+                    start = end
+                elif lower == "p":
+                    if start == 0:
+                        print(colors.Red_text("No more pages."))
+                        continue
+                    start = view.page_before(start, rows, width)[0][0]
+                elif lower == "f":
+                    full = True
+                elif choice.isdigit():
+                    start = view.turn_start(int(choice))
+                elif choice.startswith("/"):
+                    query = choice[1:].strip() or query  # a bare / finds the next match
+                    hit = view.next_hit(query, start) if query else None
+                    if hit is None:
+                        print(colors.Red_text("No matches." if query else "Type /words to search."))
+                        continue
+                    start = hit[0]
+                else:
+                    print(colors.Red_text("Invalid choice. Please try again."))
+                    continue
+                break
+
+    def print_message(self, msg, text=None, rows=None, turn=None):
+        """One message as in the chat, images as [image]. rows cuts it down to about that many lines."""
+        role = msg["role"]
+        if text is None:
+            text = text_of(msg["content"])
+        hidden = 0
+        if rows is not None:
+            text, hidden = clip(text, rows, shutil.get_terminal_size().columns)
+        if role == "user":
+            label = f"{colors.code_text(f'[{turn}]')} " if turn else ""
+            print(f"{label}You: {text}")
+        else:
+            self.output.start_answer()
+            # Same styling as live responses so both look identical
+            self.output.render(text)
+            print()
+        if hidden:
+            print(colors.code_text(f"[... {hidden} more lines, 'f' in /history shows them]"))
+
+    def search_conversations(self, query):
+        """/search: full-text search over saved conversations, pick a hit to load it."""
+        if not query:
+            print(colors.Red_text("Usage: /search <words>"))
+            return
+
+        try:
+            start = time.perf_counter()
+            self.index.refresh_search()
+            hits = self.index.search(query)
+            elapsed = (time.perf_counter() - start) * 1000
+        except Exception as e:
+            print(colors.Red_text(f"Error searching conversations: {str(e)}"))
+            return
+
+        if not hits:
+            print(colors.blue_text(f"No matches for '{query}'."))
+            return
+
+        print(colors.blue_text(f"\n=== {len(hits)} match(es) for '{query}' ({elapsed:.0f}ms) ==="))
+        for i, hit in enumerate(hits):
+            role = "You" if hit['role'] == "user" else "Claude"
+            print(f"{colors.bold_text(f'[{i+1}]')} {colors.blue_text(hit['filename'])} (message {hit['turn'] + 1}, {role})")
+            print(f"    {colors.green_text(hit['snippet'])}\n")
+
+        while True:
+            choice = input(colors.blue_text("Enter a number to open that conversation, or press Enter to cancel: ")).strip()
+            if not choice:
+                return
+            try:
+                hit = hits[int(choice) - 1]
+            except (ValueError, IndexError):
+                print(colors.Red_text("Invalid selection. Please try again."))
+                continue
+
+            self.load_conversation(hit['filename'])
+            self.prime_cache()
+            if 0 <= hit['turn'] < len(self.conversation_history):
+                print(colors.blue_text(f"\n--- message {hit['turn'] + 1} of {len(self.conversation_history)} ---"))
+                self.print_message(self.conversation_history[hit['turn']])
+            return
+
+def remove_file(path):
+    if os.path.exists(path):
+        os.remove(path)
+
+
 def signal_handler(sig, frame):
     print(colors.Red_text("\nExiting chat..."))
     exit(0)
 
 
+def trace_startup(event, at=None):
+    """Startup milestone for --bench-startup, which reads these off stderr."""
+    if os.getenv(BENCH_STARTUP_ENV):
+        print(f"clarde-startup {event} {time.time() if at is None else at:.6f}", file=sys.stderr, flush=True)
+
+
 def main():
+    trace_startup("started", STARTED)
+    trace_startup("imported")
+    if len(sys.argv) > 1 and sys.argv[1] == "--bench-startup":
+        sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks"))
+        import startup_bench
+        sys.exit(startup_bench.main(sys.argv[2:]))
+
+    # --cache, --record, --replay, --output and --profile go with any mode, so take them out first
+    sys.argv[1:] = profile_from_args(output.configure_from_args(configure_from_args(sys.argv[1:])))
+    output.setup()
+    if len(sys.argv) > 1 and sys.argv[1] == "batch":
+        import batch
+        sys.exit(batch.main(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] in ("serve", "connect"):
+        import daemon
+        sys.exit(daemon.main(sys.argv[1], sys.argv[2:]))
+
     try:
         signal.signal(signal.SIGINT, signal_handler)
         api_key = 'ANTHROPIC_API_KEY'
@@ -501,6 +1077,8 @@ def main():
             return
             
         chatbot = ClaudeChatbot(api_key)
+        signal.signal(signal.SIGINT, chatbot.interrupt)
+        trace_startup("chatbot")
         
         chatbot.clear_screen()
         colors.display_boot_logo(1)
@@ -512,6 +1090,17 @@ def main():
         print("[2] Continue recent chat")
         print("[3] Quit")
         print("")
+        trace_startup("prompt")
+        # Load the SDK and connect while the user picks an option and a model
+        chatbot.transport.start()
+        if chatbot.fanout.enabled:
+            chatbot.fanout.warm_up()
+        if os.getenv(BENCH_STARTUP_ENV):
+            chatbot.transport.client.get()
+            trace_startup("client")
+            return
+        # Old conversations go into the archive in the background
+        chatbot.engine.write(chatbot.archive_old_conversations)
         while True:
             try:
                 option = input("Type a number and press Enter: ")
@@ -533,7 +1122,8 @@ def main():
 
         while True:
             try:
-                user_input = input(f"You: ")
+                # Picks up anything typed while the last answer was coming in
+                user_input = chatbot.typeahead.input(f"You: ")
                 if user_input.lower() in ['quit', 'exit' 'quit chat', 'quit ' 'exit ']:
                     print(colors.blue_text("would you like to save this conversation [y/n]?"))
                     while True:
@@ -542,6 +1132,7 @@ def main():
                             chatbot.save_conversation(auto_save=True)
                             exit(0)
                         elif user_input.lower() == "n":
+                            chatbot.discard_autosave()
                             exit(0)
                         if not user_input.strip():
                             print(colors.Red_text("Error: Please enter a message"))
@@ -549,7 +1140,8 @@ def main():
                 if not user_input.strip():
                     print(colors.Red_text("Error: Please enter a message"))
                     continue
-                chatbot.stream_chat(user_input)
+                with chatbot.profiler.turn(user_input):
+                    chatbot.stream_chat(user_input)
             except Exception as e:
                 print(colors.Red_text(f"Unexpected error: {str(e)}"))
                 
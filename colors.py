@@ -1,27 +1,58 @@
+import os
 from colorama import init, Fore, Style
 
-init()
+# Escape codes per style, worked out once. The helpers below and the
+# renderer look them up in `active`, which setup(styled=False) blanks
+STYLES = {
+    "green": Fore.GREEN,
+    "red": Fore.RED,
+    "blue": Fore.BLUE,
+    "yellow": Fore.YELLOW,
+    "cyan": Fore.CYAN,
+    "code": Style.DIM + Fore.CYAN,
+    "bold": Style.BRIGHT,
+    "reset": Style.RESET_ALL,
+}
+PLAIN = dict.fromkeys(STYLES, "")
+active = dict(STYLES)
+
+_initialized = False
+
+
+def setup(styled=True):
+    """Turns the styles on or off. Called from main() rather than on import,
+    so importing this module for the helpers below has no side effects.
+
+    Colorama only hooks into stdout on Windows, where the codes need
+    converting. Anywhere else its wrapper would just sit on every write.
+    """
+    global _initialized
+    active.update(STYLES if styled else PLAIN)
+    if styled and os.name == "nt" and not _initialized:
+        init()
+        _initialized = True
+
 
 def green_text(text):
-    return f"{Fore.GREEN}{text}{Style.RESET_ALL}"
+    return f"{active['green']}{text}{active['reset']}"
 
 def Red_text(text):
-    return f"{Fore.RED}{text}{Style.RESET_ALL}"
+    return f"{active['red']}{text}{active['reset']}"
 
 def blue_text(text):
-    return f"{Fore.BLUE}{text}{Style.RESET_ALL}"
+    return f"{active['blue']}{text}{active['reset']}"
 
 def yellow_text(text):
-    return f"{Fore.YELLOW}{text}{Style.RESET_ALL}"
+    return f"{active['yellow']}{text}{active['reset']}"
 
 def code_text(text):
-    return f"{Style.DIM}{Fore.CYAN}{text}{Style.RESET_ALL}"
+    return f"{active['code']}{text}{active['reset']}"
 
 def bold_text(text):
-    return f"{Style.BRIGHT}{text}{Style.RESET_ALL}"
+    return f"{active['bold']}{text}{active['reset']}"
 
 def display_boot_logo(self):
-        logo = f"""{Fore.CYAN}
+        logo = f"""{active['cyan']}
   
      ░▒▓██████▓▒░░▒▓█▓▒░       ░▒▓██████▓▒░░▒▓███████▓▒░░▒▓███████▓▒░░▒▓████████▓▒░ 
     ░▒▓█▓▒░░▒▓█▓▒░▒▓█▓▒░      ░▒▓█▓▒░░▒▓█▓▒░▒▓█▓▒░░▒▓█▓▒░▒▓█▓▒░░▒▓█▓▒░▒▓█▓▒░        
@@ -31,10 +62,11 @@ def display_boot_logo(self):
     ░▒▓█▓▒░░▒▓█▓▒░▒▓█▓▒░      ░▒▓█▓▒░░▒▓█▓▒░▒▓█▓▒░░▒▓█▓▒░▒▓█▓▒░░▒▓█▓▒░▒▓█▓▒░        
      ░▒▓██████▓▒░░▒▓████████▓▒░▒▓█▓▒░░▒▓█▓▒░▒▓█▓▒░░▒▓█▓▒░▒▓███████▓▒░░▒▓████████▓▒░ 
                                                                                                                                                             
-{Style.RESET_ALL}"""
+{active['reset']}"""
         print(logo)
 
 if __name__ == "__main__":
+    setup()
     display_boot_logo(1)
     bold_text()
     Red_text()
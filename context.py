@@ -0,0 +1,237 @@
+import os
+
+
+# Models we offer in choose_model, in menu order
+MODELS = (
+    ("Haiku", "claude-3-haiku-20240307"),
+    ("Sonnet", "claude-3-5-sonnet-20241022"),
+)
+
+# Context window of each model we offer in choose_model
+MODEL_CONTEXT_WINDOWS = {
+    "claude-3-haiku-20240307": 200000,
+    "claude-3-5-sonnet-20241022": 200000,
+}
+DEFAULT_CONTEXT_WINDOW = 200000
+
+POLICIES = ("sliding", "summarize", "drop-images")
+
+# Rough numbers, good enough to decide when we're getting close to the limit
+CHARS_PER_TOKEN = 4
+IMAGE_TOKENS = 1600
+
+# The API allows at most 4 cache breakpoints per request
+MAX_BREAKPOINTS = 4
+# Blocks this big (imported files, images) get a breakpoint of their own
+LARGE_BLOCK_TOKENS = 1024
+
+SUMMARY_PROMPT = "Summarize the conversation below in a few short paragraphs. Keep names, decisions, code identifiers and open questions. Return only the summary.\n\n"
+
+
+def estimate_tokens(content):
+    """Estimates the tokens used by a message's content (str or list of blocks)."""
+    if isinstance(content, str):
+        return len(content) // CHARS_PER_TOKEN + 1
+    tokens = 0
+    for block in content:
+        if block.get("type") == "image":
+            tokens += IMAGE_TOKENS
+        else:
+            tokens += len(block.get("text", "")) // CHARS_PER_TOKEN + 1
+    return tokens
+
+
+def message_tokens(message):
+    """Token estimate of a message, without decoding it if it's a conversation.Message."""
+    tokens = getattr(message, "tokens", None)
+    return tokens if tokens is not None else estimate_tokens(message["content"])
+
+
+def has_images(message):
+    images = getattr(message, "images", None)
+    if images is not None:
+        return images
+    content = message["content"]
+    return isinstance(content, list) and any(block.get("type") == "image" for block in content)
+
+
+def message_text(content):
+    """Text parts of a message only, images are left out."""
+    if isinstance(content, str):
+        return content
+    return " ".join(block.get("text", "") for block in content if block.get("type") == "text")
+
+
+def text_of(content):
+    if isinstance(content, str):
+        return content
+    return " ".join(block.get("text", "[image]") if block.get("type") == "text" else "[image]" for block in content)
+
+
+def with_breakpoint(message):
+    """A copy of message with a cache_control breakpoint on its last block."""
+    if hasattr(message, "with_cache_control"):
+        # A conversation.Message can do this on its encoded form
+        return message.with_cache_control()
+    content = message["content"]
+    if not content:
+        return message
+    if isinstance(content, str):
+        content = [{"type": "text", "text": content}]
+    last = dict(content[-1])
+    last["cache_control"] = {"type": "ephemeral"}
+    return {"role": message["role"], "content": list(content[:-1]) + [last]}
+
+
+class ContextManager:
+    """Decides what part of the history gets sent on each turn.
+
+    Adds cache_control breakpoints on the stable prefix of the history so the
+    API can serve it from the prompt cache, and keeps the request within the
+    chosen model's context window using one of POLICIES once it fills up.
+    """
+
+    def __init__(self, policy=None, summarize=None):
+        self.policy = policy or os.getenv("CLARDE_CONTEXT_POLICY", "sliding")
+        if self.policy not in POLICIES:
+            self.policy = "sliding"
+        self.summarize = summarize  # callable(text) -> summary, used by the summarize policy
+        self.set_model(None)
+        self.reset()
+
+    def set_model(self, model, max_output_tokens=1200):
+        self.model = model
+        self.context_window = MODEL_CONTEXT_WINDOWS.get(model, DEFAULT_CONTEXT_WINDOW)
+        self.budget = self.context_window - max_output_tokens
+
+    def reset(self):
+        """Forget trimming state, call when the history is cleared or replaced."""
+        self.start = 0  # messages before this index are no longer sent as is
+        self.summary = None
+        self.last_estimate = 0
+
+    def build(self, history):
+        """Returns the messages to send for this turn. Never modifies history."""
+        if self.start > len(history):
+            self.reset()
+
+        messages = self.fit(history)
+        self.last_estimate = sum(message_tokens(m) for m in messages)
+        return self.add_cache_breakpoints(messages)
+
+    def fit(self, history):
+        messages = self.window(history)
+        if sum(message_tokens(m) for m in messages) <= self.budget:
+            return messages
+
+        if self.policy == "drop-images":
+            messages = self.drop_images(messages)
+            if sum(message_tokens(m) for m in messages) <= self.budget:
+                return messages
+
+        # Trim down to 3/4 of the budget in one go, so the prefix (and the
+        # cache built on it) stays the same for the next few turns
+        target = self.budget * 3 // 4
+        tokens = [message_tokens(m) for m in history]
+        total = sum(tokens[self.start:])
+        start = self.start
+        while total > target and start < len(history) - 1:
+            total -= tokens[start]
+            start += 1
+        # History has to start with a user message
+        while start < len(history) - 1 and history[start]["role"] != "user":
+            total -= tokens[start]
+            start += 1
+
+        if self.policy == "summarize" and self.summarize:
+            try:
+                older = "\n\n".join(f"{m['role']}: {text_of(m['content'])}" for m in history[self.start:start])
+                if self.summary:
+                    older = f"Earlier summary: {self.summary}\n\n{older}"
+                self.summary = self.summarize(SUMMARY_PROMPT + older)
+            except Exception:
+                self.summary = None
+
+        self.start = start
+        messages = self.window(history)
+        if self.policy == "drop-images":
+            messages = self.drop_images(messages)
+        return messages
+
+    def window(self, history):
+        messages = history[self.start:]
+        if self.summary:
+            messages = [
+                {"role": "user", "content": f"Summary of our earlier conversation:\n{self.summary}"},
+                {"role": "assistant", "content": "Got it, I'll keep that in mind."},
+            ] + messages
+        return messages
+
+    def drop_images(self, messages):
+        """Replaces images in all but the latest message with a short note."""
+        trimmed = []
+        for message in messages[:-1]:
+            if has_images(message):
+                content = [block if block.get("type") != "image" else {"type": "text", "text": "[image removed to save context]"}
+                           for block in message["content"]]
+                message = {"role": message["role"], "content": content}
+            trimmed.append(message)
+        return trimmed + messages[-1:]
+
+    def add_cache_breakpoints(self, messages):
+        """Copies the messages that get a cache_control breakpoint, leaves the rest shared.
+
+        Breakpoints go on the new user turn (cached for the next turn), the
+        previous user turn (read from the cache now), and the most recent
+        large blocks such as imported files and images.
+        """
+        user_turns = [i for i, m in enumerate(messages) if m["role"] == "user"]
+        marked = user_turns[-2:]
+        for i in range(len(messages) - 1, -1, -1):
+            if len(marked) >= MAX_BREAKPOINTS:
+                break
+            if i not in marked and message_tokens(messages[i]) >= LARGE_BLOCK_TOKENS:
+                marked.append(i)
+
+        messages = list(messages)
+        for i in marked:
+            messages[i] = with_breakpoint(messages[i])
+        return messages
+
+    def usage_report(self, usage):
+        """One line summary of a turn's token usage and cache hit or miss."""
+        status = "hit" if usage["cache_read_input_tokens"] else "miss"
+        return (f"[cache {status} | input: {usage['input_tokens']} | "
+                f"cache read: {usage['cache_read_input_tokens']} | "
+                f"cache write: {usage['cache_creation_input_tokens']} | "
+                f"output: {usage['output_tokens']} | "
+                f"context: ~{self.last_estimate}/{self.budget}"
+                + (f" | ttft: {usage['ttft']:.2f}s" if usage.get("ttft") is not None else "")
+                + (" | replayed from response cache" if usage.get("cached") else "")
+                + "]")
+
+
+USAGE_FIELDS = ("input_tokens", "output_tokens", "cache_read_input_tokens", "cache_creation_input_tokens")
+
+
+def read_usage(usage, into=None):
+    """Copies the token counts we care about off an API usage object into a dict.
+
+    The stream reports usage twice (message_start, then message_delta with
+    the output count), so pass the dict from the first call as `into`.
+    """
+    into = into if into is not None else dict.fromkeys(USAGE_FIELDS, 0)
+    for field in USAGE_FIELDS:
+        value = getattr(usage, field, None)
+        if value:
+            into[field] = value
+    return into
+
+
+def build_request(context, image_store, model, history, max_tokens=1200):
+    """Keyword arguments for messages.create for the next turn of history."""
+    return {
+        "model": str(model),
+        "max_tokens": max_tokens,
+        "messages": image_store.materialize(context.build(history)),
+    }
@@ -0,0 +1,136 @@
+import json
+import sys
+from collections.abc import Mapping
+from context import estimate_tokens
+
+
+# What add_cache_breakpoints puts on the last block of a message
+CACHE_CONTROL = b',"cache_control":{"type":"ephemeral"}'
+
+
+def encode(value):
+    """Compact UTF-8 JSON, the form messages are sent and saved in."""
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def encoded(message):
+    """The JSON of a message, without encoding it again if it's a Message."""
+    return message.json if isinstance(message, Message) else encode(message)
+
+
+class Message(Mapping):
+    """One turn of a conversation, kept as its encoded JSON.
+
+    A long chat holds thousands of these, so instead of a dict (plus a list
+    and a dict per block) a message is a slotted object with the bytes that
+    go into request bodies and save files as they are, the role, a token
+    estimate and whether it has images. The content is only decoded when
+    something reads it. Reads like the {"role", "content"} dict it replaces,
+    so code written for dicts takes these too. Never changed once made.
+    """
+
+    __slots__ = ("role", "json", "tokens", "images")
+
+    def __init__(self, role, content):
+        self.role = sys.intern(role)
+        self.json = encode({"role": role, "content": content})
+        self.tokens = estimate_tokens(content)
+        self.images = isinstance(content, list) and any(block.get("type") == "image" for block in content)
+
+    @classmethod
+    def of(cls, message):
+        """message as a Message, as is if it already is one."""
+        return message if isinstance(message, cls) else cls(message["role"], message["content"])
+
+    @classmethod
+    def from_encoded(cls, role, data, tokens, images):
+        message = cls.__new__(cls)
+        message.role = role
+        message.json = data
+        message.tokens = tokens
+        message.images = images
+        return message
+
+    @property
+    def content(self):
+        return json.loads(self.json)["content"]
+
+    def __getitem__(self, key):
+        if key == "role":
+            return self.role
+        if key == "content":
+            return self.content
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(("role", "content"))
+
+    def __len__(self):
+        return 2
+
+    def __repr__(self):
+        return f"Message({self.role!r}, {len(self.json)} bytes)"
+
+    def with_cache_control(self):
+        """This message with a cache breakpoint on its last block, made without decoding it."""
+        head = b'{"role":' + encode(self.role) + b',"content":'
+        content = self.json[len(head):-1]
+        if content in (b'""', b'[]'):
+            return self
+        if content.startswith(b'"'):
+            content = b'[{"type":"text","text":' + content + CACHE_CONTROL + b'}]'
+        else:
+            # Compact JSON of a list of blocks always ends in "}]"
+            content = content[:-2] + CACHE_CONTROL + b'}]'
+        return Message.from_encoded(self.role, head + content + b'}', self.tokens, self.images)
+
+
+class Conversation:
+    """The messages of a chat, in order.
+
+    Appending is O(1) and only encodes the new message. Messages are never
+    changed in place, so list(conversation) is a safe snapshot to hand to
+    another thread without copying any content.
+    """
+
+    __slots__ = ("messages",)
+
+    def __init__(self, messages=()):
+        self.messages = [Message.of(message) for message in messages]
+
+    def append(self, message):
+        """Adds message (a dict or a Message) and returns it as a Message."""
+        message = Message.of(message)
+        self.messages.append(message)
+        return message
+
+    def extend(self, messages):
+        return [self.append(message) for message in messages]
+
+    def pop(self):
+        return self.messages.pop()
+
+    def __len__(self):
+        return len(self.messages)
+
+    def __iter__(self):
+        return iter(self.messages)
+
+    def __getitem__(self, index):
+        return self.messages[index]
+
+    def to_list(self):
+        """Plain dicts, e.g. to send as JSON."""
+        return [dict(message) for message in self.messages]
+
+
+def encode_body(request):
+    """JSON body for messages.create, with the messages joined from their encoded form."""
+    fields = encode({k: v for k, v in request.items() if k != "messages"})
+    messages = b",".join(encoded(message) for message in request["messages"])
+    return fields[:-1] + (b',' if len(fields) > 2 else b'') + b'"messages":[' + messages + b']}'
+
+
+def plain_request(request):
+    """request with its messages as plain dicts, for SDKs that encode the body themselves."""
+    return dict(request, messages=[dict(message) for message in request["messages"]])
@@ -0,0 +1,310 @@
+import colors
+import functools
+import os
+import re
+import sqlite3
+import threading
+from context import message_text
+from conversation_store import iter_messages, is_conversation_file
+
+
+INDEX_FILE = ".clarde_index.db"
+# Search index rowids are file id * ROWS_PER_FILE + message number
+ROWS_PER_FILE = 1000000
+
+
+def conversation_preview(history, length=60):
+    """Short preview of the first message of a conversation."""
+    if history and "content" in history[0]:
+        message_content = history[0]["content"]
+
+        # Handle if it's a list (image + text)
+        if isinstance(message_content, list):
+            # Look for the text part in the content list
+            preview = next((item["text"] for item in message_content if item.get("type") == "text"), "Image message")
+        else:
+            # If it's just regular text
+            preview = message_content
+    else:
+        preview = "Empty conversation"
+
+    # Truncate the preview
+    return preview[:length] + "..." if len(preview) > length else preview
+
+
+def locked(method):
+    """Runs method holding the index's lock."""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+class ConversationIndex:
+    """Metadata cache for saved conversations.
+
+    Keeps the preview, message count, model and token total of every
+    conversation file in a small SQLite file, keyed on filename, mtime and
+    size. Listing only stats the directory; a file is parsed again only when
+    its stat changed and it's actually about to be shown. Conversations in
+    the archive (an archive.ConversationArchive) are listed from its table
+    of contents and stay searchable.
+
+    Saves update it from the writer thread while the prompt lists and
+    searches, and they share one connection, so everything that touches
+    it holds self.lock.
+    """
+
+    def __init__(self, directory=".", path=INDEX_FILE, archive=None):
+        self.directory = directory
+        self.archive = archive
+        self.path = os.path.join(directory, path)
+        self.lock = threading.RLock()
+        try:
+            self.db = self.connect()
+        except sqlite3.DatabaseError:
+            # It's only a cache, start over if it got corrupted
+            os.remove(self.path)
+            self.db = self.connect()
+
+    def connect(self):
+        # Shared with the writer thread, see self.lock
+        db = sqlite3.connect(self.path, check_same_thread=False)
+        # WAL keeps commits from creating and deleting a journal file next to
+        # the conversations, which would look like a directory change
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("""
+            CREATE TABLE IF NOT EXISTS conversations (
+                filename TEXT PRIMARY KEY,
+                modified REAL,
+                size INTEGER,
+                preview TEXT,
+                message_count INTEGER,
+                model TEXT,
+                tokens INTEGER
+            )
+        """)
+        # Full-text search over the text of every message, for /search
+        db.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS messages USING fts5(
+                filename UNINDEXED,
+                turn UNINDEXED,
+                role UNINDEXED,
+                text,
+                tokenize = 'porter unicode61'
+            )
+        """)
+        db.execute("""
+            CREATE TABLE IF NOT EXISTS search_state (
+                id INTEGER PRIMARY KEY,
+                filename TEXT UNIQUE,
+                modified REAL,
+                size INTEGER,
+                message_count INTEGER
+            )
+        """)
+        db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        db.commit()
+        return db
+
+    def scan(self):
+        """Stat every conversation file, newest first. Doesn't open any of them."""
+        files = []
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if is_conversation_file(entry.name):
+                    stats = entry.stat()
+                    files.append((entry.name, stats.st_mtime, stats.st_size))
+        files.sort(key=lambda f: f[1], reverse=True)
+        return files
+
+    def archived(self, loose=()):
+        """(name, mtime, size) of archived conversations, leaving out any that are also loose files."""
+        if self.archive is None:
+            return []
+        names = {name for name, _, _ in loose}
+        return [(name, entry["mtime"], entry["size"]) for name, entry in self.archive.entries().items()
+                if name not in names]
+
+    def read_messages(self, filename):
+        path = os.path.join(self.directory, filename)
+        if self.archive is not None and not os.path.exists(path) and filename in self.archive:
+            return list(self.archive.iter_messages(filename))
+        return list(iter_messages(path))
+
+    @locked
+    def list(self, page=0, page_size=10):
+        """Returns (conversations on this page, total number of conversations)."""
+        files = self.scan()
+        if page == 0:
+            self.forget_missing({name for name, _, _ in files})
+        archived = self.archived(files)
+        if archived:
+            files = sorted(files + archived, key=lambda f: f[1], reverse=True)
+        entries = self.archive.entries() if archived else {}
+
+        conversations = []
+        for filename, modified, size in files[page * page_size:(page + 1) * page_size]:
+            entry = entries.get(filename)
+            if entry is not None:
+                conversations.append({
+                    'filename': filename,
+                    'modified': modified,
+                    'size': size,
+                    'preview': entry["preview"],
+                    'message_count': entry["messages"],
+                    'model': None,
+                    'tokens': 0,
+                    'archived': True
+                })
+                continue
+
+            row = self.db.execute(
+                "SELECT modified, size, preview, message_count, model, tokens FROM conversations WHERE filename = ?",
+                (filename,)
+            ).fetchone()
+
+            if row and row[0] == modified and row[1] == size:
+                preview, message_count, model, tokens = row[2:]
+            else:
+                # New or changed since we last looked, read it again
+                try:
+                    history = list(iter_messages(os.path.join(self.directory, filename)))
+                except Exception as e:
+                    print(colors.Red_text(f"Error reading {filename}: {str(e)}"))
+                    continue
+                preview = conversation_preview(history)
+                message_count = len(history)
+                model = row[4] if row else None
+                tokens = row[5] if row else 0
+                self.store(filename, modified, size, preview, message_count, model, tokens)
+
+            conversations.append({
+                'filename': filename,
+                'modified': modified,
+                'size': size,
+                'preview': preview,
+                'message_count': message_count,
+                'model': model,
+                'tokens': tokens,
+                'archived': False
+            })
+
+        self.db.commit()
+        return conversations, len(files)
+
+    @locked
+    def update(self, filename, history, model=None, tokens=0, appended_to=None):
+        """Record a conversation that was just written, without reading it back.
+
+        appended_to is the size the file had before history's new messages
+        were appended to it, None if the whole file was (re)written.
+        """
+        stats = os.stat(os.path.join(self.directory, filename))
+        name = os.path.basename(filename)
+        self.store(name, stats.st_mtime, stats.st_size,
+                   conversation_preview(history), len(history), model, tokens)
+        self.index_messages(name, history, stats.st_mtime, stats.st_size, appended_to)
+        self.db.commit()
+
+    def index_messages(self, filename, history, modified, size, appended_to=None):
+        """Adds the messages of filename that aren't in the search index yet.
+
+        Only the new turns get indexed when they were appended to the very
+        file indexed last time, the size it had then is appended_to. Any
+        other write (a compaction, another conversation saved under the same
+        name, a change we didn't see) indexes the file again from scratch.
+        Message rows use rowid = file id * ROWS_PER_FILE + turn, so a file's
+        rows can be dropped with a rowid range instead of a full scan.
+        """
+        row = self.db.execute("SELECT id, size, message_count FROM search_state WHERE filename = ?",
+                              (filename,)).fetchone()
+        if row:
+            file_id, indexed_size, start = row
+            if appended_to is None or indexed_size != appended_to or start > len(history):
+                self.forget_messages(file_id)
+                start = 0
+        else:
+            file_id = self.db.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM search_state").fetchone()[0]
+            start = 0
+
+        rows = []
+        for turn in range(start, min(len(history), ROWS_PER_FILE)):
+            text = message_text(history[turn].get("content", ""))
+            if text.strip():
+                rows.append((file_id * ROWS_PER_FILE + turn, filename, turn, history[turn].get("role"), text))
+        self.db.executemany("INSERT INTO messages (rowid, filename, turn, role, text) VALUES (?, ?, ?, ?, ?)", rows)
+        self.db.execute("INSERT OR REPLACE INTO search_state VALUES (?, ?, ?, ?, ?)",
+                        (file_id, filename, modified, size, len(history)))
+
+    def forget_messages(self, file_id):
+        self.db.execute("DELETE FROM messages WHERE rowid >= ? AND rowid < ?",
+                        (file_id * ROWS_PER_FILE, (file_id + 1) * ROWS_PER_FILE))
+
+    @locked
+    def refresh_search(self):
+        """Brings the search index up to date with files saved or removed by other sessions.
+
+        Every session updates the index itself when it saves, so this only
+        has to look at the files when the directory changed since last time.
+        """
+        directory_mtime = os.stat(self.directory).st_mtime
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'directory_mtime'").fetchone()
+        if row and float(row[0]) == directory_mtime:
+            return
+
+        files = self.scan()
+        # Archived conversations keep their rows, they're indexed the same as before
+        files += self.archived(files)
+        existing = {name for name, _, _ in files}
+        state = {row[0]: (row[1], row[2], row[3]) for row in
+                 self.db.execute("SELECT filename, id, modified, size FROM search_state")}
+
+        for name, (file_id, _, _) in state.items():
+            if name not in existing:
+                self.forget_messages(file_id)
+                self.db.execute("DELETE FROM search_state WHERE id = ?", (file_id,))
+
+        for filename, modified, size in files:
+            known = state.get(filename)
+            if known and known[1:] == (modified, size):
+                continue
+            try:
+                history = self.read_messages(filename)
+            except Exception as e:
+                print(colors.Red_text(f"Error reading {filename}: {str(e)}"))
+                continue
+            # Changed behind our back, so it's indexed again from scratch
+            self.index_messages(filename, history, modified, size)
+
+        self.db.execute("INSERT OR REPLACE INTO meta VALUES ('directory_mtime', ?)", (str(directory_mtime),))
+        self.db.commit()
+
+    @locked
+    def search(self, query, limit=20):
+        """Best matching messages for query, best first."""
+        words = re.findall(r"\w+", query)
+        if not words:
+            return []
+        # Quote every word so FTS syntax in the query can't break anything,
+        # and let the last one match as a prefix while typing
+        match = " ".join(f'"{w}"' for w in words) + "*"
+        rows = self.db.execute("""
+            SELECT filename, turn, role, snippet(messages, 3, '[', ']', '...', 12)
+            FROM messages WHERE messages MATCH ?
+            ORDER BY bm25(messages) LIMIT ?
+        """, (match, limit)).fetchall()
+        return [{'filename': r[0], 'turn': r[1], 'role': r[2], 'snippet': r[3]} for r in rows]
+
+    def store(self, filename, modified, size, preview, message_count, model, tokens):
+        self.db.execute(
+            "INSERT OR REPLACE INTO conversations VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (filename, modified, size, preview, message_count, model, tokens)
+        )
+
+    def forget_missing(self, existing):
+        known = [row[0] for row in self.db.execute("SELECT filename FROM conversations")]
+        gone = [(name,) for name in known if name not in existing]
+        if gone:
+            self.db.executemany("DELETE FROM conversations WHERE filename = ?", gone)
@@ -0,0 +1,87 @@
+import json
+import os
+from conversation import encoded
+
+
+class ConversationStore:
+    """Append-only conversation file, one JSON message per line.
+
+    Adding a turn appends just that turn's lines and fsyncs, so a save costs
+    O(turn) instead of rewriting the whole history. compact() rewrites the
+    file through a temp file and os.replace, so a crash never leaves a half
+    written conversation behind.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.checked_tail = False
+
+    def append(self, messages):
+        """Appends messages, returns the size the file had before."""
+        with open(self.path, 'ab') as f:
+            start = f.tell()
+            if not self.checked_tail:
+                # A crash can leave the last line unterminated, don't glue onto it
+                if f.tell() > 0 and not self.ends_with_newline():
+                    f.write(b"\n")
+                self.checked_tail = True
+            for message in messages:
+                # Messages of a Conversation are written as they already are
+                f.write(encoded(message) + b"\n")
+            f.flush()
+            os.fsync(f.fileno())
+        return start
+
+    def ends_with_newline(self):
+        with open(self.path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+
+    def compact(self, messages):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            for message in messages:
+                f.write(encoded(message) + b"\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        sync_directory(self.path)
+        self.checked_tail = True
+
+
+def sync_directory(path):
+    """fsync the directory holding path so a rename survives a crash (POSIX only)."""
+    if not hasattr(os, 'O_DIRECTORY'):
+        return
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def iter_messages(path):
+    """Yields the messages of a saved conversation one at a time.
+
+    Reads both the JSONL format and the old conversation_*.json files, which
+    hold the whole history as one pretty-printed list.
+    """
+    if path.endswith(".json"):
+        with open(path, 'r', encoding='utf-8') as f:
+            yield from json.load(f)
+        return
+
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                # Torn write from a crash, skip it and keep what's intact
+                continue
+
+
+def is_conversation_file(name):
+    return name.startswith("conversation_") and name.endswith((".json", ".jsonl"))
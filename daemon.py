@@ -0,0 +1,639 @@
+"""Long-lived daemon hosting many chat sessions: python clarde.py serve
+
+Every session shares one API client and connection pool, one image store,
+one conversation index and one writer thread for saves, instead of each
+clarde process building its own. Thin clients talk to it over HTTP on a
+Unix socket (.clarde.sock in the conversations directory by default) or on
+localhost with --port. Replies stream back as NDJSON, one event per line.
+
+    GET  /health
+    GET  /stats
+    GET  /sessions
+    POST /sessions                  {"model": ..., "load": "conversation_x.jsonl"}
+    POST /sessions/<id>/chat        {"content": "..."}  -> {"type": "text" | "done" | "error", ...}
+    GET  /sessions/<id>/history
+    POST /sessions/<id>/clear
+    POST /sessions/<id>/save        {"title": "..."}    (without one, keeps an existing name)
+    POST /sessions/<id>/close       {"discard": true}   (also deletes its autosave file)
+
+python clarde.py connect [address] runs the chat prompt as a client of a
+running daemon.
+"""
+import argparse
+import asyncio
+import http.client
+import json
+import os
+import secrets
+import signal
+import socket
+import sys
+import time
+from datetime import datetime
+import colors
+import output
+from archive import ConversationArchive
+from context import MODELS, ContextManager, build_request, text_of
+from conversation_index import ConversationIndex
+from conversation import Conversation
+from conversation_store import ConversationStore, iter_messages, is_conversation_file
+from engine import BackgroundEngine
+from image_store import ImageStore
+from metrics import MetricsStore
+from titles import TitleGenerator, clean_title
+from transport import AsyncTransport
+
+
+DEFAULT_SOCKET = ".clarde.sock"
+DEFAULT_MODEL = MODELS[0][1]
+# Sessions nobody has used for this long are dropped (they're autosaved anyway)
+IDLE_TIMEOUT = 3600
+MAX_BODY = 32 * 1024 * 1024
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           413: "Payload Too Large", 500: "Internal Server Error"}
+
+
+class DaemonError(Exception):
+    """An error answer from the daemon, or no daemon to talk to."""
+
+    def __init__(self, message, status=500):
+        super().__init__(message)
+        self.status = status
+
+
+class Session:
+    """One conversation hosted by the daemon."""
+
+    def __init__(self, session_id, model):
+        self.id = session_id
+        self.model = model
+        self.history = Conversation()
+        self.context = ContextManager()
+        self.context.set_model(model)
+        self.store = None  # append-only file the conversation is autosaved to
+        self.autosave_path = None  # set while that file is still the timestamped autosave
+        self.archived_name = None  # loaded from the archive, written back out on the next exchange
+        self.total_tokens = 0
+        self.lock = asyncio.Lock()  # one turn at a time
+        self.last_active = time.monotonic()
+
+    def describe(self):
+        return {
+            "session": self.id,
+            "model": self.model,
+            "messages": len(self.history),
+            "path": self.store.path if self.store else None,
+        }
+
+
+class Daemon:
+    def __init__(self, api_key, idle_timeout=IDLE_TIMEOUT):
+        self.transport = AsyncTransport(api_key)
+        # Only its writer is used: saves from every session go through one thread
+        self.engine = BackgroundEngine(api_key)
+        self.metrics = MetricsStore()
+        self.images = ImageStore()
+        self.archive = ConversationArchive(image_store=self.images)
+        self.index = ConversationIndex(archive=self.archive)
+        self.titles = TitleGenerator(self.transport.create, metrics=self.metrics)
+        self.idle_timeout = idle_timeout
+        self.sessions = {}
+        self.connections = {}  # writer -> the task serving that client
+        self.started = time.time()
+
+    async def run(self, socket_path=DEFAULT_SOCKET, port=None):
+        self.transport.start()
+        warm = asyncio.create_task(self.transport.warm_up())
+        if port is not None:
+            server = await asyncio.start_server(self.handle, "127.0.0.1", port)
+            address = f"http://127.0.0.1:{server.sockets[0].getsockname()[1]}"
+        else:
+            claim_socket(socket_path)
+            server = await asyncio.start_unix_server(self.handle, path=socket_path)
+            os.chmod(socket_path, 0o600)
+            address = f"unix:{socket_path}"
+        print(f"clarde daemon listening on {address}", file=sys.stderr, flush=True)
+        self.engine.write(self.archive_old_conversations)
+
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        reaper = asyncio.create_task(self.reap_idle())
+        try:
+            async with server:
+                await stop.wait()
+        finally:
+            reaper.cancel()
+            warm.cancel()
+            # Hang up on clients and let their handlers finish before the loop goes
+            for writer in list(self.connections):
+                writer.close()
+            if self.connections:
+                await asyncio.wait(list(self.connections.values()), timeout=5)
+            if port is None and os.path.exists(socket_path):
+                os.remove(socket_path)
+            self.engine.wait_for_writes()
+
+    async def reap_idle(self):
+        while True:
+            await asyncio.sleep(min(60, self.idle_timeout))
+            cutoff = time.monotonic() - self.idle_timeout
+            for session in [s for s in self.sessions.values() if s.last_active < cutoff and not s.lock.locked()]:
+                del self.sessions[session.id]
+
+    async def handle(self, reader, writer):
+        """One client connection, kept alive across requests."""
+        self.connections[writer] = asyncio.current_task()
+        try:
+            while True:
+                try:
+                    request = await read_request(reader)
+                    if request is None:
+                        break
+                    method, path, body = request
+                    await self.dispatch(method, path, body, writer)
+                except DaemonError as e:
+                    await send_json(writer, e.status, {"error": str(e)})
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    raise
+                except Exception as e:
+                    await send_json(writer, 500, {"error": str(e) or type(e).__name__})
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.connections.pop(writer, None)
+            writer.close()
+
+    async def dispatch(self, method, path, body, writer):
+        parts = path.strip("/").split("/")
+        if parts == ["health"]:
+            return await send_json(writer, 200, {"pid": os.getpid(), "sessions": len(self.sessions),
+                                                 "uptime": time.time() - self.started,
+                                                 "cpu": time.process_time(),
+                                                 "ready": self.transport.warmed.is_set()})
+        if parts == ["stats"]:
+            return await send_json(writer, 200, {**self.metrics.summary(), "sessions": len(self.sessions),
+                                                 "retries": self.transport.retries,
+                                                 "resumes": self.transport.resumes})
+        if parts == ["sessions"]:
+            if method == "GET":
+                return await send_json(writer, 200, {"sessions": [s.describe() for s in self.sessions.values()]})
+            if method == "POST":
+                session = await self.open_session(body.get("model") or DEFAULT_MODEL, body.get("load"))
+                return await send_json(writer, 200, session.describe())
+            raise DaemonError(f"{method} not allowed on /sessions", 405)
+
+        if len(parts) not in (2, 3) or parts[0] != "sessions":
+            raise DaemonError(f"No such endpoint: {path}", 404)
+        session = self.sessions.get(parts[1])
+        if session is None:
+            raise DaemonError(f"No such session: {parts[1]}", 404)
+        session.last_active = time.monotonic()
+        action = parts[2] if len(parts) == 3 else None
+
+        if method == "GET" and action in (None, "history"):
+            payload = session.describe()
+            if action == "history":
+                payload["history"] = session.history.to_list()
+            return await send_json(writer, 200, payload)
+        if method != "POST":
+            raise DaemonError(f"{method} not allowed here", 405)
+        if action == "chat":
+            if not body.get("content"):
+                raise DaemonError("Nothing to send", 400)
+            return await self.chat(session, body["content"], EventStream(writer))
+        if action == "clear":
+            async with session.lock:
+                session.history = Conversation()
+                session.context.reset()
+                session.store = None
+                session.autosave_path = None
+                session.archived_name = None
+            return await send_json(writer, 200, session.describe())
+        if action == "save":
+            path = await self.save(session, body.get("title"))
+            return await send_json(writer, 200, {**session.describe(), "path": path})
+        if action == "close":
+            self.sessions.pop(session.id, None)
+            if body.get("discard") and session.autosave_path:
+                self.engine.write(remove_file, session.autosave_path)
+            return await send_json(writer, 200, {"session": session.id, "closed": True})
+        raise DaemonError(f"No such endpoint: {path}", 404)
+
+    async def open_session(self, model, load=None):
+        # Reconnecting to a conversation that's still open picks up that session
+        for session in self.sessions.values():
+            if load and session.store and os.path.abspath(session.store.path) == os.path.abspath(load):
+                return session
+
+        session_id = secrets.token_hex(4)
+        while session_id in self.sessions:
+            session_id = secrets.token_hex(4)
+        session = Session(session_id, model)
+        if load:
+            if not is_conversation_file(os.path.basename(load)):
+                raise DaemonError(f"No such conversation: {load}", 404)
+            # The startup archiving may be running, make sure it leaves this one be
+            await asyncio.to_thread(self.archive.hold, load)
+            if os.path.exists(load):
+                # Older saves have images inline as base64, move those into the image store
+                session.history = await asyncio.to_thread(
+                    lambda: Conversation(self.images.dehydrate(m) for m in iter_messages(load)))
+                # Old .json files get written out to a new .jsonl file on the next exchange
+                if load.endswith(".jsonl"):
+                    session.store = ConversationStore(load)
+            elif load in self.archive:
+                session.history = await asyncio.to_thread(lambda: Conversation(self.archive.iter_messages(load)))
+                session.archived_name = os.path.basename(load)
+            else:
+                raise DaemonError(f"No such conversation: {load}", 404)
+        self.sessions[session_id] = session
+        return session
+
+    async def chat(self, session, content, events):
+        async with session.lock:
+            await events.start()
+            message = session.history.append(self.images.dehydrate({"role": "user", "content": content}))
+            call = self.metrics.start("chat", session.model)
+            parts = []
+            try:
+                request = build_request(session.context, self.images, session.model, session.history)
+                async for event in self.transport.stream(**request):
+                    call.observe(event)
+                    if event.type == "content_block_delta" and getattr(event.delta, "text", None):
+                        parts.append(event.delta.text)
+                        await events.send({"type": "text", "text": event.delta.text})
+            except Exception as e:
+                call.finish(error=e)
+                session.history.pop()
+                # The client may be the thing that went away
+                try:
+                    await events.send({"type": "error", "message": str(e) or type(e).__name__})
+                    await events.end()
+                except ConnectionError:
+                    pass
+                return
+
+            record = call.finish()
+            session.total_tokens += record["input_tokens"] + record["output_tokens"]
+            reply = session.history.append({"role": "assistant", "content": "".join(parts)})
+            self.persist(session, message, reply)
+            await events.send({"type": "done", "usage": {field: record[field] for field in
+                                                         ("input_tokens", "output_tokens", "cache_read_input_tokens",
+                                                          "cache_creation_input_tokens", "ttft")},
+                               "report": session.context.usage_report(record)})
+            await events.end()
+
+    async def save(self, session, title=None):
+        """Compacts the conversation into a titled file and keeps appending there."""
+        async with session.lock:
+            if not session.history:
+                raise DaemonError("Nothing to save yet", 400)
+            if not title and session.store and session.store.path != session.autosave_path:
+                # Already saved under a name, and every turn since was appended there
+                return session.store.path
+            title = clean_title(title) if title else await self.titles.generate(list(session.history))
+            title = title or datetime.now().strftime('%Y%m%d_%H%M%S')
+            filename = f"conversation_{title}.jsonl"
+            # Two sessions can come up with the same title
+            taken = {s.store.path for s in self.sessions.values() if s.store and s is not session}
+            if filename in taken:
+                filename = f"conversation_{title}_{session.id}.jsonl"
+
+            superseded = None
+            if session.store and session.store.path == session.autosave_path and session.store.path != filename:
+                superseded = session.store.path
+            session.store = ConversationStore(filename)
+            session.autosave_path = None
+            self.queue_write(session, list(session.history), compact=True, remove=superseded)
+            self.unarchive(session)
+            return filename
+
+    def persist(self, session, *messages):
+        """Autosaves new messages, appending only them to the session's file."""
+        if session.store is None:
+            if session.archived_name:
+                name = session.archived_name
+                session.store = ConversationStore(name if name.endswith(".jsonl") else name + "l")
+            else:
+                path = f"conversation_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{session.id}.jsonl"
+                session.store = ConversationStore(path)
+                session.autosave_path = path
+            self.queue_write(session, list(session.history), compact=True)
+            self.unarchive(session)
+        else:
+            self.queue_write(session, list(messages))
+
+    def unarchive(self, session):
+        if session.archived_name:
+            self.engine.write(self.archive.forget, session.archived_name)
+            session.archived_name = None
+
+    def archive_old_conversations(self):
+        # On the writer thread, so it can't race a session's save
+        try:
+            self.archive.apply_policy(exclude=[s.store.path for s in self.sessions.values() if s.store])
+        except Exception as e:
+            print(colors.Red_text(f"Error archiving conversations: {str(e)}"), file=sys.stderr)
+
+    def queue_write(self, session, messages, compact=False, remove=None):
+        self.engine.write(self.write_job, session.store, messages, list(session.history),
+                          compact=compact, remove=remove, model=session.model, tokens=session.total_tokens)
+
+    def write_job(self, store, messages, history, compact=False, remove=None, model=None, tokens=0):
+        # Runs on the engine's writer thread, in the order saves were queued
+        appended_to = None
+        if compact:
+            store.compact(messages)
+        else:
+            appended_to = store.append(messages)
+        remove_file(remove)
+        self.index.update(store.path, history, model=model, tokens=tokens, appended_to=appended_to)
+
+
+def remove_file(path):
+    if path and os.path.exists(path):
+        os.remove(path)
+
+
+def claim_socket(path):
+    """Removes a socket left behind by a daemon that died, refuses if one is running."""
+    if not os.path.exists(path):
+        return
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except OSError:
+        os.remove(path)
+        return
+    finally:
+        probe.close()
+    raise DaemonError(f"A daemon is already listening on {path}")
+
+
+async def read_request(reader):
+    """Method, path and JSON body of the next request, None once the client hung up."""
+    line = await reader.readline()
+    if not line.strip():
+        return None
+    try:
+        method, target, _ = line.decode("latin-1").split(" ", 2)
+    except ValueError:
+        raise DaemonError("Malformed request line", 400)
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    length = int(headers.get("content-length") or 0)
+    if length > MAX_BODY:
+        raise DaemonError("Request body too large", 413)
+    body = {}
+    if length:
+        try:
+            body = json.loads(await reader.readexactly(length))
+        except json.JSONDecodeError:
+            raise DaemonError("Request body isn't valid JSON", 400)
+    return method.upper(), target.split("?")[0], body if isinstance(body, dict) else {}
+
+
+async def send_json(writer, status, payload):
+    data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    writer.write(f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\nContent-Type: application/json\r\n"
+                 f"Content-Length: {len(data)}\r\n\r\n".encode("latin-1") + data)
+    await writer.drain()
+
+
+class EventStream:
+    """Chunked NDJSON response, one event per line, flushed as it's sent."""
+
+    def __init__(self, writer):
+        self.writer = writer
+
+    async def start(self):
+        self.writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\n"
+                          b"Transfer-Encoding: chunked\r\n\r\n")
+        await self.writer.drain()
+
+    async def send(self, event):
+        data = (json.dumps(event, ensure_ascii=False) + "\n").encode("utf-8")
+        self.writer.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        await self.writer.drain()
+
+    async def end(self):
+        self.writer.write(b"0\r\n\r\n")
+        await self.writer.drain()
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path, timeout=None):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class DaemonClient:
+    """Talks to a running daemon over one keep-alive connection. Not thread-safe.
+
+    address is 'unix:PATH', a socket path, 'http://127.0.0.1:PORT' or just a port.
+    """
+
+    def __init__(self, address=None, timeout=600):
+        self.address = address or os.getenv("CLARDE_DAEMON") or f"unix:{DEFAULT_SOCKET}"
+        self.timeout = timeout
+        self.connection = None
+
+    def connect(self):
+        address = self.address
+        if address.isdigit():
+            return http.client.HTTPConnection("127.0.0.1", int(address), timeout=self.timeout)
+        if address.startswith("http://"):
+            return http.client.HTTPConnection(address[len("http://"):].rstrip("/"), timeout=self.timeout)
+        return UnixHTTPConnection(address[len("unix:"):] if address.startswith("unix:") else address, self.timeout)
+
+    def send(self, method, path, payload=None):
+        data = json.dumps(payload).encode("utf-8") if payload is not None else None
+        headers = {"Content-Type": "application/json"} if data is not None else {}
+        for attempt in range(2):
+            if self.connection is None:
+                self.connection = self.connect()
+            try:
+                self.connection.request(method, path, body=data, headers=headers)
+                response = self.connection.getresponse()
+                break
+            except (ConnectionError, http.client.HTTPException, FileNotFoundError) as e:
+                # A kept-alive connection the daemon dropped, try a fresh one once
+                self.connection.close()
+                self.connection = None
+                if attempt:
+                    raise DaemonError(f"Can't reach the daemon at {self.address}: {e}")
+        if response.status >= 400:
+            try:
+                message = json.loads(response.read()).get("error", response.reason)
+            except ValueError:
+                message = response.reason
+            raise DaemonError(message, response.status)
+        return response
+
+    def request(self, method, path, payload=None):
+        return json.loads(self.send(method, path, payload).read())
+
+    def health(self):
+        return self.request("GET", "/health")
+
+    def stats(self):
+        return self.request("GET", "/stats")
+
+    def open(self, model=DEFAULT_MODEL, load=None):
+        return self.request("POST", "/sessions", {"model": model, "load": load})["session"]
+
+    def chat(self, session, content):
+        """Yields the reply's events as they arrive."""
+        response = self.send("POST", f"/sessions/{session}/chat", {"content": content})
+        for line in response:
+            if line.strip():
+                yield json.loads(line)
+
+    def history(self, session):
+        return self.request("GET", f"/sessions/{session}/history")["history"]
+
+    def clear(self, session):
+        return self.request("POST", f"/sessions/{session}/clear", {})
+
+    def save(self, session, title=None):
+        return self.request("POST", f"/sessions/{session}/save", {"title": title})["path"]
+
+    def close(self, session, discard=False):
+        return self.request("POST", f"/sessions/{session}/close", {"discard": discard})
+
+
+def choose_model():
+    print(colors.blue_text("\nChoose a model:"))
+    for number, (name, _) in enumerate(MODELS, 1):
+        print(f"[{number}] Claude ({name})")
+    while True:
+        choice = input(colors.blue_text("Enter the number of the model you want to use: ")).strip()
+        if choice.isdigit() and 1 <= int(choice) <= len(MODELS):
+            name, model = MODELS[int(choice) - 1]
+            print(colors.blue_text(f"\nUsing 'Claude {name}' model.\n"))
+            return model
+        print(colors.Red_text("Invalid choice. Please try again."))
+
+
+def run_client(client, model=None, load=None):
+    """The chat prompt, with the conversation living in the daemon."""
+    session = client.open(model or choose_model(), load)
+    if load:
+        for message in client.history(session):
+            print_message(message)
+
+    while True:
+        user_input = input("You: ")
+        command = user_input.strip().lower()
+        if command in ("quit", "exit"):
+            answer = input(colors.blue_text("would you like to save this conversation [y/n]? ")).strip().lower()
+            if answer == "y":
+                print(colors.blue_text(f"\nConversation saved to {client.save(session)}"))
+                client.close(session)
+            else:
+                client.close(session, discard=True)
+            return
+        if not command:
+            print(colors.Red_text("Error: Please enter a message"))
+            continue
+
+        try:
+            if command == "/clear":
+                client.clear(session)
+                print(colors.blue_text("Conversation cleared!"))
+            elif command == "/save" or command.startswith("/save "):
+                print(colors.blue_text(f"\nConversation saved to {client.save(session, user_input.strip()[6:] or None)}"))
+            elif command == "/history":
+                print(colors.blue_text("\n=== Conversation History ==="))
+                for message in client.history(session):
+                    print_message(message)
+                print(colors.blue_text("========================\n"))
+            elif command == "/stats":
+                stats = client.stats()
+                print(colors.blue_text(f"Daemon: {stats['sessions']} session(s), {stats['calls']} API call(s), "
+                                       f"{stats['retries']} retried, {stats['resumes']} resumed, "
+                                       f"${stats['cost']:.4f} estimated"))
+            elif command.startswith("/"):
+                print(colors.Red_text("Available when connected to the daemon: /clear, /save [title], /history, /stats, quit"))
+            else:
+                stream_reply(client, session, user_input)
+        except DaemonError as e:
+            print(colors.Red_text(f"Error: {str(e)}"))
+
+
+def stream_reply(client, session, content):
+    out = output.current()
+    out.start_answer()
+    renderer = out.renderer()
+    for event in client.chat(session, content):
+        if event["type"] == "text":
+            renderer.feed(event["text"])
+        elif event["type"] == "done":
+            renderer.finish()
+            out.end_answer()
+            out.usage(event["usage"], event["report"])
+        elif event["type"] == "error":
+            renderer.finish()
+            out.end_answer()
+            out.error(f"Error: {event['message']}")
+
+
+def print_message(message):
+    if message["role"] == "user":
+        print(f"You: {text_of(message['content'])}")
+    else:
+        output.current().start_answer()
+        output.current().render(text_of(message["content"]))
+        print()
+
+
+def main(command, argv=None):
+    if command == "serve":
+        parser = argparse.ArgumentParser(prog="clarde.py serve", description="Host chat sessions for thin clients.")
+        parser.add_argument("--socket", default=DEFAULT_SOCKET, help=f"Unix socket to listen on (default {DEFAULT_SOCKET})")
+        parser.add_argument("--port", type=int, help="listen on 127.0.0.1:PORT instead, 0 picks a free port")
+        parser.add_argument("--idle-timeout", type=float, default=IDLE_TIMEOUT, help="seconds before an unused session is dropped")
+        args = parser.parse_args(argv)
+        try:
+            daemon = Daemon(os.getenv("ANTHROPIC_API_KEY"), idle_timeout=args.idle_timeout)
+            asyncio.run(daemon.run(args.socket, args.port))
+        except DaemonError as e:
+            print(colors.Red_text(str(e)), file=sys.stderr)
+            return 1
+        return 0
+
+    parser = argparse.ArgumentParser(prog="clarde.py connect", description="Chat through a running clarde daemon.")
+    parser.add_argument("address", nargs="?", help=f"unix:PATH, http://127.0.0.1:PORT or PORT (default $CLARDE_DAEMON or unix:{DEFAULT_SOCKET})")
+    parser.add_argument("--model", choices=[model for _, model in MODELS])
+    parser.add_argument("--load", help="continue a saved conversation")
+    args = parser.parse_args(argv)
+
+    client = DaemonClient(args.address)
+    try:
+        client.health()
+    except DaemonError as e:
+        print(colors.Red_text(f"{e}\nStart one with: python clarde.py serve"), file=sys.stderr)
+        return 1
+    try:
+        run_client(client, args.model, args.load)
+    except DaemonError as e:
+        print(colors.Red_text(f"Error: {str(e)}"), file=sys.stderr)
+        return 1
+    except (KeyboardInterrupt, EOFError):
+        print(colors.Red_text("\nExiting chat..."))
+    return 0
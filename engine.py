@@ -0,0 +1,112 @@
+import asyncio
+import atexit
+import threading
+import colors
+from transport import AsyncTransport
+
+
+class BackgroundEngine:
+    """asyncio event loop on a daemon thread for work the REPL shouldn't wait on.
+
+    The REPL itself stays synchronous (it lives on input()), and hands
+    coroutines to this loop: API calls through a shared AsyncTransport,
+    and file writes, which go through a single writer task so they
+    land on disk in the order they were queued. Writes are small appends
+    most of the time, so they don't hold up the loop for long.
+    """
+
+    def __init__(self, api_key, exit_timeout=5.0):
+        self.api_key = api_key
+        self.exit_timeout = exit_timeout
+        self.transport = None
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="clarde-engine", daemon=True)
+        self.thread.start()
+
+        self.writes = asyncio.run_coroutine_threadsafe(self.make_queue(), self.loop).result()
+        self.writer = self.submit(self.writer_loop())
+        self.pending_writes = 0
+        self.lock = threading.Lock()
+        self.idle = threading.Event()
+        self.idle.set()
+
+        # Don't lose queued saves on exit(), but don't hang forever either
+        atexit.register(self.close)
+
+    async def make_queue(self):
+        return asyncio.Queue()
+
+    def submit(self, coro):
+        """Runs a coroutine on the engine loop, returns a concurrent.futures.Future."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def async_transport(self):
+        """The shared AsyncTransport, built on first use. Call it from the engine loop."""
+        if self.transport is None:
+            self.transport = AsyncTransport(self.api_key)
+        return self.transport
+
+    async def create_message(self, **kwargs):
+        return await self.async_transport().create(**kwargs)
+
+    async def warm_up(self):
+        # Like Transport.start() for the synchronous one
+        await self.async_transport().warm_up()
+
+    def write(self, job, *args, **kwargs):
+        """Queues a blocking file write. Returns straight away."""
+        with self.lock:
+            self.pending_writes += 1
+            self.idle.clear()
+        self.loop.call_soon_threadsafe(self.writes.put_nowait, (job, args, kwargs))
+
+    async def writer_loop(self):
+        while True:
+            job, args, kwargs = await self.writes.get()
+            try:
+                # Run right here on the loop thread rather than in an executor:
+                # executors are shut down before atexit runs, and we still
+                # want queued saves to finish while quitting
+                job(*args, **kwargs)
+            except Exception as e:
+                print(colors.Red_text(f"\nError saving conversation: {str(e)}"))
+            finally:
+                with self.lock:
+                    self.pending_writes -= 1
+                    if not self.pending_writes:
+                        self.idle.set()
+
+    def wait_for_writes(self, timeout=None):
+        """Blocks until every queued write is on disk. False if we gave up waiting."""
+        timeout = self.exit_timeout if timeout is None else timeout
+        if self.idle.wait(timeout):
+            return True
+        print(colors.Red_text(f"Gave up waiting for {self.pending_writes} pending save(s)."))
+        return False
+
+    def close(self):
+        """Waits (bounded) for pending writes, then stops the loop."""
+        self.wait_for_writes(self.exit_timeout)
+        try:
+            self.submit(self.cancel_tasks()).result(1)
+        except Exception:
+            pass
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(1)
+
+    async def cancel_tasks(self):
+        # Anything still running (the writer, a title nobody waited for) can go
+        tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def result_or(future, timeout, default=None):
+    """Result of a future if it's ready within timeout seconds, else default."""
+    if future is None:
+        return default
+    try:
+        return future.result(timeout)
+    except Exception:  # timed out, or the work itself failed
+        return default
@@ -0,0 +1,284 @@
+import os
+import queue
+import textwrap
+import time
+from itertools import zip_longest
+from context import MODELS, USAGE_FIELDS
+from metrics import CANCELLED, percentile
+
+
+POLICIES = ("off", "race", "hedge", "compare")
+# The hedge starts backups once the first model is slower than this
+# percentile of its own times to first token...
+HEDGE_PERCENTILE = 95
+# ...once it has that many to go on, until then after CLARDE_HEDGE_AFTER seconds
+HEDGE_MIN_SAMPLES = 5
+HEDGE_AFTER = 2.0
+# compare puts answers next to each other when columns can be at least this wide
+MIN_COLUMN = 40
+
+DONE = object()
+
+
+def model_name(model):
+    """'Haiku' for claude-3-haiku-..., the id itself for models not in MODELS."""
+    return next((name for name, model_id in MODELS if model_id == model), model)
+
+
+def resolve_models(names):
+    """Model ids for names like 'haiku' or full ids. Raises ValueError for unknown names."""
+    models = []
+    for name in names:
+        match = next((model_id for short, model_id in MODELS if name.lower() in (short.lower(), model_id)), None)
+        if match is None:
+            raise ValueError(f"Unknown model: {name}")
+        models.append(match)
+    return models
+
+
+class FanOut:
+    """Sends each prompt to more than one model, per CLARDE_FANOUT (one of POLICIES).
+
+    race     all models at once, the first one to answer is shown and the others are cancelled
+    hedge    the chosen model first, the others only if it's slower to answer than it usually is
+    compare  all models at once, answers shown side by side, you pick the one to keep
+
+    CLARDE_FANOUT_MODELS picks the models (e.g. 'haiku,sonnet', all of MODELS
+    by default); the chosen model always goes first. The hedge waits for the
+    chosen model's p95 time to first token this session, see threshold().
+    """
+
+    def __init__(self, engine, metrics, policy=None, models=None, hedge_after=None):
+        self.engine = engine
+        self.metrics = metrics
+        self.policy = policy or os.getenv("CLARDE_FANOUT", "off")
+        if self.policy not in POLICIES:
+            self.policy = "off"
+        try:
+            self.models = models or resolve_models(n.strip() for n in os.getenv("CLARDE_FANOUT_MODELS", "").split(",")
+                                                   if n.strip())
+        except ValueError:
+            self.models = []
+        self.hedge_after = float(hedge_after if hedge_after is not None else os.getenv("CLARDE_HEDGE_AFTER", HEDGE_AFTER))
+
+    @property
+    def enabled(self):
+        return self.policy != "off"
+
+    def models_for(self, primary):
+        models = self.models or [model_id for _, model_id in MODELS]
+        return [primary] + [model for model in models if model != primary]
+
+    def threshold(self, model):
+        """Seconds to wait for model's first token before hedging, and what that's based on."""
+        ttfts = self.metrics.model_ttfts(model)
+        if len(ttfts) >= HEDGE_MIN_SAMPLES:
+            return percentile(ttfts, HEDGE_PERCENTILE), f"p{HEDGE_PERCENTILE} of {len(ttfts)} answers"
+        return self.hedge_after, "default"
+
+    def start(self, kind, request, primary):
+        """A Race for request (without its model) on the models for primary."""
+        models = self.models_for(primary)
+        if self.policy == "hedge":
+            return Race(self.engine, self.metrics, kind, request, models, hedge_after=self.threshold(primary)[0])
+        return Race(self.engine, self.metrics, kind, request, models, keep_all=self.policy == "compare")
+
+    def warm_up(self):
+        # Fanned out requests go through the engine's connection, not the chat's own
+        self.engine.submit(self.engine.warm_up())
+
+
+class Race:
+    """One prompt streaming from several models at once, on the engine's event loop.
+
+    Iterating it yields the winner's events: the winner is the first model
+    to send any text, and the others are cancelled right then, which hangs
+    up their connections. With hedge_after, only the first model starts
+    straight away, the rest after that many seconds without a token from it
+    (or as soon as it fails). With keep_all nobody is cancelled, answers()
+    waits for all of them.
+
+    It also stands in for the winner's metrics.CallTimer, so it can be
+    passed where one is expected. Every model's call is timed and recorded
+    on its own, cancelled ones as CANCELLED.
+    """
+
+    def __init__(self, engine, metrics, kind, request, models, hedge_after=None, keep_all=False):
+        self.engine = engine
+        self.metrics = metrics
+        self.kind = kind
+        self.request = request
+        self.models = models
+        self.keep_all = keep_all
+        self.hedge_after = hedge_after
+        self.events = queue.Queue()  # (model, event, DONE or an exception), put from the engine loop
+        self.calls = {}
+        self.futures = {}
+        self.ended = {}  # model -> None when it finished, else why it didn't
+        self.recorded = set()
+        self.pending = {model: [] for model in models}  # events from before anyone won
+        self.texts = {model: [] for model in models}
+        self.winner = None
+        self.hedged = False
+        self.hedge_at = None
+        self.start(models[0])
+        if hedge_after is None:
+            self.hedge()
+        else:
+            self.hedge_at = time.monotonic() + hedge_after
+
+    def start(self, model):
+        self.calls[model] = self.metrics.start(self.kind, model)
+        self.futures[model] = self.engine.submit(self.run(model))
+
+    def hedge(self):
+        self.hedge_at = None
+        for model in self.models:
+            if model not in self.futures:
+                self.hedged = True
+                self.start(model)
+
+    async def run(self, model):
+        try:
+            async for event in self.engine.async_transport().stream(**dict(self.request, model=model)):
+                self.events.put((model, event))
+        except Exception as e:
+            self.events.put((model, e))
+        else:
+            self.events.put((model, DONE))
+
+    def next_event(self):
+        while True:
+            timeout = None
+            if self.hedge_at is not None:
+                timeout = self.hedge_at - time.monotonic()
+                if timeout <= 0:
+                    self.hedge()
+                    continue
+            try:
+                return self.events.get(timeout=timeout)
+            except queue.Empty:
+                pass  # time to hedge
+
+    def take(self, model, item):
+        """Books an item off the queue. True if it was model's last."""
+        if item is DONE or isinstance(item, BaseException):
+            if model not in self.ended:
+                self.ended[model] = None if item is DONE else item
+                if item is not DONE and model != self.winner:
+                    self.record(model, error=item)
+            if item is not DONE and self.hedge_at is not None:
+                self.hedge()  # no point waiting for one that failed
+            return True
+        if model in self.ended:
+            return False  # cancelled, these were already on their way
+        self.calls[model].observe(item)
+        if item.type == "content_block_delta":
+            self.texts[model].append(item.delta.text)
+        return False
+
+    def __iter__(self):
+        while self.winner is not None or len(self.ended) < len(self.futures) or self.hedge_at is not None:
+            model, item = self.next_event()
+            last = self.take(model, item)
+            if self.winner is None:
+                if isinstance(item, BaseException):
+                    continue  # the others may still answer
+                self.pending[model].append(item)
+                if item is not DONE and item.type != "content_block_delta":
+                    continue
+                self.win(model)
+                for event in self.pending.pop(model):
+                    if event is not DONE:
+                        yield event
+                if item is DONE:
+                    return
+            elif model == self.winner:
+                if not last:
+                    yield item
+                elif self.ended[model] is not None:
+                    raise self.ended[model]
+                else:
+                    return
+        # Nobody answered
+        errors = [error for error in self.ended.values() if error is not None]
+        if errors:
+            raise errors[0]
+
+    def win(self, model):
+        self.winner = model
+        for other in self.models:
+            if other != model and not self.keep_all:
+                self.cancel(other)
+
+    def cancel(self, model):
+        if model in self.futures and model not in self.ended:
+            self.futures[model].cancel()
+            self.ended[model] = CANCELLED
+            if model != self.winner:
+                self.record(model, error=CANCELLED)
+
+    def close(self):
+        """Cancels every model still going."""
+        self.hedge_at = None
+        for model in list(self.futures):
+            self.cancel(model)
+
+    def answers(self):
+        """Waits for every model (keep_all). Returns (model, text or the exception) in model order.
+
+        Calls that failed are recorded already, record() the rest.
+        """
+        while len(self.ended) < len(self.futures):
+            self.take(*self.next_event())
+        return [(model, self.ended[model] or "".join(self.texts[model])) for model in self.models]
+
+    def record(self, model, error=None):
+        if model in self.recorded:
+            return None
+        self.recorded.add(model)
+        return self.calls[model].finish(error=error)
+
+    # The metrics.CallTimer side, for the winner
+
+    def observe(self, event):
+        pass  # take() already did, for every model
+
+    @property
+    def usage(self):
+        return self.calls[self.winner].usage if self.winner else None
+
+    def finish(self, response=None, error=None):
+        if self.winner is None:
+            return dict.fromkeys(USAGE_FIELDS, 0)  # the others were recorded as they ended
+        return self.record(self.winner, error=error) or dict.fromkeys(USAGE_FIELDS, 0)
+
+    def report(self):
+        """One line on how the race went, for after the answer."""
+        if self.winner is None:
+            return ""
+        timer = self.calls[self.winner]
+        took = f" in {timer.first_token - timer.start:.2f}s" if timer.first_token else ""
+        if self.hedge_after is not None and not self.hedged:
+            return f"[hedge: {model_name(self.winner)} answered{took}, within {self.hedge_after:.2f}s, no backup needed]"
+        others = [model_name(model) for model in self.futures if model != self.winner]
+        line = f"[{'hedge' if self.hedge_after is not None else 'race'}: {model_name(self.winner)} answered first{took}"
+        if self.hedged and self.hedge_after is not None:
+            line += f", backup started after {self.hedge_after:.2f}s"
+        return line + (f", cancelled {', '.join(others)}" if others else "") + "]"
+
+
+def side_by_side(columns, width):
+    """Lines showing [(title, text)] as columns in width characters, or None if they don't fit."""
+    gap = " | "
+    column = (width - len(gap) * (len(columns) - 1)) // len(columns)
+    if column < MIN_COLUMN:
+        return None
+    wrapped = []
+    for title, text in columns:
+        lines = [title[:column], "-" * min(column, len(title))]
+        for line in text.splitlines():
+            lines.extend(textwrap.wrap(line, column, replace_whitespace=False, drop_whitespace=False) or [""])
+        wrapped.append(lines)
+    return [gap.join(part.ljust(column) for part in row).rstrip()
+            for row in zip_longest(*wrapped, fillvalue="")]
@@ -0,0 +1,120 @@
+import math
+from bisect import bisect_right
+from context import text_of
+from conversation import encode, encoded
+
+
+# Turns shown after a conversation is loaded, /history has the rest
+RECENT_TURNS = 3
+# Terminal lines kept free for the header and the prompt under a page
+CHROME_LINES = 4
+
+
+def line_count(text, width):
+    """Terminal lines text takes up at width columns."""
+    return sum(max(1, math.ceil(len(line) / width)) for line in text.split("\n"))
+
+
+def clip(text, rows, width):
+    """text cut down to about rows terminal lines, and how many lines were left out."""
+    lines = text.split("\n")
+    used = 0
+    for i, line in enumerate(lines):
+        used += max(1, math.ceil(len(line) / width))
+        if used > rows:
+            return "\n".join(lines[:i]), len(lines) - i
+    return text, 0
+
+
+class HistoryView:
+    """Pages through a conversation, decoding and rendering only what's on screen.
+
+    A loaded chat can be thousands of messages. Where each turn starts is
+    indexed from the roles alone (a conversation.Message knows its role
+    without decoding anything), so jumping to turn N is a lookup. search()
+    looks through the messages' encoded JSON first and only decodes the
+    ones that might match. Images show as [image]. The index catches up
+    with messages added since it was built, so keep one view per history.
+    """
+
+    def __init__(self, history):
+        self.history = history
+        self.turns = []  # position of the user message starting each turn
+        self.indexed = 0  # messages self.turns covers
+        self.hits = {}  # query -> positions, for the history length they were found at
+        self.hits_at = 0
+
+    def index(self):
+        """Positions of the user messages, one per turn."""
+        if len(self.history) < self.indexed:
+            # Messages were taken off the end (a cancelled question), start over
+            self.turns, self.indexed = [], 0
+        for i in range(self.indexed, len(self.history)):
+            if self.history[i]["role"] == "user":
+                self.turns.append(i)
+        self.indexed = len(self.history)
+        return self.turns
+
+    def turn_of(self, position):
+        """1-based turn number of the message at position (0 before the first question)."""
+        return bisect_right(self.index(), position)
+
+    def turn_start(self, turn):
+        """Position of turn's first message, clamped to the turns there are."""
+        turns = self.index()
+        if not turns:
+            return 0
+        return turns[min(max(turn, 1), len(turns)) - 1]
+
+    def recent_start(self, turns=RECENT_TURNS):
+        """Position of the first message of the last `turns` turns."""
+        starts = self.index()
+        return starts[-turns] if len(starts) > turns else 0
+
+    def text(self, position):
+        return text_of(self.history[position]["content"])
+
+    def page_from(self, start, rows, width):
+        """[(position, text)] of the messages from start that fit in rows, at least one."""
+        page, used = [], 0
+        for i in range(start, len(self.history)):
+            text = self.text(i)
+            need = line_count(text, width) + 1
+            if page and used + need > rows:
+                break
+            page.append((i, text))
+            used += need
+        return page
+
+    def page_before(self, end, rows, width):
+        """The same for the messages just before end."""
+        page, used = [], 0
+        for i in range(end - 1, -1, -1):
+            text = self.text(i)
+            need = line_count(text, width) + 1
+            if page and used + need > rows:
+                break
+            page.append((i, text))
+            used += need
+        return page[::-1]
+
+    def search(self, query):
+        """Positions of the messages with query in their text, ignoring case."""
+        if self.hits_at != len(self.history):
+            self.hits, self.hits_at = {}, len(self.history)
+        query = query.lower()
+        if query not in self.hits:
+            # Escaped like the JSON it's looked for in; bytes.lower() only
+            # folds ASCII, so anything else is checked on the decoded text
+            needle = encode(query)[1:-1] if query.isascii() else b""
+            self.hits[query] = [i for i in range(len(self.history))
+                                if needle in encoded(self.history[i]).lower() and query in self.text(i).lower()]
+        return self.hits[query]
+
+    def next_hit(self, query, after):
+        """(position, number) of the first match after position `after`, wrapping around. None if none."""
+        hits = self.search(query)
+        if not hits:
+            return None
+        number = bisect_right(hits, after) % len(hits)
+        return hits[number], number + 1
@@ -0,0 +1,176 @@
+import base64
+import hashlib
+import io
+import os
+from collections import OrderedDict
+from context import has_images
+
+
+IMAGE_DIR = ".clarde_images"
+
+MEDIA_TYPES = {
+    'jpg': 'image/jpeg',
+    'jpeg': 'image/jpeg',
+    'png': 'image/png',
+    'gif': 'image/gif',
+    'webp': 'image/webp'
+}
+EXTENSIONS = {
+    'image/jpeg': 'jpg',
+    'image/png': 'png',
+    'image/gif': 'gif',
+    'image/webp': 'webp'
+}
+
+# Anything bigger than this gets downscaled by the API anyway, so we might as
+# well do it before uploading
+MAX_DIMENSION = 1568
+MAX_PIXELS = 1150000
+
+
+def downscale(data, media_type):
+    """Shrinks an image to the API's recommended size. Needs Pillow, otherwise a no-op."""
+    try:
+        from PIL import Image
+    except ImportError:
+        return data
+
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            if getattr(img, "is_animated", False):
+                return data
+            width, height = img.size
+            scale = min(MAX_DIMENSION / max(width, height), (MAX_PIXELS / (width * height)) ** 0.5)
+            if scale >= 1:
+                return data
+
+            img = img.resize((int(width * scale), int(height * scale)), Image.LANCZOS)
+            out = io.BytesIO()
+            if media_type == 'image/jpeg':
+                img.convert('RGB').save(out, format='JPEG', quality=85, optimize=True)
+            else:
+                img.save(out, format=EXTENSIONS[media_type].upper().replace('JPG', 'JPEG'))
+            smaller = out.getvalue()
+            return smaller if len(smaller) < len(data) else data
+    except Exception:
+        # Not worth failing the attachment over, just send the original
+        return data
+
+
+class ImageStore:
+    """Content-addressed store for attached images.
+
+    The history only holds a small reference block,
+    {"type": "image", "source": {"type": "ref", "hash": ..., "media_type": ...}},
+    and the image itself lives once in IMAGE_DIR under its sha256. The base64
+    payload the API wants is only built when a request goes out.
+    """
+
+    def __init__(self, directory=IMAGE_DIR, cache_size=8):
+        self.directory = directory
+        self.cache = OrderedDict()  # hash -> base64, for the images in use right now
+        self.cache_size = cache_size
+
+    def add(self, path, resize=True, once=False):
+        """Stores the image at path and returns a reference block for it."""
+        ext = path.lower().split('.')[-1]
+        media_type = MEDIA_TYPES.get(ext)
+        if not media_type:
+            raise ValueError(f"Unsupported image format: {ext}")
+
+        with open(path, 'rb') as img_file:
+            data = img_file.read()
+        if resize:
+            data = downscale(data, media_type)
+        return self.add_bytes(data, media_type, once=once)
+
+    def add_bytes(self, data, media_type, once=False):
+        digest = hashlib.sha256(data).hexdigest()
+        blob_path = self.blob_path(digest, media_type)
+        if not os.path.exists(blob_path):
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_path = blob_path + ".tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, blob_path)
+
+        ref = {"type": "image", "source": {"type": "ref", "hash": digest, "media_type": media_type}}
+        if once:
+            ref["once"] = True
+        return ref
+
+    def blob_path(self, digest, media_type):
+        return os.path.join(self.directory, f"{digest}.{EXTENSIONS.get(media_type, 'bin')}")
+
+    def load_base64(self, digest, media_type):
+        if digest in self.cache:
+            self.cache.move_to_end(digest)
+            return self.cache[digest]
+
+        with open(self.blob_path(digest, media_type), 'rb') as f:
+            encoded = base64.b64encode(f.read()).decode('utf-8')
+        self.cache[digest] = encoded
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return encoded
+
+    def materialize(self, messages):
+        """Returns messages ready to send, with image references swapped for base64.
+
+        One-shot images (attached with --once) are only sent with the message
+        they were attached to; after that they're replaced by a short note.
+        Messages without images are passed through untouched.
+        """
+        result = []
+        last = len(messages) - 1
+        for i, message in enumerate(messages):
+            if not has_images(message):
+                result.append(message)
+                continue
+            content = message["content"]
+            if not any(is_image_ref(block) for block in content):
+                result.append(message)
+                continue
+
+            blocks = []
+            for block in content:
+                if not is_image_ref(block):
+                    blocks.append(block)
+                    continue
+                source = block["source"]
+                if block.get("once") and i != last:
+                    new_block = {"type": "text", "text": "[image sent earlier]"}
+                else:
+                    new_block = {
+                        "type": "image",
+                        "source": {
+                            "type": "base64",
+                            "media_type": source["media_type"],
+                            "data": self.load_base64(source["hash"], source["media_type"])
+                        }
+                    }
+                if "cache_control" in block:
+                    new_block["cache_control"] = block["cache_control"]
+                blocks.append(new_block)
+            result.append({"role": message["role"], "content": blocks})
+        return result
+
+    def dehydrate(self, message):
+        """Moves inline base64 images of an old saved message into the store."""
+        content = message.get("content")
+        if not isinstance(content, list):
+            return message
+
+        blocks = []
+        changed = False
+        for block in content:
+            source = block.get("source", {}) if block.get("type") == "image" else {}
+            if source.get("type") == "base64":
+                block = self.add_bytes(base64.b64decode(source["data"]), source["media_type"])
+                changed = True
+            blocks.append(block)
+        return {**message, "content": blocks} if changed else message
+
+
+def is_image_ref(block):
+    return block.get("type") == "image" and block.get("source", {}).get("type") == "ref"
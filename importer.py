@@ -0,0 +1,154 @@
+import codecs
+import fnmatch
+import glob
+import hashlib
+import os
+import re
+from context import estimate_tokens
+
+
+CHUNK_SIZE = 64 * 1024
+MAX_FILE_BYTES = 512 * 1024  # files bigger than this are cut off
+MAX_TOTAL_BYTES = 2 * 1024 * 1024  # stop adding files past this
+
+# Always skipped when importing a directory, on top of its .gitignore
+DEFAULT_IGNORES = [
+    ".git", ".hg", ".svn", "__pycache__", "node_modules", ".venv", "venv", ".tox",
+    ".mypy_cache", ".pytest_cache", ".idea", ".vscode", "dist", "build", "*.egg-info",
+    ".clarde_images", ".clarde_index.db", "conversation_*.json", "conversation_*.jsonl",
+    "*.pyc", "*.pyo", "*.so", "*.dll", "*.exe", "*.zip", "*.gz", "*.png", "*.jpg", "*.jpeg", "*.gif", "*.webp", "*.pdf",
+]
+
+HASH_MARKER = re.compile(r"\(sha256:([0-9a-f]{64})\)")
+
+
+class ImportedFile:
+    def __init__(self, path, text, digest, size, truncated):
+        self.path = path
+        self.text = text
+        self.digest = digest
+        self.size = size
+        self.truncated = truncated
+        self.lines = text.count("\n") + (0 if text.endswith("\n") else 1) if text else 0
+        self.tokens = estimate_tokens(text)
+
+
+def read_file(path, max_bytes=MAX_FILE_BYTES):
+    """Reads a text file in chunks, hashing as it goes.
+
+    Returns (ImportedFile, None), or (None, reason) for binary files. Only the
+    first max_bytes are kept; the hash always covers the whole file so the
+    same file is recognised however it was cut.
+    """
+    sha = hashlib.sha256()
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    parts = []
+    kept = 0
+    size = 0
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            if size == 0 and b"\0" in chunk[:8192]:
+                return None, "binary"
+            size += len(chunk)
+            sha.update(chunk)
+            if kept < max_bytes:
+                piece = chunk[:max_bytes - kept]
+                kept += len(piece)
+                parts.append(decoder.decode(piece))
+    parts.append(decoder.decode(b"", final=True))
+    return ImportedFile(path, "".join(parts), sha.hexdigest(), size, size > kept), None
+
+
+def read_ignore_file(directory):
+    patterns = []
+    path = os.path.join(directory, ".gitignore")
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8', errors='replace') as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith(("#", "!")):
+                    patterns.append(line.strip("/"))
+    return patterns
+
+
+def ignored(relpath, patterns):
+    name = os.path.basename(relpath)
+    return any(fnmatch.fnmatch(name, p) or fnmatch.fnmatch(relpath, p) for p in patterns)
+
+
+def expand(target):
+    """Files named by target: a file, a directory (walked), or a glob pattern."""
+    if os.path.isdir(target):
+        patterns = DEFAULT_IGNORES + read_ignore_file(target)
+        files = []
+        for root, dirs, names in os.walk(target):
+            rel_root = os.path.relpath(root, target)
+            dirs[:] = sorted(d for d in dirs if not ignored(os.path.normpath(os.path.join(rel_root, d)), patterns))
+            for name in sorted(names):
+                if not ignored(os.path.normpath(os.path.join(rel_root, name)), patterns):
+                    files.append(os.path.join(root, name))
+        return files
+    if glob.has_magic(target):
+        return sorted(p for p in glob.glob(target, recursive=True) if os.path.isfile(p))
+    return [target]
+
+
+class Importer:
+    """Reads files for /import and remembers what has been imported already.
+
+    Files are recognised by content hash, so importing the same file twice
+    (or the same content under another name) doesn't store it twice.
+    """
+
+    def __init__(self, max_file_bytes=MAX_FILE_BYTES, max_total_bytes=MAX_TOTAL_BYTES):
+        self.max_file_bytes = max_file_bytes
+        self.max_total_bytes = max_total_bytes
+        self.seen = set()
+
+    def remember(self, history):
+        """Picks up the hashes of files imported earlier in a loaded conversation."""
+        self.seen = set()
+        for message in history:
+            if message["role"] == "assistant" and isinstance(message["content"], str):
+                self.seen.update(HASH_MARKER.findall(message["content"]))
+
+    def collect(self, target):
+        """Returns (files to import, [(path, reason)] skipped)."""
+        files = []
+        skipped = []
+        total = 0
+        digests = set()
+        for path in expand(target):
+            if not os.path.exists(path):
+                skipped.append((path, "not found"))
+                continue
+            if total >= self.max_total_bytes:
+                skipped.append((path, "total size cap reached"))
+                continue
+            try:
+                imported, reason = read_file(path, min(self.max_file_bytes, self.max_total_bytes - total))
+            except (OSError, UnicodeError) as e:
+                skipped.append((path, str(e)))
+                continue
+            if reason:
+                skipped.append((path, reason))
+                continue
+            if imported.digest in self.seen or imported.digest in digests:
+                skipped.append((path, "already imported"))
+                continue
+            digests.add(imported.digest)
+            total += len(imported.text.encode('utf-8'))
+            files.append(imported)
+        return files, skipped
+
+    def message_for(self, files):
+        """Assistant message holding the imported files, one fenced block each."""
+        parts = []
+        for f in files:
+            file_ext = f.path.split('.')[-1].lower() if '.' in os.path.basename(f.path) else ""
+            note = f" (first {len(f.text.encode('utf-8'))} of {f.size} bytes)" if f.truncated else ""
+            parts.append(f"I've imported the file '{f.path}' (sha256:{f.digest}){note}. Here's its content:\n\n```{file_ext}\n{f.text}\n```")
+        return "\n\n".join(parts)
@@ -0,0 +1,204 @@
+import json
+import os
+import threading
+import time
+from collections import deque, defaultdict
+from context import USAGE_FIELDS, read_usage
+
+
+# USD per million tokens: input, output, cache write, cache read
+PRICES = {
+    "claude-3-haiku-20240307": (0.25, 1.25, 0.30, 0.03),
+    "claude-3-5-sonnet-20241022": (3.00, 15.00, 3.75, 0.30),
+}
+# The error of calls that were stopped on purpose, e.g. the losers of a fan-out race
+CANCELLED = "cancelled"
+
+
+def cost_of(model, usage):
+    prices = PRICES.get(model)
+    if not prices:
+        return 0.0
+    input_price, output_price, write_price, read_price = prices
+    return (usage["input_tokens"] * input_price + usage["output_tokens"] * output_price
+            + usage["cache_creation_input_tokens"] * write_price
+            + usage["cache_read_input_tokens"] * read_price) / 1000000
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+class CallTimer:
+    """Times one API call. Feed it the stream's events, then call finish()."""
+
+    def __init__(self, store, kind, model):
+        self.store = store
+        self.kind = kind
+        self.model = model
+        self.start = time.perf_counter()
+        self.first_token = None
+        self.usage = None
+        self.earlier = dict.fromkeys(USAGE_FIELDS, 0)  # requests before a resumed stream
+        self.cached = False  # replayed from the response cache, nothing was spent
+
+    def observe(self, event):
+        if event.type == "cache_hit":
+            self.cached = True
+        elif event.type == "content_block_delta":
+            if self.first_token is None:
+                self.first_token = time.perf_counter()
+        elif event.type == "message_start":
+            if self.usage:
+                # The stream broke and was resumed, the first request still counts
+                for field in USAGE_FIELDS:
+                    self.earlier[field] += self.usage[field]
+            self.usage = read_usage(event.message.usage)
+        elif event.type == "message_delta":
+            self.usage = read_usage(event.usage, self.usage)
+
+    def finish(self, response=None, error=None):
+        """Records the call. Pass the response for non-streamed calls."""
+        end = time.perf_counter()
+        if response is not None:
+            self.usage = read_usage(response.usage)
+        usage = self.usage or dict.fromkeys(USAGE_FIELDS, 0)
+        usage = {field: usage[field] + self.earlier[field] for field in USAGE_FIELDS}
+
+        latency = end - self.start
+        ttft = (self.first_token - self.start) if self.first_token else None
+        generating = (end - self.first_token) if self.first_token else latency
+        record = {
+            "time": time.time(),
+            "kind": self.kind,
+            "model": self.model,
+            "ttft": ttft,
+            "latency": latency,
+            "tokens_per_sec": usage["output_tokens"] / generating if generating > 0 else None,
+            **usage,
+            "cost": 0.0 if self.cached else cost_of(self.model, usage),
+            "cached": self.cached,
+            "error": str(error) if error else None,
+        }
+        self.store.record(record)
+        return record
+
+
+class MetricsStore:
+    """Rolling in-process store of per-call timings and token usage.
+
+    Keeps the last `size` calls for percentiles, plus running totals. Set
+    CLARDE_METRICS_JSONL to append every call to a JSONL file, and/or
+    CLARDE_METRICS_PROM to keep a Prometheus textfile up to date.
+    """
+
+    def __init__(self, size=500, jsonl_path=None, prom_path=None):
+        self.records = deque(maxlen=size)
+        self.totals = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.lock = threading.Lock()
+        self.jsonl_path = jsonl_path or os.getenv("CLARDE_METRICS_JSONL")
+        self.prom_path = prom_path or os.getenv("CLARDE_METRICS_PROM")
+        self.exported = {}  # path -> last record appended to it
+
+    def start(self, kind, model):
+        return CallTimer(self, kind, model)
+
+    def record(self, record):
+        with self.lock:
+            self.records.append(record)
+            self.calls[(record["kind"], record["model"])] += 1
+            for field in USAGE_FIELDS + ("cost",):
+                self.totals[field] += record[field]
+        if self.jsonl_path:
+            self.export_jsonl(self.jsonl_path, [record])
+        if self.prom_path:
+            self.export_prometheus(self.prom_path)
+
+    def summary(self):
+        with self.lock:
+            records = list(self.records)
+            totals = dict(self.totals)
+        ttfts = [r["ttft"] for r in records if r["ttft"] is not None]
+        latencies = [r["latency"] for r in records]
+        rates = [r["tokens_per_sec"] for r in records if r["tokens_per_sec"]]
+        return {
+            "calls": sum(self.calls.values()),
+            "errors": sum(1 for r in records if r["error"] and r["error"] != CANCELLED),
+            "cancelled": sum(1 for r in records if r["error"] == CANCELLED),
+            "cached": sum(1 for r in records if r.get("cached")),
+            "ttft_p50": percentile(ttfts, 50),
+            "ttft_p95": percentile(ttfts, 95),
+            "latency_p50": percentile(latencies, 50),
+            "latency_p95": percentile(latencies, 95),
+            "tokens_per_sec": sum(rates) / len(rates) if rates else None,
+            **{field: int(totals.get(field, 0)) for field in USAGE_FIELDS},
+            "cost": totals.get("cost", 0.0),
+        }
+
+    def model_ttfts(self, model):
+        with self.lock:
+            return [r["ttft"] for r in self.records if r["model"] == model and r["ttft"] is not None]
+
+    def models(self):
+        """Models called so far, in the order they were first used."""
+        with self.lock:
+            return list(dict.fromkeys(r["model"] for r in self.records))
+
+    def export_jsonl(self, path, records=None):
+        """Appends records to path, by default the ones not already exported there."""
+        key = os.path.abspath(path)
+        with self.lock:
+            if records is None:
+                records = list(self.records)
+                last = self.exported.get(key)
+                for index, record in enumerate(records):
+                    if record is last:
+                        records = records[index + 1:]
+                        break
+            if records:
+                self.exported[key] = records[-1]
+        with open(path, 'a', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+        return len(records)
+
+    def export_prometheus(self, path):
+        """Writes a node_exporter textfile collector file (atomically)."""
+        summary = self.summary()
+        lines = [
+            "# HELP clarde_api_calls_total API calls made by clarde.",
+            "# TYPE clarde_api_calls_total counter",
+        ]
+        with self.lock:
+            calls = dict(self.calls)
+        for (kind, model), count in sorted(calls.items()):
+            lines.append(f'clarde_api_calls_total{{kind="{kind}",model="{model}"}} {count}')
+        lines += [
+            "# HELP clarde_tokens_total Tokens used, by type.",
+            "# TYPE clarde_tokens_total counter",
+        ]
+        for field in USAGE_FIELDS:
+            lines.append(f'clarde_tokens_total{{type="{field.replace("_tokens", "")}"}} {summary[field]}')
+        lines += [
+            "# HELP clarde_cost_dollars_total Estimated API cost in USD.",
+            "# TYPE clarde_cost_dollars_total counter",
+            f"clarde_cost_dollars_total {summary['cost']:.6f}",
+        ]
+        for name, key in (("ttft", "ttft"), ("latency", "latency")):
+            lines += [
+                f"# HELP clarde_{name}_seconds API {name.replace('ttft', 'time to first token')} over recent calls.",
+                f"# TYPE clarde_{name}_seconds summary",
+            ]
+            for quantile in ("50", "95"):
+                value = summary[f"{key}_p{quantile}"]
+                if value is not None:
+                    lines.append(f'clarde_{name}_seconds{{quantile="0.{quantile}"}} {value:.4f}')
+
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, path)
@@ -0,0 +1,162 @@
+import json
+import os
+import sys
+import time
+import colors
+from renderer import MarkdownRenderer, PlainRenderer, render_text
+
+
+# auto is tty when stdout is a terminal, plain when it's a pipe or a file
+BACKENDS = ("auto", "tty", "plain", "ndjson")
+
+_current = None
+
+
+def configure_from_args(argv):
+    """Takes --output NAME out of argv, passed on as CLARDE_OUTPUT like the cache flags."""
+    rest = []
+    args = iter(argv)
+    for arg in args:
+        if arg == "--output":
+            os.environ["CLARDE_OUTPUT"] = next(args, "auto")
+        elif arg.startswith("--output="):
+            os.environ["CLARDE_OUTPUT"] = arg.split("=", 1)[1]
+        else:
+            rest.append(arg)
+    return rest
+
+
+def event_line(event_type, **fields):
+    return json.dumps({"type": event_type, **fields}) + "\n"
+
+
+class TTYOutput:
+    """Colours and markdown styling, for a terminal.
+
+    Answers go through MarkdownRenderer's buffer and the style table in
+    colors, straight to stdout. `out` is None for whatever sys.stdout is
+    at the time.
+    """
+
+    name = "tty"
+    styled = True
+
+    def __init__(self, out=None):
+        self.out = out
+
+    def renderer(self):
+        return MarkdownRenderer(out=self.out)
+
+    def render(self, text):
+        """A whole message at once, e.g. from the history."""
+        render_text(text, out=self.out)
+
+    def start_answer(self, label="Claude:"):
+        print(f"{colors.yellow_text(label)} ", end="", flush=True, file=self.out)
+
+    def end_answer(self, note=None):
+        """Ends the answer's line, with note (e.g. that it was interrupted) at the end."""
+        print(colors.Red_text(f" {note}") if note else "", file=self.out)
+
+    def report(self, text):
+        """A line about the answer just shown, like how a fan-out race went."""
+        print(colors.code_text(text), file=self.out)
+
+    def usage(self, record, report=None):
+        """A finished call's metrics record, and its one line report if it has usage."""
+        if report:
+            self.report(report)
+
+    def error(self, message):
+        print(colors.Red_text(message), file=self.out)
+
+
+class PlainOutput(TTYOutput):
+    """No escape codes and no markdown styling: answers come through as written."""
+
+    name = "plain"
+    styled = False
+
+    def renderer(self):
+        return PlainRenderer(out=self.out)
+
+    def render(self, text):
+        (self.out or sys.stdout).write(text)
+
+
+class NDJSONOutput(PlainOutput):
+    """One JSON event per line on stdout, for other programs to read.
+
+    {"type": "delta", "text": ...} as the answer comes in, {"type": "usage",
+    ...} with the call's metrics record when it's done, {"type": "error",
+    "message": ...} if it failed or was interrupted. Everything meant for a
+    person (menus, prompts, reports) goes to stderr instead, see setup().
+    """
+
+    name = "ndjson"
+
+    def __init__(self, out=None):
+        super().__init__(out if out is not None else sys.stdout)
+
+    def renderer(self):
+        return NDJSONRenderer(out=self.out)
+
+    def render(self, text):
+        sys.stdout.write(text)  # the history is for reading, so stderr
+
+    def emit(self, event_type, **fields):
+        self.out.write(event_line(event_type, **fields))
+        self.out.flush()
+
+    def start_answer(self, label="Claude:"):
+        pass
+
+    def end_answer(self, note=None):
+        if note:
+            self.emit("error", message=note)
+
+    def report(self, text):
+        print(text)
+
+    def usage(self, record, report=None):
+        self.emit("usage", **{key: value for key, value in record.items() if key != "error"})
+
+    def error(self, message):
+        self.emit("error", message=message)
+
+
+class NDJSONRenderer(PlainRenderer):
+    """Deltas as NDJSON events, what came in since the last flush joined into one."""
+
+    def flush(self):
+        if self.buffer:
+            self.out.write(event_line("delta", text="".join(self.buffer)))
+            self.out.flush()
+            self.buffer = []
+            self.buffered = 0
+        self.last_flush = time.monotonic()
+
+
+OUTPUTS = {"tty": TTYOutput, "plain": PlainOutput, "ndjson": NDJSONOutput}
+
+
+def setup(name=None):
+    """Picks the backend from name, CLARDE_OUTPUT or whether stdout is a terminal.
+
+    Called once from main(). With ndjson, sys.stdout is pointed at stderr
+    afterwards, so only the events are left on the real stdout.
+    """
+    global _current
+    name = name or os.getenv("CLARDE_OUTPUT", "auto")
+    if name not in OUTPUTS:
+        name = "tty" if sys.stdout.isatty() else "plain"
+    _current = OUTPUTS[name]()
+    colors.setup(styled=_current.styled)
+    if name == "ndjson":
+        sys.stdout = sys.stderr
+    return _current
+
+
+def current():
+    """The backend main() set up, a terminal one if it hasn't (e.g. in benchmarks)."""
+    return _current or TTYOutput()
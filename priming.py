@@ -0,0 +1,101 @@
+import os
+from context import message_tokens, with_breakpoint
+from engine import result_or
+
+
+# Prompt caching doesn't start below this many tokens of prefix, so there's
+# nothing to prime in a shorter conversation
+MIN_CACHEABLE_TOKENS = {"claude-3-haiku-20240307": 2048}
+DEFAULT_MIN_CACHEABLE = 1024
+# The first turn waits at most this long for a priming request still going,
+# rather than paying for the same prefill twice
+PRIME_WAIT = 10.0
+# Stands in for the user's next message, the primed prefix ends just before it
+PROBE = {"role": "user", "content": "."}
+
+
+class CachePrimer:
+    """Warms the prompt cache for a conversation that was just loaded.
+
+    Opt-in with CLARDE_PRIME=on. start() sends the loaded history the way
+    the next turn will, with a breakpoint on its last message and a one
+    token answer, from the engine loop while the user reads the history and
+    types. The first real turn then reads the whole history from the cache
+    instead of prefilling it. Histories under MIN_CACHEABLE_TOKENS, or too
+    long to be sent as they are, aren't primed.
+
+    It goes straight to the API, past the response cache: an answer from
+    disk wouldn't warm anything.
+    """
+
+    def __init__(self, engine, metrics, enabled=None, min_tokens=None):
+        self.engine = engine
+        self.metrics = metrics
+        self.enabled = enabled if enabled is not None else os.getenv("CLARDE_PRIME", "off") == "on"
+        self.min_tokens = min_tokens
+        self.future = None  # the priming request going on
+        self.primed = None  # its record, for the first turn to compare against
+        self.results = []  # (primed tokens, priming cost, seconds saved) per loaded conversation
+
+    def start(self, context, image_store, model, history):
+        """Starts priming history for model in the background. False if it's not worth it."""
+        self.forget()
+        if not self.enabled or not history:
+            return False
+        tokens = sum(message_tokens(m) for m in history)
+        minimum = self.min_tokens or MIN_CACHEABLE_TOKENS.get(model, DEFAULT_MIN_CACHEABLE)
+        if tokens < minimum or tokens > context.budget:
+            return False
+        messages = list(context.window(history))
+        messages[-1] = with_breakpoint(messages[-1])
+        request = {"model": str(model), "max_tokens": 1, "messages": image_store.materialize(messages + [PROBE])}
+        self.future = self.engine.submit(self.prime(request))
+        return True
+
+    def forget(self):
+        """Drops priming that no longer applies, e.g. after /clear."""
+        self.future = None
+        self.primed = None
+
+    async def prime(self, request):
+        transport = self.engine.async_transport()
+        if transport.cache.mode == "replay":
+            return None  # offline
+        call = self.metrics.start("prime", request["model"])
+        try:
+            response = await transport.send(await transport.get_client(), request)
+        except Exception as e:
+            call.finish(error=e)
+            return None
+        return call.finish(response)
+
+    def wait(self):
+        """Lets a priming request that's still going finish before the first turn is sent."""
+        if self.future is not None:
+            self.primed = result_or(self.future, PRIME_WAIT)
+            self.future = None
+
+    def report(self, record):
+        """One line on what priming did for the turn in record, None for any turn but the first after it."""
+        primed, self.primed = self.primed, None
+        if primed is None or record.get("cached"):
+            return None
+        tokens = primed["cache_creation_input_tokens"] + primed["cache_read_input_tokens"]
+        line = f"[cache priming: {tokens} tokens in {primed['latency']:.2f}s for ${primed['cost']:.4f}"
+        if not record["cache_read_input_tokens"]:
+            # The cache lasts 5 minutes from the last time it was used
+            self.results.append((tokens, primed["cost"], 0.0))
+            return line + " | not used, the first turn missed the cache]"
+        if record["ttft"] is None:
+            return line + "]"
+        # Priming took about as long as the first turn would have without it
+        saved = primed["latency"] - record["ttft"]
+        self.results.append((tokens, primed["cost"], saved))
+        return line + f" | first answer after {record['ttft']:.2f}s, ~{saved:.2f}s sooner than cold]"
+
+    def summary(self):
+        """(conversations primed, total cost, average seconds saved), None before any."""
+        if not self.results:
+            return None
+        return (len(self.results), sum(cost for _, cost, _ in self.results),
+                sum(saved for _, _, saved in self.results) / len(self.results))
@@ -0,0 +1,265 @@
+import cProfile
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+
+
+PROFILE_DIR = ".clarde_profile"
+# on: spans only. cprofile and stacks also write a profile of every turn,
+# as pstats or as collapsed stacks for flame graph tools
+MODES = ("off", "on", "cprofile", "stacks")
+# Seconds between stack samples in stacks mode
+SAMPLE_INTERVAL = 0.001
+# Span names shown in the summary
+TOP = 8
+
+OFF = nullcontext()
+
+
+def configure_from_args(argv):
+    """Takes --profile[=cprofile|stacks] and --profile-dir DIR out of argv, passed on like the cache flags."""
+    rest = []
+    args = iter(argv)
+    for arg in args:
+        if arg == "--profile":
+            os.environ["CLARDE_PROFILE"] = "on"
+        elif arg.startswith("--profile="):
+            os.environ["CLARDE_PROFILE"] = arg.split("=", 1)[1]
+        elif arg == "--profile-dir":
+            os.environ["CLARDE_PROFILE_DIR"] = next(args, PROFILE_DIR)
+        else:
+            rest.append(arg)
+    return rest
+
+
+class Span:
+    """One timed piece of work, and the spans inside it."""
+
+    def __init__(self, name):
+        self.name = name
+        self.children = []
+        self.api = 0.0  # waiting on the API, see Profiler.waiting()
+        self.memory = None  # traced bytes at the start
+        self.peak = 0  # highest traced bytes seen so far
+        self.start = time.perf_counter()
+        self.cpu = time.thread_time()
+
+    def finish(self):
+        wall = time.perf_counter() - self.start
+        record = {
+            "name": self.name,
+            "wall": wall,
+            "cpu": time.thread_time() - self.cpu,
+            "api": self.api,
+            "client": max(0.0, wall - self.api),
+        }
+        if self.memory is not None and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            self.peak = max(self.peak, peak)
+            record["alloc"] = current - self.memory
+            record["peak"] = self.peak - self.memory
+        if self.children:
+            record["children"] = self.children
+        return record
+
+
+class StackSampler:
+    """Samples one thread's stack every SAMPLE_INTERVAL seconds into collapsed stacks."""
+
+    def __init__(self, thread_id, interval=SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts = Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="clarde-profiler", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.counts[";".join(reversed(stack))] += 1
+
+    def stop(self, path):
+        self.stopped.set()
+        self.thread.join()
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in self.counts.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class Profiler:
+    """Lightweight spans around the client side of each turn and command.
+
+    A span takes wall and CPU time (of its own thread) and, while
+    profiling, the memory allocated inside it via tracemalloc. Time spent
+    waiting for the next event of a stream passed through waiting() is
+    counted as API time, the rest of a span's wall time is ours. Every
+    span that isn't inside another one is appended to spans.jsonl in the
+    profile directory, and with mode cprofile or stacks each turn also
+    gets a profile file of its own.
+
+    Set up from CLARDE_PROFILE (one of MODES) and CLARDE_PROFILE_DIR
+    unless given explicitly. When off, span() and waiting() cost next to
+    nothing.
+    """
+
+    def __init__(self, mode=None, directory=None):
+        self.directory = directory or os.getenv("CLARDE_PROFILE_DIR", PROFILE_DIR)
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.records = []  # spans that finished this session, outermost only
+        self.session = datetime.now().strftime('%Y%m%d_%H%M%S')
+        self.turns = 0
+        self.mode = "off"
+        self.set_mode(mode or os.getenv("CLARDE_PROFILE", "off"))
+
+    @property
+    def enabled(self):
+        return self.mode != "off"
+
+    def set_mode(self, mode):
+        self.mode = mode if mode in MODES else "off"
+        if self.enabled and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        elif not self.enabled and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def stack(self):
+        if not hasattr(self.local, "stack"):
+            self.local.stack = []
+        return self.local.stack
+
+    def span(self, name):
+        """Context manager timing the work inside it as `name`."""
+        if not self.enabled:
+            return OFF
+        return self.timed(name)
+
+    @contextmanager
+    def timed(self, name, profile=None):
+        stack = self.stack()
+        span = Span(name)
+        if tracemalloc.is_tracing():
+            span.memory, peak = tracemalloc.get_traced_memory()
+            # The peak is reset for this span, so carry it up to the ones around it first
+            for outer in stack:
+                outer.peak = max(outer.peak, peak)
+            tracemalloc.reset_peak()
+            span.peak = span.memory
+        stack.append(span)
+        try:
+            yield span
+        finally:
+            stack.pop()
+            record = span.finish()
+            if stack:
+                stack[-1].children.append(record)
+                stack[-1].api += span.api
+                stack[-1].peak = max(stack[-1].peak, span.peak)
+            else:
+                record["time"] = time.time()
+                if profile:
+                    record["profile"] = profile
+                self.save(record)
+
+    @contextmanager
+    def turn(self, user_input):
+        """A span around one line typed at the prompt, named after the command or 'chat'."""
+        if not self.enabled:
+            yield
+            return
+        name = user_input.split()[0].lower() if user_input.startswith("/") else "chat"
+        self.turns += 1
+        path = None
+        profile = sampler = None
+        if self.mode in ("cprofile", "stacks"):
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, f"{self.session}_{self.turns:04d}_{name.lstrip('/')}"
+                                                + (".pstats" if self.mode == "cprofile" else ".folded"))
+            if self.mode == "cprofile":
+                profile = cProfile.Profile()
+                profile.enable()
+            else:
+                sampler = StackSampler(threading.get_ident())
+                sampler.start()
+        try:
+            with self.timed(name, profile=path):
+                yield
+        finally:
+            if profile is not None:
+                profile.disable()
+                profile.dump_stats(path)
+            if sampler is not None:
+                sampler.stop(path)
+
+    def waiting(self, events):
+        """Passes events on, counting the time spent waiting for each one as API time."""
+        if not self.enabled:
+            return events
+        return self.waited(events)
+
+    def waited(self, events):
+        stack = self.stack()
+        iterator = iter(events)
+        while True:
+            start = time.perf_counter()
+            try:
+                event = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                if stack:
+                    stack[-1].api += time.perf_counter() - start
+            yield event
+
+    def save(self, record):
+        with self.lock:
+            self.records.append(record)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(os.path.join(self.directory, "spans.jsonl"), 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record) + "\n")
+        except OSError:
+            pass  # the summary still has it
+
+    def summary(self, top=TOP):
+        """Lines for /profile: where the time of the turns went, then the spans that cost us the most."""
+        with self.lock:
+            records = list(self.records)
+        if not records:
+            return []
+        turns = [r for r in records if r["name"] == "chat" or r["name"].startswith("/")]
+        wall = sum(r["wall"] for r in turns)
+        api = sum(r["api"] for r in turns)
+        lines = [f"Turns: {len(turns)} | {wall:.2f}s in all | waiting on the API {api:.2f}s | "
+                 f"ours {wall - api:.2f}s ({(wall - api) / wall:.0%})" if wall else f"Turns: {len(turns)}"]
+
+        totals = defaultdict(lambda: {"count": 0, "client": 0.0, "cpu": 0.0, "peak": 0})
+        pending = list(records)
+        while pending:
+            record = pending.pop()
+            total = totals[record["name"]]
+            total["count"] += 1
+            total["client"] += record["client"]
+            total["cpu"] += record["cpu"]
+            total["peak"] = max(total["peak"], record.get("peak", 0))
+            pending.extend(record.get("children", ()))
+        lines.append("Top client-side costs (spans include the ones inside them):")
+        for name, total in sorted(totals.items(), key=lambda item: -item[1]["client"])[:top]:
+            lines.append(f"  {name:<16}{total['count']:>5}x  ours {total['client'] * 1000:>9.1f}ms  "
+                         f"cpu {total['cpu'] * 1000:>9.1f}ms  peak {total['peak'] / 1024:>8.0f}KB")
+        return lines
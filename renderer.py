@@ -0,0 +1,197 @@
+import math
+import re
+import sys
+import threading
+import time
+import colors
+
+
+# Matches the markers we care about. Everything in between is plain text.
+MARKERS = re.compile(r"```|\*\*")
+
+
+class IdleFlusher:
+    """One thread that flushes renderers whose stream paused with output still buffered.
+
+    A renderer schedules itself when something stays in its buffer, at
+    most once per flush interval. Shared by all of them, so a response
+    doesn't pay for starting a thread.
+    """
+
+    def __init__(self):
+        self.wakeup = threading.Condition(threading.Lock())
+        self.due = {}  # renderer -> monotonic time to flush it at
+        self.thread = None
+
+    def schedule(self, renderer, at):
+        with self.wakeup:
+            self.due[renderer] = min(at, self.due.get(renderer, at))
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="clarde-flusher", daemon=True)
+                self.thread.start()
+            self.wakeup.notify()
+
+    def run(self):
+        while True:
+            with self.wakeup:
+                now = time.monotonic()
+                ready = [renderer for renderer, at in self.due.items() if at <= now]
+                for renderer in ready:
+                    del self.due[renderer]
+                if not ready:
+                    self.wakeup.wait(min(self.due.values()) - now if self.due else None)
+                    continue
+            for renderer in ready:
+                renderer.flush_if_idle()
+
+
+FLUSHER = IdleFlusher()
+
+
+class MarkdownRenderer:
+    """Incremental renderer for Claude's markdown output.
+
+    Feed it whole deltas as they come off the stream. Code block (```) and
+    bold (**) state is carried between calls, so a marker split across two
+    deltas still gets picked up. Output is collected in a buffer and written
+    out in one go every `flush_interval` seconds or `flush_size` characters,
+    instead of one print per formatting segment. Styles come from a table
+    like colors.STYLES, colors.active by default.
+
+    When the stream pauses, FLUSHER writes out what's left once
+    `flush_interval` has passed, rather than holding it until the next
+    delta arrives.
+    """
+
+    CODE_STYLE = "code"
+    BOLD_STYLE = "bold"
+    TEXT_STYLE = "green"
+
+    def __init__(self, out=None, flush_interval=0.03, flush_size=4096, styles=None):
+        self.out = out if out is not None else sys.stdout
+        self.styles = styles if styles is not None else colors.active
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+
+        self.in_code_block = False
+        self.in_bold = False
+        self.pending = ""  # tail of the last chunk that might be half a marker
+        self.buffer = []
+        self.buffered = 0
+        self.style = None  # style currently open in the buffer
+        self.last_flush = time.monotonic()
+        self.lock = threading.Lock()  # FLUSHER flushes from its own thread
+        self.scheduled = not math.isfinite(flush_interval)  # True: FLUSHER will look at us, or needn't
+
+    def feed(self, chunk):
+        """Render one delta. May or may not write to the terminal yet."""
+        with self.lock:
+            self.add(chunk)
+            self.maybe_flush()
+
+    def add(self, chunk):
+        text = self.pending + chunk
+        self.pending = ""
+
+        # Hold back trailing backticks/asterisks that could be the start of a
+        # marker finished by the next chunk
+        if text.endswith("`"):
+            hold = (len(text) - len(text.rstrip("`"))) % 3
+        elif text.endswith("*"):
+            hold = (len(text) - len(text.rstrip("*"))) % 2
+        else:
+            hold = 0
+        if hold:
+            self.pending = text[-hold:]
+            text = text[:-hold]
+
+        pos = 0
+        for match in MARKERS.finditer(text):
+            if match.start() > pos:
+                self.emit(text[pos:match.start()])
+            pos = match.end()
+
+            if match.group() == "```":
+                self.in_code_block = not self.in_code_block
+            elif self.in_code_block:
+                # ** means nothing inside code, keep it as is
+                self.emit("**")
+            else:
+                self.in_bold = not self.in_bold
+
+        if pos < len(text):
+            self.emit(text[pos:])
+
+    def maybe_flush(self):
+        if self.buffered >= self.flush_size or time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+        elif not self.scheduled and self.buffer:
+            self.scheduled = True
+            FLUSHER.schedule(self, self.last_flush + self.flush_interval)
+
+    def flush_if_idle(self):
+        """Called by FLUSHER: writes the buffer if no delta has flushed it for flush_interval."""
+        with self.lock:
+            self.scheduled = False
+            if self.buffer:
+                self.maybe_flush()
+
+    def emit(self, text):
+        if self.in_code_block:
+            style = self.CODE_STYLE
+        elif self.in_bold:
+            style = self.BOLD_STYLE
+        else:
+            style = self.TEXT_STYLE
+
+        if style != self.style:
+            if self.style is not None:
+                self.buffer.append(self.styles["reset"])
+            self.buffer.append(self.styles[style])
+            self.style = style
+
+        self.buffer.append(text)
+        self.buffered += len(text)
+
+    def flush(self):
+        """Write whatever is buffered, leaving the terminal style reset."""
+        if self.buffer:
+            if self.style is not None:
+                self.buffer.append(self.styles["reset"])
+                self.style = None
+            self.out.write("".join(self.buffer))
+            self.out.flush()
+            self.buffer = []
+            self.buffered = 0
+        self.last_flush = time.monotonic()
+
+    def finish(self):
+        """Render any held back characters and flush. Call once per response."""
+        with self.lock:
+            if self.pending:
+                self.emit(self.pending)
+                self.pending = ""
+            self.flush()
+            self.in_code_block = False
+            self.in_bold = False
+
+
+class PlainRenderer(MarkdownRenderer):
+    """Writes the answer as it comes, markdown and all, with no escape codes.
+
+    Same buffering as MarkdownRenderer, for output that goes to a pipe or
+    a file rather than a terminal.
+    """
+
+    def feed(self, chunk):
+        with self.lock:
+            self.buffer.append(chunk)
+            self.buffered += len(chunk)
+            self.maybe_flush()
+
+
+def render_text(text, out=None):
+    """Render a complete message in one go (used for history display)."""
+    renderer = MarkdownRenderer(out=out, flush_interval=float("inf"))
+    renderer.feed(text)
+    renderer.finish()
@@ -0,0 +1,204 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from types import SimpleNamespace
+
+
+CACHE_DIR = ".clarde_cache"
+# off: no caching. on: reuse answers to identical requests. record: always
+# ask the API and store every answer. replay: answer only from the cache,
+# a request that was never recorded is an error (offline runs, e.g. CI).
+MODES = ("off", "on", "record", "replay")
+MAX_MB = 200
+TTL_DAYS = 30
+# Request fields that don't change what comes back
+IGNORED_FIELDS = ("stream", "metadata", "extra_headers", "timeout")
+
+
+class CacheMiss(Exception):
+    """Replay mode was asked for something that was never recorded."""
+
+
+def normalize_content(content):
+    """Content as a list of blocks, without cache_control and with images hashed."""
+    if isinstance(content, str):
+        return [{"type": "text", "text": content}]
+    blocks = []
+    for block in content:
+        block = {k: v for k, v in block.items() if k != "cache_control"}
+        source = block.get("source")
+        if isinstance(source, dict) and source.get("type") == "base64":
+            block["source"] = {"type": "sha256", "media_type": source.get("media_type"),
+                               "hash": hashlib.sha256(source["data"].encode("ascii")).hexdigest()}
+        blocks.append(block)
+    return blocks
+
+
+def request_key(request, kind="stream"):
+    """Stable hash of a messages.create request.
+
+    Where the cache breakpoints are and whether a text is a plain string
+    or a one-block list doesn't change the answer, so neither changes the key.
+    """
+    normalized = {k: v for k, v in request.items() if k not in IGNORED_FIELDS}
+    normalized["messages"] = [{"role": m["role"], "content": normalize_content(m["content"])}
+                              for m in request["messages"]]
+    if isinstance(normalized.get("system"), list):
+        normalized["system"] = normalize_content(normalized["system"])
+    normalized["kind"] = kind
+    data = json.dumps(normalized, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+def to_plain(value):
+    """SDK objects (or replayed ones) as plain JSON-able data."""
+    if hasattr(value, "to_dict"):
+        return value.to_dict()
+    if isinstance(value, SimpleNamespace):
+        return {k: to_plain(v) for k, v in vars(value).items()}
+    if isinstance(value, list):
+        return [to_plain(v) for v in value]
+    return value
+
+
+def to_namespace(value):
+    """Recorded data back as objects with the attributes the SDK's have."""
+    if isinstance(value, dict):
+        return SimpleNamespace(**{k: to_namespace(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return [to_namespace(v) for v in value]
+    return value
+
+
+def configure_from_args(argv):
+    """Takes --cache, --record, --replay and --cache-dir DIR out of argv.
+
+    They're passed on through the environment, so batch mode and the
+    daemon pick them up like the interactive chat does.
+    """
+    rest = []
+    args = iter(argv)
+    for arg in args:
+        if arg in ("--cache", "--record", "--replay"):
+            os.environ["CLARDE_CACHE"] = "on" if arg == "--cache" else arg[2:]
+        elif arg == "--cache-dir":
+            os.environ["CLARDE_CACHE_DIR"] = next(args, CACHE_DIR)
+        else:
+            rest.append(arg)
+    return rest
+
+
+class ResponseCache:
+    """Opt-in on-disk cache of complete API answers.
+
+    Entries are JSON files named after request_key(); a streamed answer is
+    kept as the list of events it was made of, so a hit plays back through
+    the same code as a live response. Hits refresh the file's mtime, and
+    once the directory is over max_mb the least recently used entries go.
+    Entries older than ttl_days are not used in 'on' mode; recordings
+    ('record' and 'replay') never expire and are never evicted.
+
+    Set up from CLARDE_CACHE (one of MODES), CLARDE_CACHE_DIR,
+    CLARDE_CACHE_MAX_MB and CLARDE_CACHE_TTL_DAYS unless given explicitly.
+    """
+
+    def __init__(self, mode=None, directory=None, max_mb=None, ttl_days=None):
+        self.mode = mode or os.getenv("CLARDE_CACHE", "off")
+        if self.mode not in MODES:
+            self.mode = "off"
+        self.directory = directory or os.getenv("CLARDE_CACHE_DIR", CACHE_DIR)
+        self.max_bytes = float(max_mb if max_mb is not None else os.getenv("CLARDE_CACHE_MAX_MB", MAX_MB)) * 1024 * 1024
+        self.ttl = float(ttl_days if ttl_days is not None else os.getenv("CLARDE_CACHE_TTL_DAYS", TTL_DAYS)) * 86400
+        self.size = None  # bytes on disk, counted on the first write
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self):
+        return self.mode != "off"
+
+    @property
+    def writes(self):
+        return self.mode in ("on", "record")
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def get(self, key):
+        """The stored payload for key, or None. Raises CacheMiss in replay mode."""
+        if self.mode not in ("on", "replay"):
+            return None
+        path = self.path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            entry = None
+
+        if entry is not None and self.mode == "on" and self.ttl and time.time() - entry.get("created", 0) > self.ttl:
+            self.remove(path)
+            entry = None
+        if entry is None:
+            self.misses += 1
+            if self.mode == "replay":
+                raise CacheMiss(f"No recorded response for this request (key {key[:12]}) in {self.directory}")
+            return None
+
+        self.hits += 1
+        try:
+            os.utime(path)  # most recently used
+        except OSError:
+            pass
+        return entry["payload"]
+
+    def put(self, key, payload):
+        if not self.writes:
+            return
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = json.dumps({"created": time.time(), "payload": payload}, ensure_ascii=False)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(data)
+        with self.lock:
+            old = os.path.getsize(path) if os.path.exists(path) else 0
+            os.replace(tmp_path, path)
+            if self.mode == "on":
+                if self.size is None:
+                    self.size = sum(size for _, size, _ in self.entries())
+                else:
+                    self.size += len(data.encode('utf-8')) - old
+                if self.size > self.max_bytes:
+                    self.evict()
+
+    def entries(self):
+        """(path, size, mtime) of every entry."""
+        if not os.path.isdir(self.directory):
+            return
+        for shard in os.scandir(self.directory):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.endswith(".json"):
+                    stat = entry.stat()
+                    yield entry.path, stat.st_size, stat.st_mtime
+
+    def evict(self):
+        # Down to 90% in one go so we're not scanning on every write
+        target = self.max_bytes * 0.9
+        entries = sorted(self.entries(), key=lambda e: e[2])
+        self.size = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if self.size <= target:
+                break
+            self.remove(path)
+            self.size -= size
+
+    def remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,82 @@
+import importlib
+import threading
+
+
+def load_sdk():
+    """The anthropic module, imported on first use.
+
+    Importing it takes longer than the rest of startup put together, so no
+    module imports it at load time. After the first call it's just a
+    sys.modules lookup.
+    """
+    import anthropic
+    return anthropic
+
+
+def transport_errors():
+    """TransportError of the HTTP library the SDK streams over, as a tuple for isinstance().
+
+    That's httpx, or httpx2 in SDKs that moved to it. Imported by name, so
+    it doesn't depend on how the SDK's own classes are put together.
+    """
+    errors = []
+    for name in ("httpx", "httpx2"):
+        try:
+            errors.append(importlib.import_module(name).TransportError)
+        except ImportError:
+            pass
+    return tuple(errors)
+
+
+class LazyClient:
+    """A client that's built off the startup path.
+
+    start() calls factory (which imports the SDK and builds the client) on a
+    background thread, so it can happen while the user is still reading the
+    menu. get() waits for that, or builds the client right there if nobody
+    called start().
+    """
+
+    def __init__(self, factory):
+        self.factory = factory
+        self.client = None
+        self.error = None
+        self.thread = None
+        self.built = threading.Event()
+        self.lock = threading.Lock()
+
+    def start(self, then=None):
+        """Builds the client in the background, then calls then(client) on that thread."""
+        with self.lock:
+            if self.client is None and self.thread is None:
+                self.built.clear()
+                self.thread = threading.Thread(target=self.build, args=(then,), name="clarde-sdk", daemon=True)
+                self.thread.start()
+
+    def build(self, then=None):
+        try:
+            self.client = self.factory()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.built.set()
+        if then is not None and self.client is not None:
+            then(self.client)
+
+    @property
+    def ready(self):
+        return self.client is not None
+
+    def get(self):
+        if self.client is not None:
+            return self.client
+        self.start()
+        self.built.wait()
+        with self.lock:
+            error, self.error = self.error, None
+            if self.client is None:
+                # Let the next call try again instead of failing forever
+                self.thread = None
+        if error is not None:
+            raise error
+        return self.client
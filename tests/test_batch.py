@@ -0,0 +1,113 @@
+"""Batch mode against the stub API: retries through the shared transport, and resuming an output file."""
+import json
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+import batch
+from stub_server import start_stub_server
+
+
+@pytest.fixture
+def stub():
+    servers = []
+
+    def start(**options):
+        server = start_stub_server(retry_after=0.01, **options)
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture(autouse=True)
+def offline(monkeypatch):
+    monkeypatch.setenv("CLARDE_CACHE", "off")
+    monkeypatch.setenv("ANTHROPIC_API_KEY", "test-key")
+
+
+def write_jobs(path, count):
+    with open(path, 'w', encoding='utf-8') as f:
+        for i in range(count):
+            f.write(json.dumps({"id": f"q{i}", "prompt": f"question {i}"}) + "\n")
+
+
+def read_results(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f]
+
+
+def test_runs_every_job_in_order_through_rate_limits(stub, tmp_path):
+    server = stub(rate_limit_every=3)
+    jobs, out = str(tmp_path / "in.jsonl"), str(tmp_path / "out.jsonl")
+    write_jobs(jobs, 8)
+
+    assert batch.main([jobs, out, "--base-url", server.url, "-c", "4"]) == 0
+
+    results = read_results(out)
+    assert [r["id"] for r in results] == [f"q{i}" for i in range(8)]
+    assert [r["response"] for r in results] == [f"Echo: question {i}" for i in range(8)]
+    # Every third request was a 429 and had to be sent again
+    assert server.requests > 8
+
+
+def test_resume_drops_failed_and_torn_records(stub, tmp_path):
+    server = stub()
+    jobs, out = str(tmp_path / "in.jsonl"), str(tmp_path / "out.jsonl")
+    write_jobs(jobs, 4)
+    with open(out, 'w', encoding='utf-8') as f:
+        f.write(json.dumps({"id": "q0", "model": "m", "response": "kept"}) + "\n")
+        f.write(json.dumps({"id": "q1", "model": "m", "error": "overloaded"}) + "\n")
+        f.write('{"id": "q2", "model": "m", "resp')  # interrupted mid-write
+
+    assert batch.main([jobs, out, "--base-url", server.url]) == 0
+
+    results = read_results(out)
+    assert sorted(r["id"] for r in results) == ["q0", "q1", "q2", "q3"]
+    assert all("error" not in r for r in results)
+    assert results[0]["response"] == "kept"
+    # q0 wasn't asked again
+    assert server.requests == 3
+
+
+def test_failures_are_written_and_retried_on_the_next_run(stub, tmp_path):
+    jobs, out = str(tmp_path / "in.jsonl"), str(tmp_path / "out.jsonl")
+    write_jobs(jobs, 2)
+
+    overloaded = stub(overload_every=1)
+    assert batch.main([jobs, out, "--base-url", overloaded.url, "--max-retries", "0"]) == 1
+    assert all("error" in r for r in read_results(out))
+
+    assert batch.main([jobs, out, "--base-url", stub().url]) == 0
+    results = read_results(out)
+    assert [r["id"] for r in results] == ["q0", "q1"]
+    assert all("error" not in r for r in results)
+
+
+def test_resume_skips_records_without_an_id(stub, tmp_path):
+    server = stub()
+    jobs, out = str(tmp_path / "in.jsonl"), str(tmp_path / "out.jsonl")
+    write_jobs(jobs, 2)
+    with open(out, 'w', encoding='utf-8') as f:
+        f.write(json.dumps({"model": "m", "response": "whose?"}) + "\n")
+        f.write(json.dumps({"id": "q0", "model": "m", "response": "kept"}) + "\n")
+
+    assert batch.main([jobs, out, "--base-url", server.url]) == 0
+
+    assert [r["id"] for r in read_results(out)] == ["q0", "q1"]
+    assert server.requests == 1
+
+
+def test_rejects_concurrency_below_one(tmp_path):
+    jobs = str(tmp_path / "in.jsonl")
+    write_jobs(jobs, 1)
+    with pytest.raises(SystemExit):
+        batch.main([jobs, str(tmp_path / "out.jsonl"), "-c", "0"])
@@ -0,0 +1,91 @@
+"""Retrying and resuming of Transport streams, against the fault-injecting stub API."""
+import asyncio
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+from response_cache import ResponseCache
+from stub_server import start_stub_server
+from transport import AsyncTransport, Transport
+
+# Every 5 characters end in a space, so a stream cut off on a chunk
+# boundary has to resume from a prefill with its whitespace left out
+REPLY = "abcd " * 10
+REQUEST = {"model": "stub-model", "max_tokens": 100, "messages": [{"role": "user", "content": "hi"}]}
+
+
+@pytest.fixture
+def stub():
+    servers = []
+
+    def start(**options):
+        server = start_stub_server(reply=REPLY, chunk_size=5, retry_after=0.01, **options)
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def transport_for(server, cls=Transport, **options):
+    return cls("test-key", base_url=server.url, base_delay=0.01, cache=ResponseCache(mode="off"), **options)
+
+
+def text_of(events):
+    return "".join(event.delta.text for event in events
+                   if event.type == "content_block_delta" and getattr(event.delta, "text", None))
+
+
+def test_stream_without_faults(stub):
+    transport = transport_for(stub())
+    assert text_of(transport.stream(**REQUEST)) == REPLY
+    assert (transport.retries, transport.resumes) == (0, 0)
+
+
+def test_dropped_stream_is_resumed_without_repeating_whitespace(stub):
+    server = stub(drop_every=2)
+    transport = transport_for(server)
+    assert text_of(transport.stream(**REQUEST)) == REPLY
+    # The second stream breaks halfway, after "abcd " five times, and goes on from a prefill
+    assert text_of(transport.stream(**REQUEST)) == REPLY
+    assert (transport.retries, transport.resumes) == (0, 1)
+    assert server.requests == 3
+
+
+def test_retries_and_resumes_are_counted_apart(stub):
+    # Requests 1 and 2 go through, 3 is rate limited, 4 is cut off and 5 finishes it
+    server = stub(rate_limit_every=3, drop_every=4)
+    transport = transport_for(server)
+    for _ in range(3):
+        assert text_of(transport.stream(**REQUEST)) == REPLY
+    assert (transport.retries, transport.resumes) == (1, 1)
+    assert server.requests == 5
+
+
+def test_gives_up_after_max_resumes(stub):
+    transport = transport_for(stub(drop_every=1), max_resumes=2)
+    with pytest.raises(Exception):
+        text_of(transport.stream(**REQUEST))
+    assert transport.resumes == 2
+
+
+def test_async_stream_resumes_too(stub):
+    server = stub(rate_limit_every=3, drop_every=4)
+
+    async def run():
+        transport = transport_for(server, AsyncTransport)
+        texts = []
+        for _ in range(3):
+            texts.append(text_of([event async for event in transport.stream(**REQUEST)]))
+        return texts, transport
+
+    texts, transport = asyncio.run(run())
+    assert texts == [REPLY] * 3
+    assert (transport.retries, transport.resumes) == (1, 1)
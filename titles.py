@@ -0,0 +1,111 @@
+import asyncio
+import hashlib
+import re
+from collections import Counter
+from context import CHARS_PER_TOKEN, message_text
+
+
+TITLE_MODEL = "claude-3-haiku-20240307"
+# Longest title kept, so conversation_<title>.jsonl stays a valid file name
+MAX_TITLE = 50
+TITLE_PROMPT = "Below is an excerpt of a conversation. Generate a brief (2-5 words) title that captures the main topic. Return ONLY the title, no quotes or extra text.\n\n"
+
+STOPWORDS = set("""
+a about above after again all also am an and any are as at be because been before being below between both but by
+can could did do does doing down during each few for from further had has have having he her here hers him his how
+i if in into is it its itself just me more most my no nor not now of off on once only or other our out over own
+please same she should so some such than that the their them then there these they this those through to too under
+until up very was we were what when where which while who whom why will with would you your yours
+like want need make use using get help thanks thank hi hello hey okay ok yes sure know think one way
+""".split())
+
+
+def build_digest(history, max_tokens=400, last_turns=4):
+    """Short text-only excerpt: the first user message plus the last few turns.
+
+    Every part is cut down so the whole thing stays under max_tokens.
+    """
+    budget = max_tokens * CHARS_PER_TOKEN
+    first = next((message_text(m["content"]) for m in history if m["role"] == "user"), "")
+    recent = history[-last_turns:] if len(history) > 1 else []
+
+    per_part = budget // (len(recent) + 1)
+    parts = [f"user: {first[:per_part]}"]
+    for message in recent:
+        if message is history[0]:
+            continue
+        parts.append(f"{message['role']}: {message_text(message['content'])[:per_part]}")
+    return "\n\n".join(parts)[:budget]
+
+
+def fingerprint(digest):
+    return hashlib.sha1(digest.encode('utf-8')).hexdigest()
+
+
+def keyword_title(digest, words=3):
+    """Local fallback: the most frequent meaningful words of the digest."""
+    tokens = [t for t in re.findall(r"[a-zA-Z][a-zA-Z0-9]{2,}", digest.lower())
+              if t not in STOPWORDS and t not in ("user", "assistant")]
+    top = [word for word, _ in Counter(tokens).most_common(words)]
+    return "_".join(top) if top else None
+
+
+def clean_title(title, length=MAX_TITLE):
+    # Replace spaces with underscores and remove special characters
+    title = title.strip().replace(' ', '_')
+    title = ''.join(c for c in title if c.isalnum() or c == '_').lower()
+    if len(title) > length:
+        # Cut at the last word that fits, or mid-word if the first one doesn't
+        head = title[:length + 1]
+        cut = head.rsplit('_', 1)[0] if '_' in head else ""
+        title = (cut if cut.strip('_') else title[:length]).rstrip('_')
+    return title
+
+
+class TitleGenerator:
+    """Works out conversation titles from a bounded digest of the history.
+
+    Titles are cached against a fingerprint of the digest, so saving the same
+    conversation again doesn't call the API. If the API is slow or fails,
+    keyword_title() is used instead.
+    """
+
+    def __init__(self, create_message, timeout=8.0, metrics=None):
+        self.create_message = create_message  # coroutine function, e.g. BackgroundEngine.create_message
+        self.timeout = timeout
+        self.metrics = metrics
+        self.cache = {}
+
+    def cached(self, history):
+        return self.cache.get(fingerprint(build_digest(history)))
+
+    async def generate(self, history):
+        """Returns a title (without the conversation_ prefix) for history."""
+        digest = build_digest(history)
+        key = fingerprint(digest)
+        if key in self.cache:
+            return self.cache[key]
+
+        timer = self.metrics.start("title", TITLE_MODEL) if self.metrics else None
+        try:
+            response = await asyncio.wait_for(
+                self.create_message(
+                    model=TITLE_MODEL,
+                    max_tokens=20,
+                    messages=[{"role": "user", "content": TITLE_PROMPT + digest}]
+                ),
+                self.timeout
+            )
+            if timer:
+                timer.finish(response)
+            title = clean_title(response.content[0].text)
+        except Exception as e:
+            if timer:
+                timer.finish(error=str(e) or type(e).__name__)
+            title = None
+
+        if title:
+            self.cache[key] = title
+            return title
+        # Not cached, the API might be back next time
+        return keyword_title(digest)
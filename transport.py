@@ -0,0 +1,364 @@
+import asyncio
+import importlib.util
+import inspect
+import os
+import random
+import threading
+import time
+from types import SimpleNamespace
+from conversation import encode_body, plain_request
+from response_cache import ResponseCache, request_key, to_namespace, to_plain
+from sdk import LazyClient, load_sdk, transport_errors
+
+
+RETRY_STATUS = {429, 500, 502, 503, 529}
+# Error types the API can also send as an event in the middle of a stream
+RETRY_ERROR_TYPES = {"rate_limit_error", "overloaded_error", "api_error"}
+# Idle connections are kept this long, so one opened at the menu is still
+# there once the user has picked a model and typed their first message
+KEEPALIVE_SECONDS = 300
+# HTTP/2 needs the h2 package (pip install httpx[http2]), HTTP/1.1 keep-alive otherwise
+HTTP2 = importlib.util.find_spec("h2") is not None
+
+
+def retry_after(error):
+    try:
+        return float(error.response.headers.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def is_transient(error):
+    """True for rate limits, overloads, 5xx and dropped or reset connections."""
+    sdk = load_sdk()
+    if isinstance(error, sdk.APIStatusError):
+        body = error.body if isinstance(error.body, dict) else {}
+        kind = body.get("error", {}).get("type") if isinstance(body.get("error"), dict) else body.get("type")
+        return error.status_code in RETRY_STATUS or kind in RETRY_ERROR_TYPES
+    if isinstance(error, sdk.APIConnectionError):
+        return True
+    # A stream that breaks after the response started raises the HTTP
+    # library's own TransportError, the SDK only wraps errors before that
+    return isinstance(error, transport_errors())
+
+
+def accepts_raw_body(client):
+    """True if client.post() can send a body we encoded ourselves (newer SDKs)."""
+    return "content" in inspect.signature(client.post).parameters
+
+
+def keepalive_limits(sdk):
+    """The SDK's connection limits, with idle connections kept KEEPALIVE_SECONDS."""
+    defaults = sdk.DEFAULT_CONNECTION_LIMITS
+    return type(defaults)(max_connections=defaults.max_connections,
+                          max_keepalive_connections=defaults.max_keepalive_connections,
+                          keepalive_expiry=KEEPALIVE_SECONDS)
+
+
+class Transport:
+    """The chat's connection to the API.
+
+    One pooled keep-alive client (HTTP/2 when h2 is installed), built and
+    connected in the background by start() so the first message doesn't pay
+    for DNS, TCP and TLS. Transient errors are retried with jittered
+    backoff. A stream that breaks halfway is resumed: the request is sent
+    again with the text received so far as an assistant prefill, and the
+    rest of the answer streams on from there.
+
+    With the response cache on, repeated requests are answered from disk:
+    a cached stream is replayed event by event, starting with a synthetic
+    'cache_hit' event.
+    """
+
+    def __init__(self, api_key, base_url=None, max_retries=4, max_resumes=3, base_delay=0.5, max_delay=8.0,
+                 cache=None):
+        self.api_key = api_key
+        self.base_url = base_url or os.getenv("ANTHROPIC_BASE_URL")
+        self.max_retries = max_retries
+        self.max_resumes = max_resumes
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.client = LazyClient(self.build)
+        self.http = None
+        self.raw_body = False
+        self.warmed = threading.Event()
+        self.cache = cache or ResponseCache()
+        self.retries = 0
+        self.resumes = 0
+
+    def build(self):
+        sdk = load_sdk()
+        self.http = sdk.DefaultHttpxClient(http2=HTTP2, limits=keepalive_limits(sdk))
+        # We do the retrying ourselves, so a broken stream can be resumed
+        client = sdk.Anthropic(api_key=self.api_key, base_url=self.base_url, http_client=self.http, max_retries=0)
+        self.raw_body = accepts_raw_body(client)
+        return client
+
+    def stream_class(self, sdk):
+        return sdk.Stream
+
+    def send(self, client, request):
+        """messages.create, with the body joined from the messages' encoded JSON when the SDK allows.
+
+        That way a long history isn't walked and encoded again on every turn.
+        """
+        if not self.raw_body:
+            return client.messages.create(**plain_request(request))
+        sdk = load_sdk()
+        return client.post("/v1/messages", content=encode_body(request), cast_to=sdk.types.Message,
+                           stream=request.get("stream", False),
+                           stream_cls=self.stream_class(sdk)[sdk.types.RawMessageStreamEvent])
+
+    def start(self):
+        """Loads the SDK, builds the client and opens a connection, all in the background."""
+        if self.cache.mode == "replay":
+            # Offline, everything comes from the recordings
+            self.warmed.set()
+            return
+        self.client.start(then=self.warm)
+
+    def warm(self, client):
+        # Any answer will do, it's the connection left in the pool we're after
+        try:
+            self.http.head(str(client.base_url), timeout=5)
+        except Exception:
+            pass
+        finally:
+            self.warmed.set()
+
+    def backoff(self, attempt):
+        return min(self.max_delay, self.base_delay * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+    def retry_delay(self, error, attempt, resuming=False):
+        """Seconds to wait before the next try, or None to give up and raise."""
+        if not is_transient(error):
+            return None
+        if resuming:
+            if attempt >= self.max_resumes:
+                return None
+            self.resumes += 1
+            return self.backoff(attempt)
+        if attempt >= self.max_retries:
+            return None
+        self.retries += 1
+        return retry_after(error) or self.backoff(attempt)
+
+    def lookup(self, request, kind):
+        """Cache key for request (None with the cache off) and the cached answer, if any."""
+        if not self.cache.enabled:
+            return None, None
+        key = request_key(request, kind)
+        payload = self.cache.get(key)
+        if payload is None:
+            return key, None
+        if kind == "stream":
+            return key, [SimpleNamespace(type="cache_hit")] + [to_namespace(event) for event in payload]
+        return key, to_namespace(payload)
+
+    def remember(self, key, payload):
+        if key is None or not self.cache.writes:
+            return
+        try:
+            self.cache.put(key, payload)
+        except OSError:
+            pass  # a cache that can't be written is just a cache miss next time
+
+    def create(self, **request):
+        """messages.create without streaming, retried on transient errors."""
+        key, cached = self.lookup(request, "message")
+        if cached is not None:
+            return cached
+        attempt = 0
+        while True:
+            try:
+                response = self.send(self.client.get(), request)
+                self.remember(key, to_plain(response))
+                return response
+            except Exception as e:
+                delay = self.retry_delay(e, attempt)
+                if delay is None:
+                    raise
+                attempt += 1
+                time.sleep(delay)
+
+    def stream(self, **request):
+        """Streams messages.create, yielding its events as one unbroken response.
+
+        After a resume the new stream's events are passed on as they come,
+        including its own message_start, with any whitespace the prefill had
+        to drop taken off the front of the continuation.
+        """
+        key, cached = self.lookup(request, "stream")
+        if cached is not None:
+            yield from cached
+            return
+
+        recorded = []
+        resume = Resume(request)
+        attempts = {False: 0, True: 0}  # retries before any text, resumes after
+        while True:
+            try:
+                response = self.send(self.client.get(), dict(resume.request(), stream=True))
+                try:
+                    for event in response:
+                        event = resume.observe(event)
+                        if key is not None:
+                            recorded.append(to_plain(event))
+                        yield event
+                finally:
+                    # Closed early (Ctrl-C, a caller that stopped reading, an
+                    # error) means hanging up, so the rest isn't generated for nothing
+                    response.close()
+                self.remember(key, recorded)
+                return
+            except Exception as e:
+                resuming = resume.started
+                delay = self.retry_delay(e, attempts[resuming], resuming)
+                if delay is None:
+                    raise
+                attempts[resuming] += 1
+                time.sleep(delay)
+
+
+class AsyncTransport(Transport):
+    """Transport for asyncio code: same retries and resuming, on AsyncAnthropic.
+
+    Everything sharing one runs concurrently, so a 429 or 529 holds back
+    all of its requests until the retry-after time has passed, instead of
+    each one hammering the API on its own.
+
+    Build it inside the event loop that will use it, or call start() and
+    await warm_up() there.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.paused_until = 0.0  # loop time before which nothing is sent
+
+    async def wait_if_paused(self):
+        wait = self.paused_until - asyncio.get_running_loop().time()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def pause_for(self, error, delay):
+        if getattr(error, "status_code", None) in (429, 529):
+            self.paused_until = max(self.paused_until, asyncio.get_running_loop().time() + delay)
+
+    def build(self):
+        sdk = load_sdk()
+        self.http = sdk.DefaultAsyncHttpxClient(http2=HTTP2, limits=keepalive_limits(sdk))
+        client = sdk.AsyncAnthropic(api_key=self.api_key, base_url=self.base_url, http_client=self.http, max_retries=0)
+        self.raw_body = accepts_raw_body(client)
+        return client
+
+    def stream_class(self, sdk):
+        return sdk.AsyncStream
+
+    def start(self):
+        # The async client can't open a connection from another thread's loop
+        self.client.start()
+
+    async def get_client(self):
+        # Don't hold up the event loop while the SDK loads
+        if self.client.ready:
+            return self.client.client
+        return await asyncio.to_thread(self.client.get)
+
+    async def warm_up(self):
+        if self.cache.mode == "replay":
+            self.warmed.set()
+            return
+        client = await self.get_client()
+        try:
+            await self.http.head(str(client.base_url), timeout=5)
+        except Exception:
+            pass
+        finally:
+            self.warmed.set()
+
+    async def create(self, **request):
+        key, cached = self.lookup(request, "message")
+        if cached is not None:
+            return cached
+        attempt = 0
+        while True:
+            try:
+                await self.wait_if_paused()
+                client = await self.get_client()
+                response = await self.send(client, request)
+                self.remember(key, to_plain(response))
+                return response
+            except Exception as e:
+                delay = self.retry_delay(e, attempt)
+                if delay is None:
+                    raise
+                self.pause_for(e, delay)
+                attempt += 1
+                await asyncio.sleep(delay)
+
+    async def stream(self, **request):
+        key, cached = self.lookup(request, "stream")
+        if cached is not None:
+            for event in cached:
+                yield event
+            return
+
+        recorded = []
+        resume = Resume(request)
+        attempts = {False: 0, True: 0}
+        while True:
+            try:
+                await self.wait_if_paused()
+                client = await self.get_client()
+                response = await self.send(client, dict(resume.request(), stream=True))
+                try:
+                    async for event in response:
+                        event = resume.observe(event)
+                        if key is not None:
+                            recorded.append(to_plain(event))
+                        yield event
+                finally:
+                    # Cancelled (e.g. it lost a fan-out race) means hanging up too
+                    await response.close()
+                self.remember(key, recorded)
+                return
+            except Exception as e:
+                resuming = resume.started
+                delay = self.retry_delay(e, attempts[resuming], resuming)
+                if delay is None:
+                    raise
+                self.pause_for(e, delay)
+                attempts[resuming] += 1
+                await asyncio.sleep(delay)
+
+
+class Resume:
+    """Keeps the text of a stream so far, to pick it up again if it breaks."""
+
+    def __init__(self, request):
+        self.original = request
+        self.received = []
+        self.skip = 0  # whitespace already shown that the prefill had to leave out
+
+    @property
+    def started(self):
+        return bool(self.received)
+
+    def request(self):
+        text = "".join(self.received)
+        # The API rejects a prefill that ends in whitespace
+        prefill = text.rstrip()
+        self.skip = len(text) - len(prefill)
+        if not prefill:
+            return self.original
+        messages = list(self.original["messages"]) + [{"role": "assistant", "content": prefill}]
+        return dict(self.original, messages=messages)
+
+    def observe(self, event):
+        if event.type == "content_block_delta" and getattr(event.delta, "text", None):
+            if self.skip:
+                delta = event.delta.text
+                event.delta.text = delta[min(self.skip, len(delta) - len(delta.lstrip())):]
+                self.skip = 0
+            self.received.append(event.delta.text)
+        return event
@@ -0,0 +1,117 @@
+import codecs
+import os
+import sys
+from contextlib import contextmanager
+
+try:
+    import select
+    import termios
+except ImportError:  # Windows, the console keeps type-ahead on its own there
+    termios = None
+
+
+ERASE = ("\x7f", "\b")
+KILL = "\x15"  # Ctrl-U, clears the line
+
+
+class TypeAhead:
+    """Keeps what's typed while an answer is streaming, for the next prompt.
+
+    While capture() is on, the terminal stops echoing keys into the answer
+    being rendered and poll() collects them between events. A line finished
+    with Enter becomes the next input() as is, an unfinished one is put back
+    on the prompt to carry on editing. Does nothing unless stdin is a
+    terminal.
+    """
+
+    def __init__(self, stream=None):
+        self.stream = stream
+        self.fd = None
+        self.saved = None  # terminal settings to restore
+        self.lines = []
+        self.partial = ""
+        self.escape = False  # in the middle of an arrow key or similar
+        self.decoder = None
+
+    @contextmanager
+    def capture(self):
+        self.start()
+        try:
+            yield self
+        finally:
+            self.stop()
+
+    def start(self):
+        stream = self.stream or sys.stdin
+        if termios is None or not stream.isatty():
+            return
+        try:
+            self.fd = stream.fileno()
+            self.saved = termios.tcgetattr(self.fd)
+            attrs = termios.tcgetattr(self.fd)
+            # Keys come in one at a time and unechoed, Ctrl-C still sends SIGINT
+            attrs[3] &= ~(termios.ECHO | termios.ICANON)
+            attrs[6][termios.VMIN] = 1
+            attrs[6][termios.VTIME] = 0
+            termios.tcsetattr(self.fd, termios.TCSANOW, attrs)
+        except (OSError, ValueError, termios.error):
+            self.saved = None
+            return
+        self.decoder = codecs.getincrementaldecoder(getattr(stream, "encoding", None) or "utf-8")("replace")
+
+    def stop(self):
+        if self.saved is None:
+            return
+        try:
+            self.poll()
+        finally:
+            # TCSANOW, so nothing typed is flushed away
+            termios.tcsetattr(self.fd, termios.TCSANOW, self.saved)
+            self.saved = None
+
+    def poll(self):
+        """Reads whatever was typed since the last call, without waiting."""
+        if self.saved is None:
+            return
+        while select.select([self.fd], [], [], 0)[0]:
+            data = os.read(self.fd, 1024)
+            if not data:
+                break
+            self.feed(self.decoder.decode(data))
+
+    def feed(self, text):
+        for char in text:
+            if self.escape:
+                # Cursor keys and such are ESC [ ... letter, none of them are text
+                self.escape = not (char.isalpha() or char == "~")
+            elif char == "\x1b":
+                self.escape = True
+            elif char in "\r\n":
+                self.lines.append(self.partial)
+                self.partial = ""
+            elif char in ERASE:
+                self.partial = self.partial[:-1]
+            elif char == KILL:
+                self.partial = ""
+            elif char >= " " or char == "\t":
+                self.partial += char
+
+    def input(self, prompt=""):
+        """input(), starting from whatever was typed ahead."""
+        if self.lines:
+            line = self.lines.pop(0)
+            print(prompt + line)
+            return line
+        if not self.partial:
+            return input(prompt)
+        partial, self.partial = self.partial, ""
+        try:
+            import readline
+        except ImportError:
+            print(prompt + partial, end="", flush=True)
+            return partial + input()
+        readline.set_startup_hook(lambda: readline.insert_text(partial))
+        try:
+            return input(prompt)
+        finally:
+            readline.set_startup_hook()